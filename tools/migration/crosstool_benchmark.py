@@ -0,0 +1,83 @@
+"""Benchmark timing the phases of the migration tools on large CROSSTOOLs.
+
+For every combination of the requested toolchain and feature counts the script
+generates a CROSSTOOL exercising all legacy fields, times parsing it in the
+text and binary formats, migrate_legacy_fields, comparing the toolchains
+before and after the migration and serializing the migrated CROSSTOOL. The
+results are written as JSON, together with the Python and protobuf versions
+they were measured with.
+
+Passing the JSON written at another commit as --baseline prints how much
+slower or faster every phase got, so scaling regressions show up before they
+hit large CROSSTOOLs.
+
+Example usage:
+
+bazel run @rules_cc//tools/migration:crosstool_benchmark -- \
+--toolchain_counts=100,400 --feature_counts=50 --output=/tmp/after.json \
+--baseline=/tmp/before.json
+"""
+
+import json
+import sys
+from absl import app
+from absl import flags
+from tools.migration.crosstool_benchmark_lib import compare_results
+from tools.migration.crosstool_benchmark_lib import environment
+from tools.migration.crosstool_benchmark_lib import run_benchmark
+
+flags.DEFINE_list("toolchain_counts", ["10", "100"],
+                  "Numbers of toolchains per CROSSTOOL to benchmark.")
+flags.DEFINE_list("feature_counts", ["50"],
+                  "Numbers of features per toolchain to benchmark.")
+flags.DEFINE_integer("flag_sets", 1, "Number of flag sets per feature.",
+                     lower_bound=1)
+flags.DEFINE_integer("nesting_depth", 1,
+                     "Number of nested flag groups per flag set.",
+                     lower_bound=1)
+flags.DEFINE_integer("repetitions", 3,
+                     "How many times to repeat each measurement.",
+                     lower_bound=1)
+flags.DEFINE_string("output", None,
+                    "File to write the JSON results to, defaults to stdout.")
+flags.DEFINE_string(
+    "baseline", None,
+    "JSON results of an earlier run to compare the results with.")
+
+
+def main(unused_argv):
+  results = {"environment": environment(), "runs": []}
+  for toolchain_count in [int(count) for count in flags.FLAGS.toolchain_counts]:
+    for feature_count in [int(count) for count in flags.FLAGS.feature_counts]:
+      results["runs"].append(
+          run_benchmark(toolchain_count, feature_count, flags.FLAGS.flag_sets,
+                        flags.FLAGS.nesting_depth, flags.FLAGS.repetitions))
+
+  serialized_results = json.dumps(results, indent=2, separators=(",", ": "))
+  if flags.FLAGS.output:
+    with open(flags.FLAGS.output, "w") as f:
+      f.write(serialized_results + "\n")
+  else:
+    print(serialized_results)
+
+  if flags.FLAGS.baseline:
+    with open(flags.FLAGS.baseline) as f:
+      baseline = json.load(f)
+    # Keep stdout parseable as JSON when the results are printed there.
+    out = sys.stdout if flags.FLAGS.output else sys.stderr
+    if baseline.get("environment") != results["environment"]:
+      out.write("WARNING the baseline was measured with %s\n" %
+                json.dumps(baseline.get("environment"), sort_keys=True))
+    out.write("%10s %10s %10s %10s %18s %12s %12s %8s\n" %
+              ("toolchains", "features", "flag_sets", "nesting", "phase",
+               "baseline ms", "ms", "ratio"))
+    for run, phase, baseline_seconds, seconds in compare_results(
+        baseline, results):
+      out.write("%10d %10d %10d %10d %18s %12.3f %12.3f %8.2f\n" %
+                (run["toolchains"], run["features"], run["flag_sets"],
+                 run["nesting_depth"], phase, baseline_seconds * 1e3,
+                 seconds * 1e3, seconds / baseline_seconds))
+
+
+if __name__ == "__main__":
+  app.run(main)
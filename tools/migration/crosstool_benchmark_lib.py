@@ -0,0 +1,204 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing the synthetic CROSSTOOLs and phases of the benchmarks.
+
+make_crosstool generates CROSSTOOLs of a configurable size that exercise all
+legacy fields, run_benchmark times the phases of the migration tools on them:
+parsing, migrate_legacy_fields, comparing the toolchains before and after the
+migration and serialization. The results are JSON-serializable dicts, so that
+runs at different commits can be compared with compare_results.
+"""
+
+import collections
+import platform
+import timeit
+import google.protobuf
+from google.protobuf import text_format
+from google.protobuf.internal import api_implementation
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_io_lib import BINARY_FORMAT
+from tools.migration.crosstool_io_lib import TEXT_FORMAT
+from tools.migration.crosstool_io_lib import parse_proto
+from tools.migration.ctoolchain_comparator_lib import diff_ctoolchains
+from tools.migration.ctoolchain_comparator_lib import format_differences
+from tools.migration.ctoolchain_comparator_lib import pair_toolchains
+from tools.migration.legacy_fields_migration_lib import migrate_legacy_fields
+
+# Benchmarked phases in the order they are run.
+PHASES = [
+    "parse_text", "parse_binary", "migrate", "compare", "serialize_text",
+    "serialize_binary"
+]
+
+
+def make_crosstool(toolchain_count,
+                   feature_count,
+                   flag_set_count=1,
+                   nesting_depth=1):
+  """Returns a CROSSTOOL whose toolchains use all migrated legacy fields.
+
+  Every toolchain has feature_count features with flag_set_count flag sets
+  each. Every flag set has a chain of nesting_depth nested flag groups, all of
+  them with repeated expand_if_all_available fields to be migrated, the
+  innermost one with a flag.
+  """
+  crosstool = crosstool_config_pb2.CrosstoolRelease()
+  crosstool.major_version = "benchmark"
+  crosstool.minor_version = ""
+  for t in range(toolchain_count):
+    toolchain = crosstool.toolchain.add()
+    toolchain.toolchain_identifier = "toolchain-%d" % t
+    toolchain.host_system_name = "host"
+    toolchain.target_system_name = "target"
+    toolchain.target_cpu = "cpu"
+    toolchain.target_libc = "libc"
+    toolchain.compiler = "compiler"
+    toolchain.abi_version = "abi"
+    toolchain.abi_libc_version = "abi-libc"
+    toolchain.compiler_flag.append("-compiler-flag")
+    toolchain.cxx_flag.append("-cxx-flag")
+    toolchain.linker_flag.append("-linker-flag")
+    toolchain.dynamic_library_linker_flag.append("-dynamic-flag")
+    toolchain.unfiltered_cxx_flag.append("-unfiltered-flag")
+    toolchain.supports_start_end_lib = True
+    toolchain.supports_fission = True
+    toolchain.needsPic = True
+    for mode in crosstool_config_pb2.CompilationMode.values():
+      cmf = toolchain.compilation_mode_flags.add()
+      cmf.mode = mode
+      cmf.compiler_flag.append("-mode-compiler-flag")
+      cmf.linker_flag.append("-mode-linker-flag")
+    for mode in crosstool_config_pb2.LinkingMode.values():
+      lmf = toolchain.linking_mode_flags.add()
+      lmf.mode = mode
+      lmf.linker_flag.append("-linking-mode-flag")
+    feature = toolchain.feature.add()
+    feature.name = "legacy_compile_flags"
+    for f in range(feature_count):
+      feature = toolchain.feature.add()
+      feature.name = "feature-%d" % f
+      feature.implies.append("legacy_compile_flags")
+      for _ in range(flag_set_count):
+        flag_set = feature.flag_set.add()
+        flag_set.action.append("c++-compile")
+        flag_set.with_feature.add().feature.append("legacy_compile_flags")
+        flag_group = flag_set.flag_group.add()
+        flag_group.expand_if_all_available.extend(["foo", "bar"])
+        for _ in range(nesting_depth - 1):
+          flag_group = flag_group.flag_group.add()
+          flag_group.expand_if_all_available.extend(["foo", "bar"])
+        flag_group.flag.append("-flag-%d" % f)
+  return crosstool
+
+
+def run_benchmark(toolchain_count,
+                  feature_count,
+                  flag_set_count=1,
+                  nesting_depth=1,
+                  repetitions=3):
+  """Times the phases of the migration tools on a generated CROSSTOOL.
+
+  Returns a dict with the configuration of the run, the sizes of the serialized
+  CROSSTOOL and the best wall time in seconds of every phase out of the given
+  number of repetitions.
+  """
+  crosstool = make_crosstool(toolchain_count, feature_count, flag_set_count,
+                             nesting_depth)
+  run = collections.OrderedDict()
+  run["toolchains"] = toolchain_count
+  run["features"] = feature_count
+  run["flag_sets"] = flag_set_count
+  run["nesting_depth"] = nesting_depth
+  run.update(_time_phases(crosstool, repetitions))
+  return run
+
+
+def _time_phases(crosstool, repetitions):
+  """Returns the sizes of crosstool and the best times of all phases."""
+  text = text_format.MessageToString(crosstool)
+  binary = crosstool.SerializePartialToString()
+  migrated = crosstool_config_pb2.CrosstoolRelease()
+  migrated.CopyFrom(crosstool)
+  migrate_legacy_fields(migrated)
+  pairs, _, _ = pair_toolchains(crosstool, migrated)
+
+  def parse(data, input_format):
+    parse_proto(data, crosstool_config_pb2.CrosstoolRelease(), input_format)
+
+  def copy_crosstool():
+    copy = crosstool_config_pb2.CrosstoolRelease()
+    copy.CopyFrom(crosstool)
+    return copy
+
+  def compare():
+    for _, before, after in pairs:
+      format_differences(diff_ctoolchains(before, after))
+
+  seconds = collections.OrderedDict()
+  seconds["parse_text"] = _best_time(lambda _: parse(text, TEXT_FORMAT),
+                                     repetitions)
+  seconds["parse_binary"] = _best_time(lambda _: parse(binary, BINARY_FORMAT),
+                                       repetitions)
+  seconds["migrate"] = _best_time(migrate_legacy_fields, repetitions,
+                                  copy_crosstool)
+  seconds["compare"] = _best_time(lambda _: compare(), repetitions)
+  seconds["serialize_text"] = _best_time(
+      lambda _: text_format.MessageToString(migrated), repetitions)
+  seconds["serialize_binary"] = _best_time(
+      lambda _: migrated.SerializePartialToString(), repetitions)
+  return [("text_bytes", len(text)), ("binary_bytes", len(binary)),
+          ("seconds", seconds)]
+
+
+def _best_time(function, repetitions, setup=lambda: None):
+  """Returns the best time of calling function with the result of setup."""
+  timings = []
+  for _ in range(repetitions):
+    argument = setup()
+    start = timeit.default_timer()
+    function(argument)
+    timings.append(timeit.default_timer() - start)
+  return min(timings)
+
+
+def environment():
+  """Returns a dict describing the Python and protobuf runtime."""
+  return {
+      "python": platform.python_version(),
+      "protobuf": google.protobuf.__version__,
+      "protobuf_implementation": api_implementation.Type(),
+  }
+
+
+def run_key(run):
+  """Returns the tuple identifying the configuration of a benchmark run."""
+  return (run["toolchains"], run["features"], run["flag_sets"],
+          run["nesting_depth"])
+
+
+def compare_results(baseline, results):
+  """Yields (run, phase, baseline seconds, seconds) of runs in both results.
+
+  Both arguments are results as written by crosstool_benchmark, runs are
+  matched by their configuration.
+  """
+  baseline_runs = dict((run_key(run), run) for run in baseline["runs"])
+  for run in results["runs"]:
+    baseline_run = baseline_runs.get(run_key(run))
+    if baseline_run is None:
+      continue
+    for phase in PHASES:
+      if phase in baseline_run["seconds"] and phase in run["seconds"]:
+        yield (run, phase, baseline_run["seconds"][phase],
+               run["seconds"][phase])
@@ -0,0 +1,75 @@
+import json
+import unittest
+from tools.migration.crosstool_benchmark_lib import PHASES
+from tools.migration.crosstool_benchmark_lib import compare_results
+from tools.migration.crosstool_benchmark_lib import make_crosstool
+from tools.migration.crosstool_benchmark_lib import run_benchmark
+from tools.migration.legacy_fields_migration_lib import migrate_legacy_fields
+
+
+def nesting_depth(flag_group):
+  depth = 1
+  while flag_group.flag_group:
+    flag_group = flag_group.flag_group[0]
+    depth += 1
+  return depth
+
+
+class CrosstoolBenchmarkLibTest(unittest.TestCase):
+
+  def test_make_crosstool(self):
+    crosstool = make_crosstool(
+        toolchain_count=3, feature_count=4, flag_set_count=2, nesting_depth=3)
+    self.assertEqual(len(crosstool.toolchain), 3)
+    toolchain = crosstool.toolchain[0]
+    # The features and the legacy_compile_flags feature they imply.
+    self.assertEqual(len(toolchain.feature), 5)
+    feature = toolchain.feature[1]
+    self.assertEqual(len(feature.flag_set), 2)
+    self.assertEqual(nesting_depth(feature.flag_set[0].flag_group[0]), 3)
+
+  def test_make_crosstool_needs_migration(self):
+    crosstool = make_crosstool(
+        toolchain_count=1, feature_count=1, nesting_depth=2)
+    migrate_legacy_fields(crosstool)
+    feature, = [
+        f for f in crosstool.toolchain[0].feature if f.name == "feature-0"
+    ]
+    # Every level of repeated expands is nested once more.
+    self.assertEqual(nesting_depth(feature.flag_set[0].flag_group[0]), 4)
+
+  def test_run_benchmark(self):
+    run = run_benchmark(
+        toolchain_count=2, feature_count=3, flag_set_count=2, repetitions=1)
+    self.assertEqual(run["toolchains"], 2)
+    self.assertEqual(run["features"], 3)
+    self.assertEqual(run["flag_sets"], 2)
+    self.assertEqual(run["nesting_depth"], 1)
+    self.assertGreater(run["text_bytes"], run["binary_bytes"])
+    self.assertEqual(list(run["seconds"].keys()), PHASES)
+    for seconds in run["seconds"].values():
+      self.assertGreaterEqual(seconds, 0)
+    self.assertEqual(json.loads(json.dumps(run)), run)
+
+  def test_compare_results(self):
+
+    def run(toolchains, seconds):
+      return {
+          "toolchains": toolchains,
+          "features": 1,
+          "flag_sets": 1,
+          "nesting_depth": 1,
+          "seconds": {
+              "migrate": seconds
+          }
+      }
+
+    baseline = {"runs": [run(1, 1.0), run(2, 2.0)]}
+    results = {"runs": [run(2, 3.0), run(3, 1.0)]}
+    self.assertEqual(
+        list(compare_results(baseline, results)),
+        [(results["runs"][0], "migrate", 2.0, 3.0)])
+
+
+if __name__ == "__main__":
+  unittest.main()
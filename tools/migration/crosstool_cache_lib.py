@@ -0,0 +1,160 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing parse_proto_cached function and MessageCache class.
+
+parse_proto_cached parses text protos like crosstool_io_lib.parse_proto, but
+stores the parsed message in the binary format in an on-disk cache keyed by the
+SHA-256 of the input. Parsing the same text again only deserializes the cached
+binary proto, which is much faster than parsing the text format.
+
+MessageCache is the underlying cache, it maps arbitrary bytes to messages and
+is used by other tools to cache the results of deterministic transformations.
+
+The cache is bounded in size, least recently used entries are evicted first.
+"""
+
+import hashlib
+import os
+import tempfile
+from google.protobuf import message as proto_message
+from tools.migration.crosstool_io_lib import AUTO_FORMAT
+from tools.migration.crosstool_io_lib import BINARY_FORMAT
+from tools.migration.crosstool_io_lib import parse_proto
+from tools.migration.crosstool_io_lib import resolve_format
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+_CACHE_ENTRY_SUFFIX = ".pb"
+
+
+def default_cache_dir(name="crosstool"):
+  """Returns the cache directory, following the XDG base directory spec."""
+  cache_home = os.environ.get("XDG_CACHE_HOME")
+  if not cache_home:
+    cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(cache_home, "rules_cc", name)
+
+
+def parse_proto_cached(data,
+                       message,
+                       input_format=AUTO_FORMAT,
+                       cache_dir=None,
+                       max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+  """Merges serialized data into message, using the cache for text protos.
+
+  Failures to read or write the cache are not fatal, the data is then parsed
+  as if there was no cache.
+  """
+  input_format = resolve_format(data, input_format)
+  if input_format == BINARY_FORMAT:
+    return parse_proto(data, message, input_format)
+
+  cache = MessageCache(cache_dir or default_cache_dir(),
+                       message.DESCRIPTOR.full_name, max_cache_size)
+  if cache.get(data, message):
+    return input_format
+
+  parse_proto(data, message, input_format)
+  cache.put(data, message)
+  cache.evict()
+  return input_format
+
+
+class MessageCache(object):
+  """An on-disk cache of messages keyed by arbitrary bytes.
+
+  Entries are keyed by the SHA-256 of the namespace and of the key bytes, so
+  changing the namespace makes all previous entries unreachable, they are no
+  longer used and are evicted like any other least recently used entry.
+  Failures to read or write the cache are treated as cache misses.
+  """
+
+  def __init__(self, cache_dir, namespace,
+               max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+    self.cache_dir = cache_dir
+    self._namespace = namespace.encode("utf-8")
+    self._max_cache_size = max_cache_size
+
+  def get(self, key, message):
+    """Merges the entry of key into message, returns False on a cache miss."""
+    return _read_cache_entry(self._entry_path(key), message)
+
+  def put(self, key, message):
+    """Stores message as the entry of key."""
+    _write_cache_entry(self.cache_dir, self._entry_path(key), message)
+
+  def evict(self):
+    """Removes least recently used entries until the cache fits its size."""
+    _evict_cache_entries(self.cache_dir, self._max_cache_size)
+
+  def _entry_path(self, key):
+    digest = hashlib.sha256()
+    digest.update(self._namespace)
+    digest.update(b"\0")
+    digest.update(key)
+    return os.path.join(self.cache_dir,
+                        digest.hexdigest() + _CACHE_ENTRY_SUFFIX)
+
+
+def _read_cache_entry(entry_path, message):
+  """Merges the cached message into message, returns False on a cache miss."""
+  try:
+    with open(entry_path, "rb") as f:
+      cached = f.read()
+    # Mark the entry as recently used.
+    os.utime(entry_path, None)
+  except (IOError, OSError):
+    return False
+  try:
+    message.MergeFromString(cached)
+  except proto_message.DecodeError:
+    message.Clear()
+    return False
+  return True
+
+
+def _write_cache_entry(cache_dir, entry_path, message):
+  """Atomically stores message in the cache."""
+  try:
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+      f.write(message.SerializePartialToString())
+    os.rename(tmp_path, entry_path)
+  except (IOError, OSError):
+    pass
+
+
+def _evict_cache_entries(cache_dir, max_cache_size):
+  """Removes least recently used entries until the cache fits max_cache_size."""
+  entries = []
+  try:
+    for name in os.listdir(cache_dir):
+      if not name.endswith(_CACHE_ENTRY_SUFFIX):
+        continue
+      path = os.path.join(cache_dir, name)
+      stat = os.stat(path)
+      entries.append((stat.st_mtime, stat.st_size, path))
+  except OSError:
+    return
+  cache_size = sum(size for _, size, _ in entries)
+  for _, size, path in sorted(entries):
+    if cache_size <= max_cache_size:
+      break
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    cache_size -= size
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_cache_lib import MessageCache
+from tools.migration.crosstool_cache_lib import parse_proto_cached
+
+
+def make_crosstool_text(identifier):
+  return ("""
+      major_version: '123'
+      minor_version: '456'
+      toolchain { toolchain_identifier: '%s' }
+  """ % identifier).encode()
+
+
+def cache_entries(cache_dir):
+  return sorted(os.path.join(cache_dir, name) for name in os.listdir(cache_dir))
+
+
+class CrosstoolCacheLibTest(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def parse(self, data, max_cache_size=1024 * 1024):
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    parse_proto_cached(
+        data,
+        crosstool,
+        cache_dir=self.cache_dir,
+        max_cache_size=max_cache_size)
+    return crosstool
+
+  def test_parses_text(self):
+    crosstool = self.parse(make_crosstool_text("id-1"))
+    self.assertEqual(crosstool.toolchain[0].toolchain_identifier, "id-1")
+    self.assertEqual(len(cache_entries(self.cache_dir)), 1)
+
+  def test_cache_hit_skips_text_parsing(self):
+    data = make_crosstool_text("id-1")
+    self.parse(data)
+    entry, = cache_entries(self.cache_dir)
+    # Replace the cached proto to observe that it is used instead of the text.
+    cached = crosstool_config_pb2.CrosstoolRelease()
+    text_format.Merge(make_crosstool_text("cached"), cached)
+    with open(entry, "wb") as f:
+      f.write(cached.SerializePartialToString())
+    crosstool = self.parse(data)
+    self.assertEqual(crosstool.toolchain[0].toolchain_identifier, "cached")
+
+  def test_corrupted_entry_is_replaced(self):
+    data = make_crosstool_text("id-1")
+    self.parse(data)
+    entry, = cache_entries(self.cache_dir)
+    with open(entry, "wb") as f:
+      f.write(b"\xff\xff\xff")
+    crosstool = self.parse(data)
+    self.assertEqual(crosstool.toolchain[0].toolchain_identifier, "id-1")
+
+  def test_binary_input_is_not_cached(self):
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    text_format.Merge(make_crosstool_text("id-1"), crosstool)
+    parsed = self.parse(crosstool.SerializePartialToString())
+    self.assertEqual(parsed, crosstool)
+    self.assertEqual(cache_entries(self.cache_dir), [])
+
+  def test_least_recently_used_entries_are_evicted(self):
+    crosstool = self.parse(make_crosstool_text("id-1"))
+    entry_size = len(crosstool.SerializePartialToString())
+    first, = cache_entries(self.cache_dir)
+    os.utime(first, (1, 1))
+    self.parse(make_crosstool_text("id-2"))
+    second = [e for e in cache_entries(self.cache_dir) if e != first][0]
+    os.utime(second, (2, 2))
+    # Using the first entry makes the second one the least recently used.
+    self.parse(make_crosstool_text("id-1"))
+    self.parse(make_crosstool_text("id-3"), max_cache_size=2 * entry_size)
+    entries = cache_entries(self.cache_dir)
+    self.assertEqual(len(entries), 2)
+    self.assertIn(first, entries)
+    self.assertNotIn(second, entries)
+
+  def test_message_cache(self):
+    toolchain = crosstool_config_pb2.CToolchain(toolchain_identifier="id-1")
+    cache = MessageCache(self.cache_dir, "namespace")
+    cache.put(b"key", toolchain)
+    cached = crosstool_config_pb2.CToolchain()
+    self.assertTrue(cache.get(b"key", cached))
+    self.assertEqual(cached, toolchain)
+    self.assertFalse(cache.get(b"other key", crosstool_config_pb2.CToolchain()))
+    # Entries of other namespaces are not visible.
+    self.assertFalse(
+        MessageCache(self.cache_dir, "other namespace").get(
+            b"key", crosstool_config_pb2.CToolchain()))
+
+  def test_message_cache_eviction(self):
+    cache = MessageCache(self.cache_dir, "namespace", max_cache_size=0)
+    cache.put(b"key", crosstool_config_pb2.CToolchain(toolchain_identifier="x"))
+    self.assertEqual(len(cache_entries(self.cache_dir)), 1)
+    cache.evict()
+    self.assertEqual(cache_entries(self.cache_dir), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
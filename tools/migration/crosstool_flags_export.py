@@ -0,0 +1,139 @@
+"""Script exporting the flags every toolchain of a CROSSTOOL passes to actions.
+
+Every toolchain is expanded for every action of --actions, every combination
+of --compilation_modes and --linking_modes, and every variable set of
+--variables, see crosstool_flags_export_lib. The flags and environment are
+streamed as NDJSON, one object per toolchain, action, configuration and
+variable set, or written into a SQLite database with --output_format=sqlite.
+
+Toolchains whose features, action configs and legacy flag fields are the same
+are expanded once, features and action configs that toolchains have in common
+are expanded once per process. NDJSON rows are written as soon as a toolchain
+is expanded.
+"""
+
+import sys
+from absl import app
+from absl import flags
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_flags_export_lib import EXPORT_ACTIONS
+from tools.migration.crosstool_flags_export_lib import NdjsonExportWriter
+from tools.migration.crosstool_flags_export_lib import SqliteExportWriter
+from tools.migration.crosstool_flags_export_lib import export_toolchains
+from tools.migration.crosstool_io_lib import AUTO_FORMAT
+from tools.migration.crosstool_io_lib import FORMATS
+from tools.migration.crosstool_io_lib import map_file
+from tools.migration.crosstool_io_lib import parse_proto_streaming
+from tools.migration.semantic_comparator_lib import COMPILATION_MODE_FEATURES
+from tools.migration.semantic_comparator_lib import DEFAULT_VARIABLE_SETS
+from tools.migration.semantic_comparator_lib import LINKING_MODE_FEATURES
+from tools.migration.semantic_comparator_lib import mode_configurations
+from tools.migration.semantic_comparator_lib import parse_variable_sets
+from tools.migration.timings_lib import PhaseTimer
+from tools.migration.timings_lib import run_profiled
+
+NDJSON_FORMAT = "ndjson"
+SQLITE_FORMAT = "sqlite"
+
+flags.DEFINE_string("crosstool", None, "CROSSTOOL file path to be exported")
+flags.DEFINE_enum(
+    "input_format", AUTO_FORMAT, FORMATS,
+    "Format of the --crosstool file, 'auto' detects it from the file content.")
+flags.DEFINE_string(
+    "output", None,
+    "File to write the export to, NDJSON is written to stdout by default.")
+flags.DEFINE_enum("output_format", NDJSON_FORMAT,
+                  [NDJSON_FORMAT, SQLITE_FORMAT],
+                  "Format of the export, 'sqlite' requires --output.")
+flags.DEFINE_list("actions", EXPORT_ACTIONS, "Actions to expand.")
+flags.DEFINE_list("compilation_modes", COMPILATION_MODE_FEATURES,
+                  "Compilation mode features to request.")
+flags.DEFINE_list("linking_modes", LINKING_MODE_FEATURES,
+                  "Linking mode features to request.")
+flags.DEFINE_string(
+    "variables", None,
+    "JSON file mapping names of variable sets to objects of build variables "
+    "every action is expanded with, defaults to an empty set and a set of "
+    "common variables.")
+flags.DEFINE_integer(
+    "jobs", 1, "Number of processes expanding toolchains in parallel.",
+    lower_bound=1)
+flags.DEFINE_boolean(
+    "timings", False,
+    "Print the wall and CPU time of every phase, the peak RSS and the slowest "
+    "toolchains to stderr.")
+flags.DEFINE_integer(
+    "timings_top_n", 10,
+    "Number of the slowest toolchains to print with --timings.",
+    lower_bound=0)
+flags.DEFINE_string(
+    "profile", None,
+    "File to write a cProfile profile of the export to, in the pstats "
+    "format. Worker processes started by --jobs are not profiled.")
+
+
+def main(unused_argv):
+  timer = PhaseTimer(flags.FLAGS.timings, flags.FLAGS.timings_top_n)
+  try:
+    run_profiled(flags.FLAGS.profile, _export, timer)
+  finally:
+    timer.report()
+
+
+def _export(timer):
+  """Writes the flags of the toolchains of --crosstool to --output."""
+  crosstool = crosstool_config_pb2.CrosstoolRelease()
+
+  if not flags.FLAGS.crosstool:
+    raise app.UsageError("ERROR crosstool unspecified")
+  if flags.FLAGS.output_format == SQLITE_FORMAT and not flags.FLAGS.output:
+    raise app.UsageError("ERROR --output_format=sqlite requires --output")
+  if not flags.FLAGS.actions:
+    raise app.UsageError("ERROR actions unspecified")
+  configurations = mode_configurations(flags.FLAGS.compilation_modes,
+                                       flags.FLAGS.linking_modes)
+  variable_sets = DEFAULT_VARIABLE_SETS
+  if flags.FLAGS.variables:
+    try:
+      with open(flags.FLAGS.variables) as f:
+        variable_sets = parse_variable_sets(f.read())
+    except (IOError, ValueError) as e:
+      raise app.UsageError("ERROR invalid --variables: %s" % e)
+
+  with timer.phase("read"):
+    crosstool_data = map_file(flags.FLAGS.crosstool)
+  with timer.phase("parse"):
+    _, toolchains = parse_proto_streaming(crosstool_data, crosstool,
+                                          "toolchain", flags.FLAGS.input_format)
+  toolchains = timer.iterate("parse", toolchains)
+  exported = export_toolchains(toolchains, flags.FLAGS.actions, configurations,
+                               variable_sets, flags.FLAGS.jobs, timer)
+
+  if flags.FLAGS.output_format == SQLITE_FORMAT:
+    with SqliteExportWriter(flags.FLAGS.output) as writer:
+      counts = _write_all(writer, exported, timer)
+  elif flags.FLAGS.output:
+    with open(flags.FLAGS.output, "w") as f, NdjsonExportWriter(f) as writer:
+      counts = _write_all(writer, exported, timer)
+  else:
+    with NdjsonExportWriter(sys.stdout) as writer:
+      counts = _write_all(writer, exported, timer)
+  if flags.FLAGS.output:
+    print("Exported %d rows of %d toolchains, %d distinct toolchains were "
+          "expanded." % ((writer.rows,) + counts))  # pylint: disable=superfluous-parens
+
+
+def _write_all(writer, exported, timer):
+  """Writes the rows, returns the numbers of toolchains and distinct ones."""
+  toolchain_count = 0
+  fragment_count = 0
+  for exported_toolchain in exported:
+    with timer.phase("write"):
+      writer.write(exported_toolchain)
+    toolchain_count += 1
+    fragment_count = max(fragment_count, exported_toolchain.fragment + 1)
+  return toolchain_count, fragment_count
+
+
+if __name__ == "__main__":
+  app.run(main)
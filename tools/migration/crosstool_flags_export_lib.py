@@ -0,0 +1,343 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing export_toolchains function.
+
+export_toolchains expands the actions of every toolchain for every
+configuration of requested features and every variable set, like
+migration_validation_lib expands them before the migration. Toolchains only
+differing in fields that don't affect the expansion, like their identifiers,
+share an expansion fragment and are expanded once. Features and action
+configs that distinct fragments have in common are expanded once per process
+for the same enabled features and variables. The rows are written as NDJSON
+by NdjsonExportWriter or into a SQLite database by SqliteExportWriter.
+"""
+
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import timeit
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.legacy_fields_migration_lib import ALL_CC_COMPILE_ACTIONS
+from tools.migration.legacy_fields_migration_lib import ALL_CC_LINK_ACTIONS
+from tools.migration.legacy_fields_migration_lib import ALL_OBJC_COMPILE_ACTIONS
+from tools.migration.legacy_fields_migration_lib import ALL_OBJC_LINK_ACTIONS
+from tools.migration.legacy_fields_migration_lib import LEGACY_FIELDS
+from tools.migration.legacy_fields_migration_lib import is_migrated
+from tools.migration.migration_validation_lib import bazel_expander
+from tools.migration.semantic_comparator_lib import DEFAULT_CONFIGURATIONS
+from tools.migration.semantic_comparator_lib import DEFAULT_VARIABLE_SETS
+from tools.migration.timings_lib import PhaseTimer
+
+EXPORT_ACTIONS = (
+    ALL_CC_COMPILE_ACTIONS + ALL_OBJC_COMPILE_ACTIONS + ALL_CC_LINK_ACTIONS +
+    ALL_OBJC_LINK_ACTIONS)
+
+# CToolchain fields the expansion of a toolchain reads.
+_FRAGMENT_FIELDS = frozenset(
+    LEGACY_FIELDS + ["feature", "action_config", "test_only_linker_flag"])
+
+try:
+  # Python 2
+  _STRING_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+  # Python 3
+  _STRING_TYPES = (str,)
+
+# Number of toolchains per job read before sending their fragments to the
+# worker pool.
+_TOOLCHAINS_PER_JOB = 4
+
+# The caches of the expansions shared by the fragments a worker process
+# exports, see _init_worker.
+_worker_caches = None
+
+
+class ExportedToolchain(
+    collections.namedtuple("ExportedToolchain",
+                           ["toolchain_identifier", "fragment", "rows"])):
+  """The ExpansionRows of a toolchain.
+
+  fragment is the index of the distinct expansion fragment of the toolchain in
+  the order of its first toolchain, toolchains sharing a fragment share the
+  rows.
+  """
+  __slots__ = ()
+
+
+class ExpansionRow(
+    collections.namedtuple(
+        "ExpansionRow",
+        ["action", "configuration", "variables", "flags", "env", "error"])):
+  """The flags and environment of an action in a configuration.
+
+  env is a list of (key, value) tuples. When expanding the action fails,
+  flags and env are None and error is the message. When resolving the
+  features of the configuration fails, action and variables are None too, and
+  when the toolchain is invalid, e.g. defines a feature twice, there is only
+  a row with the error.
+  """
+  __slots__ = ()
+
+
+def expansion_fragment(toolchain):
+  """Returns a copy of the toolchain with only the fields its expansion reads.
+
+  Toolchains with equal fragments have equal expansions.
+  """
+  fragment = crosstool_config_pb2.CToolchain()
+  for field, value in toolchain.ListFields():
+    if field.name in _FRAGMENT_FIELDS:
+      if field.label == field.LABEL_REPEATED:
+        getattr(fragment, field.name).extend(value)
+      else:
+        setattr(fragment, field.name, value)
+  return fragment
+
+
+def export_fragment(fragment,
+                    actions=None,
+                    configurations=None,
+                    variable_sets=None,
+                    caches=None):
+  """Returns the ExpansionRows of the actions of the fragment.
+
+  The legacy fields of a toolchain that is not migrated are expanded the way
+  Bazel consumed them. Actions are expanded for every configuration and
+  variable set, also when the toolchain has no flags for them. caches is an
+  optional dict shared by the fragments exported with the same variable sets,
+  see ToolchainExpander.
+  """
+  actions = actions or EXPORT_ACTIONS
+  configurations = configurations or DEFAULT_CONFIGURATIONS
+  variable_sets = variable_sets or DEFAULT_VARIABLE_SETS
+  try:
+    expander = bazel_expander(
+        fragment, legacy_fields=not is_migrated(fragment), caches=caches)
+  except ValueError as e:
+    return [ExpansionRow(None, None, None, None, None, str(e))]
+  rows = []
+  for configuration, requested in configurations:
+    enabled, error = expander.solve(requested)
+    if error:
+      rows.append(ExpansionRow(None, configuration, None, None, None, error))
+      continue
+    for action in actions:
+      for variable_set, variables in variable_sets:
+        flags, env = expander.expand(action, requested, enabled, variable_set,
+                                     variables)
+        error = next((expansion for expansion in (flags, env)
+                      if isinstance(expansion, _STRING_TYPES)), None)
+        if error:
+          flags = env = None
+        rows.append(
+            ExpansionRow(action, configuration, variable_set, flags, env,
+                         error))
+  return rows
+
+
+def export_toolchains(toolchains,
+                      actions=None,
+                      configurations=None,
+                      variable_sets=None,
+                      jobs=1,
+                      timer=None):
+  """Yields the ExportedToolchain of every toolchain in order.
+
+  A toolchain is yielded as soon as its fragment is exported, the first
+  toolchain of every distinct fragment expands it, later toolchains reuse its
+  rows. With more than one job the toolchains are read in batches and the new
+  fragments of a batch are exported by a pool of worker processes. The
+  expansion is timed as the "export" phase of the timer, with the time of
+  every fragment recorded as an item named by its first toolchain.
+  """
+  timer = timer or PhaseTimer(enabled=False)
+  # Maps serialized fragments to their index and rows.
+  fragments = {}
+  if jobs <= 1:
+    caches = {}
+    for toolchain in toolchains:
+      identifier = toolchain.toolchain_identifier
+      key = expansion_fragment(toolchain).SerializePartialToString()
+      if key not in fragments:
+        with timer.phase("export", item=identifier):
+          rows = _export_serialized_fragment(
+              (key, actions, configurations, variable_sets), caches)[0]
+        fragments[key] = (len(fragments), rows)
+      yield ExportedToolchain(identifier, *fragments[key])
+    return
+  pool = multiprocessing.Pool(jobs, _init_worker)
+  try:
+    toolchains = iter(toolchains)
+    while True:
+      batch = list(itertools.islice(toolchains, jobs * _TOOLCHAINS_PER_JOB))
+      if not batch:
+        break
+      identifiers = [toolchain.toolchain_identifier for toolchain in batch]
+      keys = [
+          expansion_fragment(toolchain).SerializePartialToString()
+          for toolchain in batch
+      ]
+      new_keys = []
+      first_identifiers = []
+      for identifier, key in zip(identifiers, keys):
+        if key not in fragments and key not in new_keys:
+          new_keys.append(key)
+          first_identifiers.append(identifier)
+      with timer.phase("export"):
+        results = pool.map(_export_serialized_fragment,
+                           [(key, actions, configurations, variable_sets)
+                            for key in new_keys])
+      for key, identifier, (rows, seconds) in zip(new_keys, first_identifiers,
+                                                   results):
+        timer.record_item("export", identifier, seconds)
+        fragments[key] = (len(fragments), rows)
+      for identifier, key in zip(identifiers, keys):
+        yield ExportedToolchain(identifier, *fragments[key])
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _init_worker():
+  global _worker_caches
+  _worker_caches = {}
+
+
+def _export_serialized_fragment(arguments, caches=None):
+  """Returns the ExpansionRows of the fragment and the time it took.
+
+  caches defaults to the caches of the worker process.
+  """
+  start = timeit.default_timer()
+  serialized_fragment, actions, configurations, variable_sets = arguments
+  fragment = crosstool_config_pb2.CToolchain()
+  fragment.MergeFromString(serialized_fragment)
+  rows = export_fragment(fragment, actions, configurations, variable_sets,
+                         _worker_caches if caches is None else caches)
+  return rows, timeit.default_timer() - start
+
+
+def expansion_row_to_json(toolchain_identifier, row):
+  """Returns the JSON object of the row of the toolchain."""
+  return collections.OrderedDict([
+      ("toolchain_identifier", toolchain_identifier),
+      ("action", row.action),
+      ("configuration", row.configuration),
+      ("variables", row.variables),
+      ("flags", row.flags),
+      ("env", None if row.env is None else collections.OrderedDict(row.env)),
+      ("error", row.error),
+  ])
+
+
+class NdjsonExportWriter(object):
+  """Writes a JSON object per toolchain and row to a text stream.
+
+  The objects are those of expansion_row_to_json, one per line.
+  """
+
+  def __init__(self, stream):
+    self._stream = stream
+    self.rows = 0
+
+  def write(self, exported_toolchain):
+    """Writes the rows of the ExportedToolchain."""
+    identifier = exported_toolchain.toolchain_identifier
+    for row in exported_toolchain.rows:
+      self._stream.write(
+          json.dumps(expansion_row_to_json(identifier, row)) + "\n")
+      self.rows += 1
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self._stream.flush()
+
+
+_SQLITE_SCHEMA = """
+    CREATE TABLE fragments (id INTEGER PRIMARY KEY);
+    CREATE TABLE toolchains (
+        toolchain_identifier TEXT NOT NULL,
+        fragment INTEGER NOT NULL REFERENCES fragments(id));
+    CREATE TABLE expansions (
+        fragment INTEGER NOT NULL REFERENCES fragments(id),
+        action TEXT,
+        configuration TEXT,
+        variables TEXT,
+        flags TEXT,
+        env TEXT,
+        error TEXT);
+    CREATE INDEX expansions_by_fragment ON expansions (fragment, action);
+    CREATE VIEW effective_flags AS
+        SELECT toolchain_identifier, action, configuration, variables, flags,
+               env, error
+        FROM toolchains JOIN expansions USING (fragment);
+"""
+
+
+class SqliteExportWriter(object):
+  """Writes the rows into a new SQLite database.
+
+  The rows of every fragment are stored once in the expansions table when its
+  first toolchain is written and are referenced by the toolchains sharing it,
+  the effective_flags view joins them into a row per toolchain like NDJSON.
+  flags and env are stored as JSON. The database is written next to path and
+  moved over it when the writer is closed without an error.
+  """
+
+  def __init__(self, path):
+    self._path = path
+    fd, self._temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + ".")
+    os.close(fd)
+    self._connection = sqlite3.connect(self._temporary_path)
+    self._connection.executescript(_SQLITE_SCHEMA)
+    self._fragments = set()
+    self.rows = 0
+
+  def write(self, exported_toolchain):
+    """Writes the ExportedToolchain, and the rows of a new fragment."""
+    fragment = exported_toolchain.fragment
+    if fragment not in self._fragments:
+      self._fragments.add(fragment)
+      self._connection.execute("INSERT INTO fragments VALUES (?)", (fragment,))
+      self._connection.executemany(
+          "INSERT INTO expansions VALUES (?, ?, ?, ?, ?, ?, ?)",
+          [(fragment, row.action, row.configuration, row.variables,
+            None if row.flags is None else json.dumps(row.flags),
+            None if row.env is None else json.dumps(
+                collections.OrderedDict(row.env)), row.error)
+           for row in exported_toolchain.rows])
+    self._connection.execute(
+        "INSERT INTO toolchains VALUES (?, ?)",
+        (exported_toolchain.toolchain_identifier, fragment))
+    self.rows += len(exported_toolchain.rows)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, unused_value, unused_traceback):
+    if exc_type is None:
+      self._connection.commit()
+    self._connection.close()
+    if exc_type is None:
+      os.rename(self._temporary_path, self._path)
+    else:
+      os.remove(self._temporary_path)
@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_flags_export_lib import EXPORT_ACTIONS
+from tools.migration.crosstool_flags_export_lib import ExpansionRow
+from tools.migration.crosstool_flags_export_lib import ExportedToolchain
+from tools.migration.crosstool_flags_export_lib import NdjsonExportWriter
+from tools.migration.crosstool_flags_export_lib import SqliteExportWriter
+from tools.migration.crosstool_flags_export_lib import expansion_fragment
+from tools.migration.crosstool_flags_export_lib import export_fragment
+from tools.migration.crosstool_flags_export_lib import export_toolchains
+from tools.migration.legacy_fields_migration_lib import migrate_toolchain
+
+LEGACY_TOOLCHAIN = """
+    toolchain_identifier: 'legacy'
+    target_cpu: 'k8'
+    compiler_flag: '-compiler-flag'
+    compilation_mode_flags { mode: OPT compiler_flag: '-opt-compiler-flag' }
+    linker_flag: '-linker-flag'
+    linking_mode_flags { mode: FULLY_STATIC linker_flag: '-fully-static' }
+    tool_path { name: 'gcc' path: '/usr/bin/gcc' }
+    feature {
+      name: 'env'
+      enabled: true
+      env_set {
+        action: 'c-compile'
+        env_entry { key: 'PATH' value: '/bin' }
+      }
+    }
+"""
+
+CONFIGURATIONS = [("opt,fully_static_link", ["opt", "fully_static_link"])]
+
+VARIABLE_SETS = [("none", {})]
+
+
+def make_toolchain(toolchain_proto):
+  toolchain = crosstool_config_pb2.CToolchain()
+  text_format.Merge(toolchain_proto, toolchain)
+  return toolchain
+
+
+def export(toolchain, actions):
+  return export_fragment(toolchain, actions, CONFIGURATIONS, VARIABLE_SETS)
+
+
+class CrosstoolFlagsExportLibTest(unittest.TestCase):
+
+  def test_export_actions(self):
+    self.assertEqual(EXPORT_ACTIONS[:2], ["assemble", "preprocess-assemble"])
+    self.assertIn("objc++-compile", EXPORT_ACTIONS)
+    self.assertIn("objc-executable", EXPORT_ACTIONS)
+    self.assertEqual(len(EXPORT_ACTIONS), len(set(EXPORT_ACTIONS)))
+
+  def test_expansion_fragment(self):
+    toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    fragment = expansion_fragment(toolchain)
+    self.assertEqual(fragment.toolchain_identifier, "")
+    self.assertEqual(fragment.target_cpu, "")
+    self.assertEqual(len(fragment.tool_path), 0)
+    self.assertEqual(list(fragment.compiler_flag), ["-compiler-flag"])
+    self.assertEqual(fragment.feature, toolchain.feature)
+    self.assertEqual(
+        fragment,
+        expansion_fragment(
+            make_toolchain(
+                LEGACY_TOOLCHAIN.replace("'legacy'", "'other'").replace(
+                    "/usr/bin/gcc", "/opt/bin/gcc"))))
+
+  def test_legacy_and_migrated_toolchains_export_the_same_flags(self):
+    toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    migrated_toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    migrate_toolchain(migrated_toolchain)
+    actions = ["c-compile", "c++-link-executable"]
+    rows = export(toolchain, actions)
+    self.assertEqual(rows, export(migrated_toolchain, actions))
+    self.assertEqual(rows, [
+        ExpansionRow("c-compile", "opt,fully_static_link", "none",
+                     ["-compiler-flag", "-opt-compiler-flag"],
+                     [("PATH", "/bin")], None),
+        ExpansionRow("c++-link-executable", "opt,fully_static_link", "none",
+                     ["-linker-flag", "-fully-static"], [], None),
+    ])
+
+  def test_errors(self):
+    toolchain = make_toolchain("""
+        feature {
+          name: 'flags'
+          enabled: true
+          flag_set {
+            action: 'c-compile'
+            flag_group { flag: '-I%{include}' }
+          }
+        }
+        feature { name: 'a' provides: 'symbol' enabled: true }
+        feature { name: 'b' provides: 'symbol' }
+    """)
+    rows = export_fragment(toolchain, ["c-compile"],
+                           [("none", []), ("b", ["b"])], VARIABLE_SETS)
+    self.assertEqual([(row.action, row.configuration, row.flags)
+                      for row in rows], [("c-compile", "none", None),
+                                         (None, "b", None)])
+    self.assertIn("Cannot find variable named 'include'", rows[0].error)
+    self.assertIn("Symbol symbol is provided", rows[1].error)
+    rows = export(make_toolchain("feature { name: 'a' } feature { name: 'a' }"),
+                  ["c-compile"])
+    self.assertEqual(len(rows), 1)
+    self.assertIn("specified multiple times", rows[0].error)
+
+  def test_export_toolchains_deduplicates_fragments(self):
+    toolchains = [
+        make_toolchain(LEGACY_TOOLCHAIN.replace("'legacy'", "'%s'" % name))
+        for name in ["a", "b"]
+    ]
+    toolchains.insert(1, make_toolchain("toolchain_identifier: 'empty'"))
+    for jobs in [1, 2]:
+      exported = list(
+          export_toolchains(toolchains, ["c-compile"], CONFIGURATIONS,
+                            VARIABLE_SETS, jobs))
+      self.assertEqual([(e.toolchain_identifier, e.fragment) for e in exported],
+                       [("a", 0), ("empty", 1), ("b", 0)])
+      self.assertEqual(exported[0].rows, export(toolchains[0], ["c-compile"]))
+      self.assertEqual(exported[2].rows, exported[0].rows)
+
+  def test_export_toolchains_streams(self):
+
+    def toolchains():
+      yield make_toolchain("toolchain_identifier: 'a'")
+      raise ValueError("not read yet")
+
+    exported = export_toolchains(toolchains(), ["c-compile"], CONFIGURATIONS,
+                                 VARIABLE_SETS)
+    self.assertEqual(next(exported).toolchain_identifier, "a")
+
+  def test_shared_caches(self):
+    toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    other_toolchain = make_toolchain(LEGACY_TOOLCHAIN + """
+        feature {
+          name: 'other'
+          enabled: true
+          flag_set { action: 'c-compile' flag_group { flag: '-other' } }
+        }
+    """)
+    caches = {}
+    rows = export_fragment(toolchain, ["c-compile"], CONFIGURATIONS,
+                           VARIABLE_SETS, caches)
+    self.assertEqual(rows, export(toolchain, ["c-compile"]))
+    entries = sum(len(cache) for cache in caches.values())
+    rows = export_fragment(other_toolchain, ["c-compile"], CONFIGURATIONS,
+                           VARIABLE_SETS, caches)
+    self.assertEqual(rows, export(other_toolchain, ["c-compile"]))
+    self.assertEqual(rows[0].flags[-1], "-other")
+    # Only the flags of the feature 'other' are new.
+    self.assertEqual(sum(len(cache) for cache in caches.values()), entries + 1)
+
+  def test_ndjson_writer(self):
+    stream = tempfile.TemporaryFile("w+")
+    self.addCleanup(stream.close)
+    rows = export(make_toolchain(LEGACY_TOOLCHAIN), ["c-compile"])
+    with NdjsonExportWriter(stream) as writer:
+      writer.write(ExportedToolchain("a", 0, rows))
+      writer.write(ExportedToolchain("b", 0, rows))
+    self.assertEqual(writer.rows, 2)
+    stream.seek(0)
+    lines = stream.read().splitlines()
+    self.assertEqual(len(lines), 2)
+    self.assertEqual(
+        json.loads(lines[1]), {
+            "toolchain_identifier": "b",
+            "action": "c-compile",
+            "configuration": "opt,fully_static_link",
+            "variables": "none",
+            "flags": ["-compiler-flag", "-opt-compiler-flag"],
+            "env": {
+                "PATH": "/bin"
+            },
+            "error": None,
+        })
+
+  def test_sqlite_writer(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, "flags.db")
+    rows = export(make_toolchain(LEGACY_TOOLCHAIN), ["c-compile"])
+    with SqliteExportWriter(path) as writer:
+      writer.write(ExportedToolchain("a", 0, rows))
+      writer.write(ExportedToolchain("c", 1, []))
+      writer.write(ExportedToolchain("b", 0, rows))
+    self.assertEqual(writer.rows, 2)
+    self.assertEqual(os.listdir(directory), ["flags.db"])
+    connection = sqlite3.connect(path)
+    self.addCleanup(connection.close)
+    self.assertEqual(
+        connection.execute("SELECT COUNT(*) FROM expansions").fetchone(), (1,))
+    self.assertEqual(
+        connection.execute(
+            "SELECT toolchain_identifier, action, flags, env FROM "
+            "effective_flags ORDER BY toolchain_identifier").fetchall(),
+        [("a", "c-compile", '["-compiler-flag", "-opt-compiler-flag"]',
+          '{"PATH": "/bin"}'),
+         ("b", "c-compile", '["-compiler-flag", "-opt-compiler-flag"]',
+          '{"PATH": "/bin"}')])
+    with self.assertRaises(ValueError):
+      with SqliteExportWriter(path):
+        raise ValueError("failed")
+    self.assertEqual(os.listdir(directory), ["flags.db"])
+
+
+if __name__ == "__main__":
+  unittest.main()
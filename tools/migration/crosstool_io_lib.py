@@ -0,0 +1,384 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing reading and writing of CROSSTOOL protos.
+
+Protos can be stored either in the text format or in the binary (wire) format.
+When the format is "auto", it is detected from the content of the input.
+
+parse_proto_streaming and StreamingProtoWriter process the elements of a
+top-level repeated field (e.g. the toolchains of a CROSSTOOL) one at a time, so
+that only a single element has to be held in memory as a parsed message.
+
+Data can be passed as bytes or as the read-only memory map returned by
+map_file, binary protos are then parsed directly from the mapped pages.
+"""
+
+import mmap
+import os
+import re
+import tempfile
+from google.protobuf import descriptor
+from google.protobuf import message as proto_message
+from google.protobuf import text_format
+
+TEXT_FORMAT = "text"
+BINARY_FORMAT = "binary"
+AUTO_FORMAT = "auto"
+
+FORMATS = [AUTO_FORMAT, TEXT_FORMAT, BINARY_FORMAT]
+
+# Number of leading bytes inspected when detecting the format.
+_DETECTION_PREFIX_SIZE = 4096
+
+# Control characters that can legitimately appear in a text proto.
+_TEXT_WHITESPACE = frozenset(bytearray(b"\t\n\v\f\r"))
+
+
+def detect_format(data):
+  """Returns TEXT_FORMAT or BINARY_FORMAT depending on the content of data.
+
+  Binary protos contain length prefixes and tags that are almost always
+  unprintable, while text protos only contain printable characters and
+  whitespace.
+  """
+  for byte in bytearray(data[:_DETECTION_PREFIX_SIZE]):
+    if (byte < 0x20 and byte not in _TEXT_WHITESPACE) or byte == 0x7f:
+      return BINARY_FORMAT
+  return TEXT_FORMAT
+
+
+def resolve_format(data, proto_format):
+  """Returns the concrete format of data, detecting it for AUTO_FORMAT."""
+  if proto_format == AUTO_FORMAT:
+    return detect_format(data)
+  return proto_format
+
+
+def read_file(path):
+  """Returns the raw content of the file at path."""
+  with open(path, "rb") as f:
+    return f.read()
+
+
+def map_file(path):
+  """Returns the raw content of the file at path as a read-only memory map.
+
+  The content is not copied into the process, the pages of the file are loaded
+  on demand and shared by all processes mapping it. Files that can't be mapped,
+  like empty files or pipes, are read into bytes instead.
+  """
+  with open(path, "rb") as f:
+    try:
+      return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+      return f.read()
+
+
+try:
+  buffer  # pylint: disable=pointless-statement
+
+  def _view(data, start, end):
+    # Python 2 memory maps only support the old buffer interface.
+    return buffer(data, start, end - start)  # pylint: disable=undefined-variable
+except NameError:
+
+  def _view(data, start, end):
+    return memoryview(data)[start:end]
+
+
+def _as_bytes(data):
+  # The text format parser needs bytes, slicing copies memory maps into bytes
+  # and returns bytes unchanged.
+  return data[:]
+
+
+def parse_proto(data, message, input_format=AUTO_FORMAT):
+  """Merges serialized data into message and returns the format it used.
+
+  Raises text_format.ParseError or google.protobuf.message.DecodeError when data
+  is not a valid proto of the message type.
+  """
+  input_format = resolve_format(data, input_format)
+  if input_format == BINARY_FORMAT:
+    # Merging does not enforce required fields, just like text_format.Merge.
+    message.MergeFromString(_view(data, 0, len(data)))
+  else:
+    text_format.Merge(_as_bytes(data), message)
+  return input_format
+
+
+def write_proto_file(path, message, output_format):
+  """Writes message to the file at path in the given format."""
+  if output_format == BINARY_FORMAT:
+    with open(path, "wb") as f:
+      f.write(message.SerializePartialToString())
+  else:
+    with open(path, "w") as f:
+      f.write(text_format.MessageToString(message))
+
+
+def parse_proto_streaming(data, message, field_name, input_format=AUTO_FORMAT):
+  """Parses data into message, except for the elements of field_name.
+
+  field_name has to be a repeated message field of message. Its elements are
+  located in data without parsing them and are parsed one at a time when
+  iterating over the returned generator, all other fields are merged into
+  message right away.
+
+  Returns a tuple of the format of data and the generator of the parsed
+  elements. Binary elements are parsed from views of data and text elements
+  from slices of it, so the data is never copied as a whole. Raises
+  text_format.ParseError or google.protobuf.message.DecodeError when data is
+  not a valid proto of the message type.
+  """
+  input_format = resolve_format(data, input_format)
+  field = message.DESCRIPTOR.fields_by_name[field_name]
+  if input_format == BINARY_FORMAT:
+    header, spans = _split_binary(data, field.number)
+    message.MergeFromString(header)
+    return input_format, _parse_binary_elements(data, spans,
+                                                _element_class(message, field))
+
+  split = _split_text(data, field_name)
+  if split is not None:
+    header, spans = split
+    try:
+      text_format.Merge(header, message)
+      if not getattr(message, field_name):
+        return input_format, _parse_text_elements(data, spans, message, field)
+    except text_format.ParseError:
+      pass
+    message.Clear()
+  # The text could not be split reliably or contains errors, parse it as a
+  # whole to get the same result and errors as parse_proto.
+  text_format.Merge(_as_bytes(data), message)
+  elements = list(getattr(message, field_name))
+  message.ClearField(field_name)
+  return input_format, iter(elements)
+
+
+def _element_class(message, field):
+  # Adding to the field of a scratch message is the portable way of getting to
+  # the class of the elements across all protobuf implementations.
+  return getattr(message.__class__(), field.name).add().__class__
+
+
+def _parse_binary_elements(data, spans, element_class):
+  for start, end in spans:
+    element = element_class()
+    element.MergeFromString(_view(data, start, end))
+    yield element
+
+
+def _parse_text_elements(data, spans, message, field):
+  element_class = _element_class(message, field)
+  for start, end, is_list in spans:
+    try:
+      if is_list:
+        container = message.__class__()
+        text_format.Merge(data[start:end], container)
+        for element in getattr(container, field.name):
+          yield element
+      else:
+        element = element_class()
+        text_format.Merge(data[start:end], element)
+        yield element
+    except text_format.ParseError:
+      # Parse the whole input to report the error with its real position.
+      text_format.Merge(_as_bytes(data), message.__class__())
+      raise
+
+
+# Tokens of the text format relevant for finding the top-level fields: string
+# literals and comments (which may contain anything), brackets and field names.
+_TEXT_TOKEN_RE = re.compile(br"""("(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'"""
+                            br"""|#[^\n]*|[{}<>\[\]]|[A-Za-z_][\w.]*)""")
+_OPENING_BRACKETS = frozenset([b"{", b"<", b"["])
+_CLOSING_BRACKETS = frozenset([b"}", b">", b"]"])
+
+
+def _split_text(data, field_name):
+  """Splits a text proto into the top-level elements of field_name and the rest.
+
+  Returns a tuple of the text without the elements and a list of (start, end,
+  is_list) spans of data. Spans of single elements cover the content between
+  the braces, spans of list values ("field_name: [{...}, {...}]") cover the
+  whole field. Returns None when data is not well-formed enough to be split.
+  """
+  field_name = field_name.encode("ascii")
+  header_parts = []
+  spans = []
+  header_start = 0
+  depth = 0
+  # Start of the field name and end of the opening bracket of the element
+  # currently being scanned.
+  element_start = None
+  content_start = None
+  field_name_end = None
+  for match in _TEXT_TOKEN_RE.finditer(data):
+    token = match.group()
+    if token in _OPENING_BRACKETS:
+      if depth == 0 and field_name_end is not None:
+        if data[field_name_end:match.start()].strip() not in (b"", b":"):
+          return None
+        element_start = field_name_end - len(field_name)
+        content_start = match.end()
+        is_list = token == b"["
+      depth += 1
+    elif token in _CLOSING_BRACKETS:
+      depth -= 1
+      if depth < 0:
+        return None
+      if depth == 0 and element_start is not None:
+        header_parts.append(data[header_start:element_start])
+        if is_list:
+          spans.append((element_start, match.end(), True))
+        else:
+          spans.append((content_start, match.start(), False))
+        header_start = match.end()
+        element_start = None
+    field_name_end = (
+        match.end() if depth == 0 and token == field_name else None)
+  if depth != 0:
+    return None
+  header_parts.append(data[header_start:])
+  return b"".join(header_parts), spans
+
+
+def _split_binary(data, field_number):
+  """Splits a binary proto into the elements of field_number and the rest.
+
+  Returns a tuple of the serialized proto without the elements and a list of
+  (start, end) spans of the serialized elements in data.
+  """
+  header_parts = []
+  spans = []
+  position = 0
+  while position < len(data):
+    tag, value_start = _decode_varint(data, position)
+    wire_type = tag & 7
+    if wire_type == 0:
+      _, end = _decode_varint(data, value_start)
+    elif wire_type == 1:
+      end = value_start + 8
+    elif wire_type == 2:
+      length, value_start = _decode_varint(data, value_start)
+      end = value_start + length
+      if tag >> 3 == field_number:
+        if end > len(data):
+          raise proto_message.DecodeError("Truncated message.")
+        spans.append((value_start, end))
+        position = end
+        continue
+    elif wire_type == 5:
+      end = value_start + 4
+    else:
+      raise proto_message.DecodeError("Unsupported wire type %d." % wire_type)
+    if end > len(data):
+      raise proto_message.DecodeError("Truncated message.")
+    header_parts.append(data[position:end])
+    position = end
+  return b"".join(header_parts), spans
+
+
+def _decode_varint(data, position):
+  """Returns the varint at position in data and the position after it."""
+  result = 0
+  shift = 0
+  for byte in bytearray(data[position:position + 10]):
+    position += 1
+    result |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return result, position
+    shift += 7
+  raise proto_message.DecodeError("Truncated or invalid varint.")
+
+
+def _encode_varint(value):
+  result = bytearray()
+  while value > 0x7f:
+    result.append((value & 0x7f) | 0x80)
+    value >>= 7
+  result.append(value)
+  return bytes(result)
+
+
+def _file_mode(path):
+  """Returns the permissions of the file at path or the default ones."""
+  try:
+    return os.stat(path).st_mode & 0o777
+  except OSError:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class StreamingProtoWriter(object):
+  """Writes a message followed by the elements of its repeated field one by one.
+
+  The output is the same as writing the message with all elements at once, as
+  long as field_name has the highest field number of the message. The file is
+  written next to path and moved over it when the writer is closed without an
+  error, so path may also be the file the elements are being read from.
+
+  Use as a context manager:
+
+    with StreamingProtoWriter(path, message, "toolchain", TEXT_FORMAT) as w:
+      for toolchain in toolchains:
+        w.write(toolchain)
+  """
+
+  def __init__(self, path, message, field_name, output_format):
+    field = message.DESCRIPTOR.fields_by_name[field_name]
+    if (field.label != descriptor.FieldDescriptor.LABEL_REPEATED or
+        field.message_type is None):
+      raise ValueError("%s is not a repeated message field" % field_name)
+    self._path = path
+    self._field_name = field_name
+    self._output_format = output_format
+    self._tag = _encode_varint(field.number << 3 | 2)
+    fd, self._temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + ".")
+    os.chmod(self._temporary_path, _file_mode(path))
+    self._file = os.fdopen(fd,
+                           "wb" if output_format == BINARY_FORMAT else "w")
+    header = message.__class__()
+    header.CopyFrom(message)
+    header.ClearField(field_name)
+    if output_format == BINARY_FORMAT:
+      self._file.write(header.SerializePartialToString())
+    else:
+      self._file.write(text_format.MessageToString(header))
+
+  def write(self, element):
+    """Appends an element of the repeated field to the output."""
+    if self._output_format == BINARY_FORMAT:
+      serialized = element.SerializePartialToString()
+      self._file.write(self._tag)
+      self._file.write(_encode_varint(len(serialized)))
+      self._file.write(serialized)
+    else:
+      text = text_format.MessageToString(element, indent=2)
+      self._file.write("%s {\n%s}\n" % (self._field_name, text))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self._file.close()
+    if exc_type is None:
+      os.rename(self._temporary_path, self._path)
+    else:
+      os.remove(self._temporary_path)
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_io_lib import AUTO_FORMAT
+from tools.migration.crosstool_io_lib import BINARY_FORMAT
+from tools.migration.crosstool_io_lib import StreamingProtoWriter
+from tools.migration.crosstool_io_lib import TEXT_FORMAT
+from tools.migration.crosstool_io_lib import detect_format
+from tools.migration.crosstool_io_lib import map_file
+from tools.migration.crosstool_io_lib import parse_proto
+from tools.migration.crosstool_io_lib import parse_proto_streaming
+from tools.migration.crosstool_io_lib import read_file
+from tools.migration.crosstool_io_lib import write_proto_file
+
+
+def make_crosstool(string):
+  crosstool = crosstool_config_pb2.CrosstoolRelease()
+  text_format.Merge(string, crosstool)
+  return crosstool
+
+
+class CrosstoolIoLibTest(unittest.TestCase):
+
+  def setUp(self):
+    self.crosstool = make_crosstool("""
+        major_version: '123'
+        minor_version: '456'
+        toolchain {
+          toolchain_identifier: 'id-1'
+          compiler_flag: 'flag-1'
+          feature { name: 'feature-1' enabled: true }
+        }
+        toolchain {
+          toolchain_identifier: 'id-2'
+        }
+    """)
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_detect_format(self):
+    self.assertEqual(
+        detect_format(text_format.MessageToString(self.crosstool).encode()),
+        TEXT_FORMAT)
+    self.assertEqual(
+        detect_format(self.crosstool.SerializePartialToString()),
+        BINARY_FORMAT)
+    self.assertEqual(detect_format(b""), TEXT_FORMAT)
+
+  def test_parse_text(self):
+    data = text_format.MessageToString(self.crosstool).encode()
+    for input_format in [AUTO_FORMAT, TEXT_FORMAT]:
+      crosstool = crosstool_config_pb2.CrosstoolRelease()
+      self.assertEqual(
+          parse_proto(data, crosstool, input_format), TEXT_FORMAT)
+      self.assertEqual(crosstool, self.crosstool)
+
+  def test_parse_binary(self):
+    data = self.crosstool.SerializePartialToString()
+    for input_format in [AUTO_FORMAT, BINARY_FORMAT]:
+      crosstool = crosstool_config_pb2.CrosstoolRelease()
+      self.assertEqual(
+          parse_proto(data, crosstool, input_format), BINARY_FORMAT)
+      self.assertEqual(crosstool, self.crosstool)
+
+  def test_write_and_read_roundtrip(self):
+    for output_format in [TEXT_FORMAT, BINARY_FORMAT]:
+      path = os.path.join(self.tmpdir, "CROSSTOOL." + output_format)
+      write_proto_file(path, self.crosstool, output_format)
+      crosstool = crosstool_config_pb2.CrosstoolRelease()
+      self.assertEqual(
+          parse_proto(read_file(path), crosstool), output_format)
+      self.assertEqual(crosstool, self.crosstool)
+
+  def test_parse_mapped_file(self):
+    for output_format in [TEXT_FORMAT, BINARY_FORMAT]:
+      path = os.path.join(self.tmpdir, "CROSSTOOL." + output_format)
+      write_proto_file(path, self.crosstool, output_format)
+      crosstool = crosstool_config_pb2.CrosstoolRelease()
+      self.assertEqual(parse_proto(map_file(path), crosstool), output_format)
+      self.assertEqual(crosstool, self.crosstool)
+      self.assertEqual(self.parse_streaming(map_file(path)), self.crosstool)
+
+  def test_map_empty_file(self):
+    path = os.path.join(self.tmpdir, "CROSSTOOL")
+    open(path, "w").close()
+    self.assertEqual(map_file(path), b"")
+
+  def parse_streaming(self, data, input_format=AUTO_FORMAT):
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    _, toolchains = parse_proto_streaming(data, crosstool, "toolchain",
+                                          input_format)
+    crosstool.toolchain.extend(list(toolchains))
+    return crosstool
+
+  def test_parse_streaming(self):
+    for data in [
+        text_format.MessageToString(self.crosstool).encode(),
+        self.crosstool.SerializePartialToString()
+    ]:
+      self.assertEqual(self.parse_streaming(data), self.crosstool)
+
+  def test_parse_streaming_text_syntax_variants(self):
+    data = br"""
+        # toolchain { this is a comment }
+        toolchain: < toolchain_identifier: 'id-1' compiler_flag: 'flag-1'
+                     feature { name: "feature-1" enabled: true } >
+        major_version: '123'
+        toolchain: [{ toolchain_identifier: 'id-2' }]
+        minor_version: "4}5\"6"
+    """
+    crosstool = self.parse_streaming(data)
+    self.assertEqual(crosstool.minor_version, '4}5"6')
+    crosstool.minor_version = "456"
+    self.assertEqual(crosstool, self.crosstool)
+
+  def test_parse_streaming_errors(self):
+    with self.assertRaises(text_format.ParseError):
+      self.parse_streaming(b"toolchain { toolchain_identifier: 'id-1'")
+    # Errors in a toolchain are reported at their position in the whole file.
+    with self.assertRaises(text_format.ParseError) as context:
+      self.parse_streaming(b"major_version: '1'\n\ntoolchain {\n"
+                           b"  no_such_field: 1\n}\n")
+    self.assertTrue(str(context.exception).startswith("4:"))
+
+  def test_streaming_writer_matches_write_proto_file(self):
+    for output_format in [TEXT_FORMAT, BINARY_FORMAT]:
+      expected_path = os.path.join(self.tmpdir, "expected")
+      write_proto_file(expected_path, self.crosstool, output_format)
+      path = os.path.join(self.tmpdir, "streamed")
+      header = crosstool_config_pb2.CrosstoolRelease()
+      header.CopyFrom(self.crosstool)
+      header.ClearField("toolchain")
+      with StreamingProtoWriter(path, header, "toolchain",
+                                output_format) as writer:
+        for toolchain in self.crosstool.toolchain:
+          writer.write(toolchain)
+      self.assertEqual(read_file(path), read_file(expected_path))
+    self.assertEqual(sorted(os.listdir(self.tmpdir)), ["expected", "streamed"])
+
+  def test_streaming_writer_keeps_file_on_error(self):
+    path = os.path.join(self.tmpdir, "CROSSTOOL")
+    write_proto_file(path, self.crosstool, TEXT_FORMAT)
+    with self.assertRaises(ValueError):
+      with StreamingProtoWriter(path, self.crosstool, "toolchain", TEXT_FORMAT):
+        raise ValueError()
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    parse_proto(read_file(path), crosstool)
+    self.assertEqual(crosstool, self.crosstool)
+    self.assertEqual(os.listdir(self.tmpdir), ["CROSSTOOL"])
+
+
+if __name__ == "__main__":
+  unittest.main()
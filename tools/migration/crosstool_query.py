@@ -1,52 +1,198 @@
 """Script to make automated CROSSTOOL refactorings easier.
 
 This script reads the CROSSTOOL file and allows for querying of its fields.
+
+In batch mode the CROSSTOOL is parsed once and many queries are answered in a
+single run. Queries are either the cross product of --identifiers and
+--print_fields, or are read from a --queries file containing a JSON array or
+NDJSON of {"identifier": ..., "field": ...} objects. Results are streamed to
+stdout as NDJSON, a query that can't be read is answered with an
+{"error": ...} result.
+
+With --serve the CROSSTOOLs stay loaded and queries are answered over a Unix
+domain socket, one JSON query per line, see crosstool_query_server_lib.
 """
 
+import json
+import sys
 from absl import app
 from absl import flags
-from google.protobuf import text_format
 from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_cache_lib import DEFAULT_MAX_CACHE_SIZE
+from tools.migration.crosstool_cache_lib import parse_proto_cached
+from tools.migration.crosstool_io_lib import AUTO_FORMAT
+from tools.migration.crosstool_io_lib import FORMATS
+from tools.migration.crosstool_io_lib import map_file
+from tools.migration.crosstool_io_lib import parse_proto
+from tools.migration.crosstool_query_lib import compile_field_path
+from tools.migration.crosstool_query_lib import read_queries
+from tools.migration.crosstool_query_lib import run_queries
+from tools.migration.crosstool_query_server_lib import CrosstoolStore
+from tools.migration.crosstool_query_server_lib import serve
+from tools.migration.timings_lib import PhaseTimer
+from tools.migration.timings_lib import run_profiled
 
 flags.DEFINE_string("crosstool", None, "CROSSTOOL file path to be queried")
 flags.DEFINE_string("identifier", None,
                     "Toolchain identifier to specify toolchain.")
-flags.DEFINE_string("print_field", None, "Field to be printed to stdout.")
+flags.DEFINE_string(
+    "print_field", None,
+    ("Field to be printed to stdout. Nested fields are selected by paths like "
+     "'feature[name=opt].flag_set.flag_group.flag' or "
+     "'action_config[*].tool.tool_path'."))
+flags.DEFINE_list("identifiers", None,
+                  "Toolchain identifiers to query in batch mode.")
+flags.DEFINE_list("print_fields", None, "Fields to query in batch mode.")
+flags.DEFINE_string(
+    "queries", None,
+    "JSON or NDJSON file with queries to run in batch mode, '-' reads stdin.")
+flags.DEFINE_string(
+    "serve", None,
+    "Path of a Unix domain socket on which to answer queries until "
+    "interrupted.")
+flags.DEFINE_list("crosstools", None,
+                  "CROSSTOOL files served by --serve, defaults to --crosstool.")
+flags.DEFINE_enum(
+    "input_format", AUTO_FORMAT, FORMATS,
+    "Format of the --crosstool file, 'auto' detects it from the file content.")
+flags.DEFINE_boolean(
+    "no_cache", False,
+    "Always parse the text CROSSTOOL instead of using the parsed proto cache.")
+flags.DEFINE_string(
+    "cache_dir", None,
+    "Directory of the parsed proto cache, defaults to "
+    "$XDG_CACHE_HOME/rules_cc/crosstool.")
+flags.DEFINE_integer(
+    "max_cache_size", DEFAULT_MAX_CACHE_SIZE,
+    "Maximum size of the parsed proto cache in bytes.",
+    lower_bound=0)
+flags.DEFINE_boolean(
+    "timings", False,
+    "Print the wall and CPU time of every phase and the peak RSS to stderr.")
+flags.DEFINE_integer(
+    "timings_top_n", 10,
+    "Number of the slowest CROSSTOOL loads to print with --timings.",
+    lower_bound=0)
+flags.DEFINE_string(
+    "profile", None,
+    "File to write a cProfile profile of the run to, in the pstats format.")
 
 
 def main(unused_argv):
+  timer = PhaseTimer(flags.FLAGS.timings, flags.FLAGS.timings_top_n)
+  try:
+    run_profiled(flags.FLAGS.profile, _query, timer)
+  finally:
+    timer.report()
+
+
+def _query(timer):
+  """Answers the queries passed on the command line."""
+  if flags.FLAGS.serve:
+    _serve(timer)
+    return
+
   crosstool = crosstool_config_pb2.CrosstoolRelease()
 
   crosstool_filename = flags.FLAGS.crosstool
   identifier = flags.FLAGS.identifier
   print_field = flags.FLAGS.print_field
+  batch_mode = (
+      flags.FLAGS.identifiers or flags.FLAGS.print_fields or
+      flags.FLAGS.queries)
 
   if not crosstool_filename:
     raise app.UsageError("ERROR crosstool unspecified")
-  if not identifier:
-    raise app.UsageError("ERROR identifier unspecified")
+  if flags.FLAGS.queries:
+    if flags.FLAGS.identifiers or flags.FLAGS.print_fields:
+      raise app.UsageError("ERROR --queries can't be combined with "
+                           "--identifiers or --print_fields")
+  else:
+    if not identifier and not flags.FLAGS.identifiers:
+      raise app.UsageError("ERROR identifier unspecified")
 
-  if not print_field:
-    raise app.UsageError("ERROR print_field unspecified")
+    if not print_field and not flags.FLAGS.print_fields:
+      raise app.UsageError("ERROR print_field unspecified")
 
-  with open(crosstool_filename, "r") as f:
-    text = f.read()
-    text_format.Merge(text, crosstool)
+  field_path = None
+  if not batch_mode and ("." in print_field or "[" in print_field):
+    try:
+      field_path = compile_field_path(print_field,
+                                      crosstool_config_pb2.CToolchain.DESCRIPTOR)
+    except ValueError as e:
+      raise app.UsageError("ERROR %s" % e)
+
+  _parse_crosstool(crosstool_filename, crosstool, timer)
+
+  if batch_mode:
+    _run_batch_queries(crosstool, timer)
+    return
 
   toolchain_found = False
-  for toolchain in crosstool.toolchain:
-    if toolchain.toolchain_identifier == identifier:
-      toolchain_found = True
-      if not print_field:
-        continue
-      for field, value in toolchain.ListFields():
-        if print_field == field.name:
-          print value
+  with timer.phase("query"):
+    for toolchain in crosstool.toolchain:
+      if toolchain.toolchain_identifier == identifier:
+        toolchain_found = True
+        if not print_field:
+          continue
+        if field_path:
+          for value in field_path.evaluate(toolchain):
+            print(value)
+          continue
+        for field, value in toolchain.ListFields():
+          if print_field == field.name:
+            print(value)
 
   if not toolchain_found:
-    print "toolchain_identifier %s not found, valid values are:" % identifier
+    print("toolchain_identifier %s not found, valid values are:" % identifier)
     for toolchain in crosstool.toolchain:
-      print "  " + toolchain.toolchain_identifier
+      print("  " + toolchain.toolchain_identifier)
+
+
+def _parse_crosstool(crosstool_filename, crosstool, timer):
+  with timer.phase("read"):
+    data = map_file(crosstool_filename)
+  with timer.phase("parse", item=crosstool_filename):
+    if flags.FLAGS.no_cache:
+      parse_proto(data, crosstool, flags.FLAGS.input_format)
+    else:
+      parse_proto_cached(data, crosstool, flags.FLAGS.input_format,
+                         flags.FLAGS.cache_dir, flags.FLAGS.max_cache_size)
+
+
+def _serve(timer):
+  """Keeps the CROSSTOOLs loaded and answers queries on the --serve socket."""
+  crosstool_filenames = flags.FLAGS.crosstools or [flags.FLAGS.crosstool]
+  if not all(crosstool_filenames):
+    raise app.UsageError("ERROR crosstool unspecified")
+
+  def load_crosstool(crosstool_filename):
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    _parse_crosstool(crosstool_filename, crosstool, timer)
+    return crosstool
+
+  store = CrosstoolStore(crosstool_filenames, load_crosstool)
+  serve(flags.FLAGS.serve, store)
+
+
+def _run_batch_queries(crosstool, timer):
+  """Runs the queries passed on the command line and prints NDJSON results."""
+  if flags.FLAGS.queries == "-":
+    queries = read_queries(iter(sys.stdin.readline, ""))
+  elif flags.FLAGS.queries:
+    with open(flags.FLAGS.queries, "r") as f:
+      queries = list(read_queries(f))
+  else:
+    identifiers = flags.FLAGS.identifiers or [flags.FLAGS.identifier]
+    fields = flags.FLAGS.print_fields or [flags.FLAGS.print_field]
+    queries = [{
+        "identifier": identifier,
+        "field": field
+    } for identifier in identifiers for field in fields]
+  for result in timer.iterate("query", run_queries(crosstool, queries)):
+    with timer.phase("output"):
+      sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+      sys.stdout.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing run_queries function.
+
+run_queries answers queries for fields of CToolchains in a parsed CROSSTOOL.
+A query is a dict with an "identifier" of the toolchain and a "field" path to
+print, every query produces a JSON-serializable result dict. Field paths can
+descend into nested messages and select elements of repeated fields, e.g.
+"feature[name=opt].flag_set.flag_group.flag", see compile_field_path.
+"""
+
+import collections
+import json
+import re
+from google.protobuf import descriptor
+from google.protobuf import json_format
+
+try:
+  # Python 2
+  _STRING_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+  # Python 3
+  _STRING_TYPES = (str,)
+
+
+def index_toolchains(crosstool):
+  """Returns a dict mapping toolchain identifiers to toolchains.
+
+  When multiple toolchains share an identifier, the first one wins.
+  """
+  toolchains_by_identifier = {}
+  for toolchain in crosstool.toolchain:
+    toolchains_by_identifier.setdefault(toolchain.toolchain_identifier,
+                                        toolchain)
+  return toolchains_by_identifier
+
+
+class InvalidQuery(collections.namedtuple("InvalidQuery", ["error"])):
+  """A query that could not be read, answered by a result with the error."""
+  __slots__ = ()
+
+
+def read_queries(lines):
+  """Yields queries from lines of a JSON array or of NDJSON.
+
+  A JSON array is read as a whole, NDJSON is read lazily line by line so that
+  queries can be answered while they are still being written. Instead of
+  raising, an InvalidQuery is yielded for every NDJSON line, or once for an
+  array, that is not valid JSON, and for every query that is not an object.
+  """
+  lines = iter(lines)
+  line_number = 0
+  for line in lines:
+    line_number += 1
+    if not line.strip():
+      continue
+    if line.lstrip().startswith("["):
+      try:
+        queries = json.loads(line + "".join(lines))
+      except ValueError as e:
+        yield InvalidQuery("invalid JSON array of queries: %s" % e)
+        return
+      for query in queries:
+        yield _checked_query(query, "query")
+      return
+    try:
+      query = json.loads(line)
+    except ValueError as e:
+      yield InvalidQuery("line %d: %s" % (line_number, e))
+      continue
+    yield _checked_query(query, "line %d" % line_number)
+
+
+def _checked_query(query, location):
+  if not isinstance(query, dict):
+    return InvalidQuery("%s: query must be a JSON object" % location)
+  return query
+
+
+def run_queries(crosstool, queries):
+  """Yields a result dict for every query."""
+  runner = QueryRunner(crosstool)
+  for query in queries:
+    yield runner.run_query(query)
+
+
+class QueryRunner(object):
+  """Answers queries against a single parsed CROSSTOOL.
+
+  Field paths are compiled once and reused for all toolchains, selector indexes
+  are built once per toolchain and reused by all queries.
+  """
+
+  def __init__(self, crosstool):
+    self.toolchains_by_identifier = index_toolchains(crosstool)
+    self._field_paths = {}
+    self._selector_indexes = {}
+
+  def field_path(self, path, message_descriptor):
+    """Returns the compiled FieldPath, raises ValueError for invalid paths."""
+    key = (message_descriptor.full_name, path)
+    field_path = self._field_paths.get(key)
+    if field_path is None:
+      field_path = compile_field_path(path, message_descriptor)
+      self._field_paths[key] = field_path
+    return field_path
+
+  def run_query(self, query):
+    """Returns the result dict of a single query or InvalidQuery.
+
+    Errors, including an "identifier" or "field" that is not a string, are
+    returned as {"error": ...}.
+    """
+    if isinstance(query, InvalidQuery):
+      return {"error": query.error}
+    identifier = query.get("identifier")
+    path = query.get("field")
+    result = {"identifier": identifier, "field": path}
+    for key, value in (("identifier", identifier), ("field", path)):
+      if value is not None and not isinstance(value, _STRING_TYPES):
+        result["error"] = "%s must be a string" % key
+        return result
+    toolchain = self.toolchains_by_identifier.get(identifier)
+    if toolchain is None:
+      result["error"] = "toolchain_identifier %s not found" % identifier
+      return result
+    try:
+      field_path = self.field_path(path, toolchain.DESCRIPTOR)
+    except ValueError as e:
+      result["error"] = str(e)
+      return result
+    selector_indexes = self._selector_indexes.setdefault(identifier, {})
+    result["value"] = field_path.to_json(toolchain, selector_indexes)
+    return result
+
+
+# A path segment is a field name optionally followed by a selector in brackets.
+_SEGMENT_RE = re.compile(r"^(\w+)(?:\[([^\]]*)\])?$")
+
+
+def compile_field_path(path, message_descriptor):
+  """Compiles a field path like "feature[name=opt].flag_set.flag_group.flag".
+
+  Every segment of the path names a field of the message reached by the
+  previous segments. Repeated fields can be followed by a selector: "[*]"
+  selects all elements (the same as no selector), "[3]" selects the element at
+  the given index and "[name=opt]" selects the elements whose field "name" has
+  the value "opt".
+
+  Raises ValueError when the path doesn't match the message structure.
+  """
+  segments = []
+  current_descriptor = message_descriptor
+  for segment in (path or "").split("."):
+    if current_descriptor is None:
+      raise ValueError("field path %s descends into a non-message field" % path)
+    match = _SEGMENT_RE.match(segment)
+    if not match:
+      raise ValueError("invalid field path %s" % path)
+    name, selector = match.groups()
+    field = current_descriptor.fields_by_name.get(name)
+    if field is None:
+      raise ValueError("field %s not found" % name)
+    segments.append((field, _compile_selector(field, selector, path)))
+    current_descriptor = field.message_type
+  return FieldPath(path, segments)
+
+
+def _compile_selector(field, selector, path):
+  """Returns a (kind, arguments...) tuple describing the selector."""
+  if selector is None or selector == "*":
+    return None
+  if field.label != descriptor.FieldDescriptor.LABEL_REPEATED:
+    raise ValueError("selector in field path %s used on non-repeated field %s" %
+                     (path, field.name))
+  if "=" in selector:
+    key, value = selector.split("=", 1)
+    if (field.message_type is None or
+        key not in field.message_type.fields_by_name):
+      raise ValueError("field %s has no field %s to select by" %
+                       (field.name, key))
+    return ("match", field.message_type.fields_by_name[key], value)
+  try:
+    return ("index", int(selector))
+  except ValueError:
+    raise ValueError("invalid selector [%s] in field path %s" %
+                     (selector, path))
+
+
+class FieldPath(object):
+  """A compiled field path, see compile_field_path."""
+
+  def __init__(self, path, segments):
+    self.path = path
+    self._segments = segments
+    self._leaf_field = segments[-1][0]
+    # Plain field names keep the output of a single field lookup.
+    self._is_plain_field = len(segments) == 1 and segments[0][1] is None
+
+  def evaluate(self, message, selector_indexes=None):
+    """Returns the list of values the path reaches in message.
+
+    selector_indexes is a dict caching the indexes used by "[key=value]"
+    selectors, pass the same dict for all evaluations on the same message to
+    avoid rescanning repeated fields.
+    """
+    if selector_indexes is None:
+      selector_indexes = {}
+    nodes = [((), message)]
+    for field, selector in self._segments:
+      next_nodes = []
+      for position, node in nodes:
+        for ordinal, value in _select(position, node, field, selector,
+                                      selector_indexes):
+          next_nodes.append((position + ((field.number, ordinal),), value))
+      nodes = next_nodes
+    return [value for _, value in nodes]
+
+  def to_json(self, message, selector_indexes=None):
+    """Returns the values the path reaches as a JSON-serializable value."""
+    if self._is_plain_field:
+      return field_to_json(message, self._leaf_field)
+    return [
+        _value_to_json(self._leaf_field, value)
+        for value in self.evaluate(message, selector_indexes)
+    ]
+
+
+def _select(position, node, field, selector, selector_indexes):
+  """Returns (ordinal, value) pairs selected from the field of node."""
+  if field.label != descriptor.FieldDescriptor.LABEL_REPEATED:
+    if not node.HasField(field.name):
+      return []
+    return [(None, getattr(node, field.name))]
+  container = getattr(node, field.name)
+  if selector is None:
+    return list(enumerate(container))
+  if selector[0] == "index":
+    index = selector[1]
+    if -len(container) <= index < len(container):
+      return [(index % len(container), container[index])]
+    return []
+  _, key_field, key_value = selector
+  index_key = (position, field.number, key_field.number)
+  index = selector_indexes.get(index_key)
+  if index is None:
+    index = {}
+    for ordinal, element in enumerate(container):
+      value = _selector_value(key_field, getattr(element, key_field.name))
+      index.setdefault(value, []).append(ordinal)
+    selector_indexes[index_key] = index
+  return [(ordinal, container[ordinal]) for ordinal in index.get(key_value, [])]
+
+
+def _selector_value(field, value):
+  """Returns the string a selector compares the value of the field with."""
+  if field.type == descriptor.FieldDescriptor.TYPE_ENUM:
+    return field.enum_type.values_by_number[value].name
+  if field.type == descriptor.FieldDescriptor.TYPE_BOOL:
+    return "true" if value else "false"
+  if field.type == descriptor.FieldDescriptor.TYPE_STRING:
+    return value
+  return str(value)
+
+
+def field_to_json(message, field):
+  """Returns the value of the field in message as a JSON-serializable value.
+
+  Unset singular fields are returned as None.
+  """
+  if field.label == descriptor.FieldDescriptor.LABEL_REPEATED:
+    return [
+        _value_to_json(field, value) for value in getattr(message, field.name)
+    ]
+  if not message.HasField(field.name):
+    return None
+  return _value_to_json(field, getattr(message, field.name))
+
+
+def _value_to_json(field, value):
+  if field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+    return json_format.MessageToDict(value, preserving_proto_field_name=True)
+  if field.type == descriptor.FieldDescriptor.TYPE_ENUM:
+    return field.enum_type.values_by_number[value].name
+  return value
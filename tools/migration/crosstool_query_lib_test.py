@@ -0,0 +1,232 @@
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_query_lib import InvalidQuery
+from tools.migration.crosstool_query_lib import compile_field_path
+from tools.migration.crosstool_query_lib import index_toolchains
+from tools.migration.crosstool_query_lib import read_queries
+from tools.migration.crosstool_query_lib import run_queries
+
+
+def make_crosstool(string):
+  crosstool = crosstool_config_pb2.CrosstoolRelease()
+  text_format.Merge(string, crosstool)
+  return crosstool
+
+
+class CrosstoolQueryLibTest(unittest.TestCase):
+
+  def setUp(self):
+    self.crosstool = make_crosstool("""
+        major_version: '123'
+        minor_version: '456'
+        toolchain {
+          toolchain_identifier: 'id-1'
+          target_cpu: 'cpu-1'
+          compiler_flag: 'flag-1'
+          compiler_flag: 'flag-2'
+          compilation_mode_flags { mode: OPT compiler_flag: 'opt-flag' }
+          feature {
+            name: 'opt'
+            flag_set {
+              flag_group { flag: 'opt-1' flag: 'opt-2' }
+              flag_group { flag: 'opt-3' }
+            }
+            flag_set {
+              flag_group { flag: 'opt-4' }
+            }
+          }
+          feature {
+            name: 'dbg'
+            flag_set { flag_group { flag: 'dbg-1' } }
+          }
+          action_config {
+            config_name: 'c-compile'
+            action_name: 'c-compile'
+            tool { tool_path: 'gcc' }
+          }
+          action_config {
+            config_name: 'c++-compile'
+            action_name: 'c++-compile'
+            tool { tool_path: 'g++' }
+            tool { tool_path: 'clang++' }
+          }
+        }
+        toolchain {
+          toolchain_identifier: 'id-2'
+          target_cpu: 'cpu-2'
+        }
+        toolchain {
+          toolchain_identifier: 'id-1'
+          target_cpu: 'duplicate'
+        }
+    """)
+
+  def query(self, identifier, field):
+    return list(
+        run_queries(self.crosstool, [{
+            "identifier": identifier,
+            "field": field
+        }]))[0]
+
+  def test_index_toolchains_prefers_first_toolchain(self):
+    toolchains_by_identifier = index_toolchains(self.crosstool)
+    self.assertEqual(sorted(toolchains_by_identifier.keys()), ["id-1", "id-2"])
+    self.assertEqual(toolchains_by_identifier["id-1"].target_cpu, "cpu-1")
+
+  def test_scalar_field(self):
+    self.assertEqual(
+        self.query("id-2", "target_cpu"), {
+            "identifier": "id-2",
+            "field": "target_cpu",
+            "value": "cpu-2"
+        })
+
+  def test_unset_fields(self):
+    self.assertIsNone(self.query("id-2", "builtin_sysroot")["value"])
+    self.assertEqual(self.query("id-2", "compiler_flag")["value"], [])
+
+  def test_repeated_field(self):
+    self.assertEqual(
+        self.query("id-1", "compiler_flag")["value"], ["flag-1", "flag-2"])
+
+  def test_message_field(self):
+    self.assertEqual(
+        self.query("id-1", "compilation_mode_flags")["value"], [{
+            "mode": "OPT",
+            "compiler_flag": ["opt-flag"]
+        }])
+
+  def test_unknown_toolchain(self):
+    result = self.query("id-3", "target_cpu")
+    self.assertNotIn("value", result)
+    self.assertEqual(result["error"], "toolchain_identifier id-3 not found")
+
+  def test_unknown_field(self):
+    result = self.query("id-1", "no_such_field")
+    self.assertNotIn("value", result)
+    self.assertEqual(result["error"], "field no_such_field not found")
+
+  def test_values_that_are_not_strings(self):
+    self.assertEqual(
+        self.query("id-1", 3), {
+            "identifier": "id-1",
+            "field": 3,
+            "error": "field must be a string"
+        })
+    self.assertEqual(
+        self.query(["id-1"], "target_cpu"), {
+            "identifier": ["id-1"],
+            "field": "target_cpu",
+            "error": "identifier must be a string"
+        })
+
+  def test_nested_path_with_name_selector(self):
+    self.assertEqual(
+        self.query("id-1", "feature[name=opt].flag_set.flag_group.flag")
+        ["value"], ["opt-1", "opt-2", "opt-3", "opt-4"])
+
+  def test_nested_path_with_wildcard_selector(self):
+    self.assertEqual(
+        self.query("id-1", "action_config[*].tool.tool_path")["value"],
+        ["gcc", "g++", "clang++"])
+
+  def test_nested_path_with_index_selector(self):
+    self.assertEqual(
+        self.query("id-1", "feature[1].name")["value"], ["dbg"])
+    self.assertEqual(
+        self.query("id-1", "feature[-1].name")["value"], ["dbg"])
+    self.assertEqual(self.query("id-1", "feature[5].name")["value"], [])
+
+  def test_nested_path_with_enum_selector(self):
+    self.assertEqual(
+        self.query("id-1", "compilation_mode_flags[mode=OPT].compiler_flag")
+        ["value"], ["opt-flag"])
+
+  def test_nested_path_to_message(self):
+    self.assertEqual(
+        self.query("id-1", "feature[name=dbg].flag_set.flag_group")["value"],
+        [{
+            "flag": ["dbg-1"]
+        }])
+
+  def test_invalid_paths(self):
+    self.assertEqual(
+        self.query("id-1", "feature.no_such_field")["error"],
+        "field no_such_field not found")
+    self.assertEqual(
+        self.query("id-1", "feature[unknown=1]")["error"],
+        "field feature has no field unknown to select by")
+    self.assertEqual(
+        self.query("id-1", "target_cpu[0]")["error"],
+        ("selector in field path target_cpu[0] used on non-repeated field "
+         "target_cpu"))
+    self.assertEqual(
+        self.query("id-1", "target_cpu.foo")["error"],
+        "field path target_cpu.foo descends into a non-message field")
+
+  def test_selector_index_is_reused(self):
+    field_path = compile_field_path(
+        "feature[name=opt].name",
+        crosstool_config_pb2.CToolchain.DESCRIPTOR)
+    toolchain = self.crosstool.toolchain[0]
+    selector_indexes = {}
+    self.assertEqual(field_path.evaluate(toolchain, selector_indexes), ["opt"])
+    self.assertEqual(len(selector_indexes), 1)
+    # A stale index is used as is, proving that the features are not rescanned.
+    toolchain.feature[0].name = "renamed"
+    self.assertEqual(
+        field_path.evaluate(toolchain, selector_indexes), ["renamed"])
+    self.assertEqual(field_path.evaluate(toolchain), [])
+
+  def test_read_ndjson_queries(self):
+    lines = [
+        '{"identifier": "id-1", "field": "target_cpu"}\n', "\n",
+        '{"identifier": "id-2", "field": "compiler"}\n'
+    ]
+    self.assertEqual(
+        list(read_queries(lines)), [{
+            "identifier": "id-1",
+            "field": "target_cpu"
+        }, {
+            "identifier": "id-2",
+            "field": "compiler"
+        }])
+
+  def test_read_json_array_queries(self):
+    lines = [
+        "[\n", '  {"identifier": "id-1", "field": "target_cpu"},\n',
+        '  {"identifier": "id-2", "field": "compiler"}\n', "]\n"
+    ]
+    self.assertEqual(
+        list(read_queries(lines)), [{
+            "identifier": "id-1",
+            "field": "target_cpu"
+        }, {
+            "identifier": "id-2",
+            "field": "compiler"
+        }])
+
+  def test_read_invalid_queries(self):
+    lines = [
+        '{"identifier": "id-1", "field": "target_cpu"}\n', "not json\n",
+        "1\n", '{"identifier": "id-2", "field": "compiler"}\n'
+    ]
+    queries = list(read_queries(lines))
+    self.assertEqual(len(queries), 4)
+    self.assertIsInstance(queries[1], InvalidQuery)
+    self.assertTrue(queries[1].error.startswith("line 2: "))
+    self.assertEqual(queries[2],
+                     InvalidQuery("line 3: query must be a JSON object"))
+    self.assertEqual(queries[3], {"identifier": "id-2", "field": "compiler"})
+    self.assertEqual(
+        list(read_queries(["[", '{"identifier": "id-1"}, 2', "]"]))[1],
+        InvalidQuery("query: query must be a JSON object"))
+    self.assertEqual(len(list(read_queries(["[", "not json"]))), 1)
+    results = list(run_queries(self.crosstool, queries))
+    self.assertEqual(results[1], {"error": queries[1].error})
+    self.assertEqual(results[3]["identifier"], "id-2")
+
+
+if __name__ == "__main__":
+  unittest.main()
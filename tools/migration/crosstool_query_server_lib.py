@@ -0,0 +1,148 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing a query server keeping parsed CROSSTOOLs in memory.
+
+The server listens on a Unix domain socket and speaks a line protocol: every
+request line is a JSON query object as accepted by crosstool_query_lib, with an
+additional "crosstool" key naming the queried file (optional when the server
+has a single file loaded). Every request is answered by a single JSON line.
+
+Files are parsed once and reparsed only when their modification time or size
+changes.
+"""
+
+import json
+import os
+import stat
+import threading
+from google.protobuf import message
+from google.protobuf import text_format
+from tools.migration.crosstool_query_lib import QueryRunner
+
+try:
+  # Python 2
+  import SocketServer as socketserver
+except ImportError:
+  # Python 3
+  import socketserver
+
+try:
+  # Python 2
+  _STRING_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+  # Python 3
+  _STRING_TYPES = (str,)
+
+
+class CrosstoolStore(object):
+  """Keeps parsed CROSSTOOL files and reloads them when they change."""
+
+  def __init__(self, paths, parse_crosstool):
+    """Creates the store, parse_crosstool maps a path to a CrosstoolRelease."""
+    self._parse_crosstool = parse_crosstool
+    self._lock = threading.Lock()
+    # Maps absolute path to a (stat key, QueryRunner) tuple.
+    self._entries = {}
+    self._paths = [os.path.abspath(path) for path in paths]
+    for path in self._paths:
+      self.query_runner(path)
+
+  def query_runner(self, path=None):
+    """Returns the QueryRunner of an up to date parse of the file at path.
+
+    Raises KeyError for files that are not served and OSError when the file
+    can't be read.
+    """
+    if path is None:
+      if len(self._paths) != 1:
+        raise KeyError("crosstool unspecified, served files are: %s" %
+                       ", ".join(self._paths))
+      path = self._paths[0]
+    path = os.path.abspath(path)
+    if path not in self._paths:
+      raise KeyError("crosstool %s is not served" % path)
+    file_stat = os.stat(path)
+    stat_key = (file_stat.st_mtime, file_stat.st_size)
+    with self._lock:
+      entry = self._entries.get(path)
+      if entry is None or entry[0] != stat_key:
+        entry = (stat_key, QueryRunner(self._parse_crosstool(path)))
+        self._entries[path] = entry
+      return entry[1]
+
+  def answer(self, line):
+    """Returns the response line for a request line.
+
+    The line is bytes encoded as UTF-8 or a string. Every line is answered by
+    exactly one response line, errors are returned as {"error": ...}.
+    """
+    try:
+      if isinstance(line, bytes):
+        line = line.decode("utf-8")
+      query = json.loads(line)
+      if not isinstance(query, dict):
+        raise ValueError("query must be a JSON object")
+      crosstool = query.get("crosstool")
+      if crosstool is not None and not isinstance(crosstool, _STRING_TYPES):
+        raise ValueError("crosstool must be a string")
+      runner = self.query_runner(crosstool)
+      result = runner.run_query(query)
+    except KeyError as e:
+      result = {"error": e.args[0]}
+    except (ValueError, TypeError, UnicodeDecodeError, OSError, IOError,
+            text_format.ParseError, message.DecodeError) as e:
+      result = {"error": str(e)}
+    return json.dumps(result, sort_keys=True) + "\n"
+
+
+class _QueryHandler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    for line in iter(self.rfile.readline, b""):
+      if not line.strip():
+        continue
+      self.wfile.write(self.server.store.answer(line).encode("utf-8"))
+      self.wfile.flush()
+
+
+class _QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+def make_server(socket_path, store):
+  """Returns a server answering queries from store on the Unix socket."""
+  _remove_stale_socket(socket_path)
+  server = _QueryServer(socket_path, _QueryHandler)
+  server.store = store
+  return server
+
+
+def serve(socket_path, store):
+  """Answers queries on the Unix socket until interrupted."""
+  server = make_server(socket_path, store)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    _remove_stale_socket(socket_path)
+
+
+def _remove_stale_socket(socket_path):
+  try:
+    if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+      os.remove(socket_path)
+  except OSError:
+    pass
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_query_server_lib import CrosstoolStore
+from tools.migration.crosstool_query_server_lib import make_server
+
+
+def write_crosstool(path, target_cpu, mtime):
+  with open(path, "w") as f:
+    f.write("""
+        major_version: '123'
+        minor_version: '456'
+        toolchain { toolchain_identifier: 'id-1' target_cpu: '%s' }
+    """ % target_cpu)
+  os.utime(path, (mtime, mtime))
+
+
+class CrosstoolQueryServerLibTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.crosstool_path = os.path.join(self.tmpdir, "CROSSTOOL")
+    write_crosstool(self.crosstool_path, "cpu-1", 1)
+    self.parse_count = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def parse_crosstool(self, path):
+    self.parse_count += 1
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    with open(path, "r") as f:
+      text_format.Merge(f.read(), crosstool)
+    return crosstool
+
+  def answer(self, store, query):
+    return json.loads(store.answer(json.dumps(query)))
+
+  def test_answers_queries_without_reparsing(self):
+    store = CrosstoolStore([self.crosstool_path], self.parse_crosstool)
+    for _ in range(3):
+      self.assertEqual(
+          self.answer(store, {
+              "identifier": "id-1",
+              "field": "target_cpu"
+          })["value"], "cpu-1")
+    self.assertEqual(self.parse_count, 1)
+
+  def test_reloads_changed_file(self):
+    store = CrosstoolStore([self.crosstool_path], self.parse_crosstool)
+    write_crosstool(self.crosstool_path, "cpu-2", 2)
+    self.assertEqual(
+        self.answer(store, {
+            "identifier": "id-1",
+            "field": "target_cpu"
+        })["value"], "cpu-2")
+    self.assertEqual(self.parse_count, 2)
+
+  def test_multiple_crosstools(self):
+    other_path = os.path.join(self.tmpdir, "OTHER")
+    write_crosstool(other_path, "other-cpu", 1)
+    store = CrosstoolStore([self.crosstool_path, other_path],
+                           self.parse_crosstool)
+    self.assertEqual(
+        self.answer(store, {
+            "crosstool": other_path,
+            "identifier": "id-1",
+            "field": "target_cpu"
+        })["value"], "other-cpu")
+    self.assertIn(
+        "crosstool unspecified",
+        self.answer(store, {
+            "identifier": "id-1",
+            "field": "target_cpu"
+        })["error"])
+    self.assertIn(
+        "is not served",
+        self.answer(store, {
+            "crosstool": os.path.join(self.tmpdir, "UNKNOWN"),
+            "identifier": "id-1",
+            "field": "target_cpu"
+        })["error"])
+
+  def test_invalid_request(self):
+    store = CrosstoolStore([self.crosstool_path], self.parse_crosstool)
+    self.assertIn("error", json.loads(store.answer("not json")))
+    self.assertIn("error", json.loads(store.answer("[]")))
+    self.assertIn("error", json.loads(store.answer(b"\xff\n")))
+    self.assertEqual(
+        json.loads(store.answer('{"crosstool": 1, "identifier": "id-1"}')),
+        {"error": "crosstool must be a string"})
+    self.assertEqual(
+        json.loads(store.answer(b'{"identifier": "id-1", "field": 3}')), {
+            "identifier": "id-1",
+            "field": 3,
+            "error": "field must be a string"
+        })
+
+  def test_socket_line_protocol(self):
+    store = CrosstoolStore([self.crosstool_path], self.parse_crosstool)
+    socket_path = os.path.join(self.tmpdir, "socket")
+    server = make_server(socket_path, store)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+      client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      client.connect(socket_path)
+      client.sendall(b'{"identifier": "id-1", "field": "target_cpu"}\n'
+                     b'\xff\n'
+                     b'{"identifier": "id-1", "field": 3}\n'
+                     b'{"identifier": "id-2", "field": "target_cpu"}\n')
+      client.shutdown(socket.SHUT_WR)
+      response = b""
+      while True:
+        data = client.recv(4096)
+        if not data:
+          break
+        response += data
+      client.close()
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+    results = [json.loads(line) for line in response.decode().splitlines()]
+    self.assertEqual(len(results), 4)
+    self.assertEqual(results[0]["value"], "cpu-1")
+    self.assertIn("error", results[1])
+    self.assertEqual(results[2]["error"], "field must be a string")
+    self.assertEqual(results[3]["error"], "toolchain_identifier id-2 not found")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -14,9 +14,9 @@
 r"""A script that compares 2 CToolchains from proto format.
 
 This script accepts two files in either a CROSSTOOL proto text format or a
-CToolchain proto text format. It then locates the CToolchains with the given
-toolchain_identifier and checks if the resulting CToolchain objects in Java
-are the same.
+CToolchain proto text format, or the same protos in the binary format. It then
+locates the CToolchains with the given toolchain_identifier and checks if the
+resulting CToolchain objects in Java are the same.
 
 Example usage:
 
@@ -25,14 +25,54 @@ bazel run \
 --before=/path/to/CROSSTOOL1 \
 --after=/path/to/CROSSTOOL2 \
 --toolchain_identifier=id
+
+With --all instead of --toolchain_identifier, both files have to be CROSSTOOL
+files and all toolchains with the same identifier are compared. Identifiers
+present in only one of the files are reported as well.
+
+With --format=json the differences are printed as a single JSON object with a
+"differences" list of {"field", "name", "path", "kind", "before", "after"}
+records, where kind is one of "added", "removed", "changed" and "reordered".
+
+With --semantic the toolchains are compared by the flags and environment they
+pass to every action instead of by their fields, expanding all actions for a
+matrix of requested features and build variables, by default all combinations
+of compilation and linking modes with no and with common variables.
+--semantic_matrix reads the matrix from a JSON file of the form
+
+{"configurations": {"opt": ["opt", "pic"]}, "variables": {"none": {}}}
+
+With --format=json the semantic differences are {"action", "configuration",
+"variables", "kind", "before", "after"} records, where kind is one of "flags",
+"env" and "features".
 """
 
+import functools
+import json
+import multiprocessing
 import os
 from absl import app
 from absl import flags
+from google.protobuf import message
 from google.protobuf import text_format
 from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
-from tools.migration.ctoolchain_comparator_lib import compare_ctoolchains
+from tools.migration.crosstool_io_lib import AUTO_FORMAT
+from tools.migration.crosstool_io_lib import FORMATS
+from tools.migration.crosstool_io_lib import map_file
+from tools.migration.crosstool_io_lib import parse_proto
+from tools.migration.ctoolchain_comparator_lib import diff_ctoolchains
+from tools.migration.ctoolchain_comparator_lib import difference_to_json
+from tools.migration.ctoolchain_comparator_lib import format_differences
+from tools.migration.ctoolchain_comparator_lib import has_difference
+from tools.migration.ctoolchain_comparator_lib import pair_toolchains
+from tools.migration.semantic_comparator_lib import diff_expanded_ctoolchains
+from tools.migration.semantic_comparator_lib import format_semantic_differences
+from tools.migration.semantic_comparator_lib import has_semantic_difference
+from tools.migration.semantic_comparator_lib import parse_matrix
+from tools.migration.semantic_comparator_lib import semantic_difference_to_json
+from tools.migration.timings_lib import PhaseTimer
+from tools.migration.timings_lib import run_profiled
+import timeit
 
 flags.DEFINE_string(
     "before", None,
@@ -44,9 +84,46 @@ flags.DEFINE_string(
      "either a CROSSTOOL file or a single CToolchain proto text"))
 flags.DEFINE_string("toolchain_identifier", None,
                     "The identifier of the CToolchain that is being compared.")
+flags.DEFINE_boolean(
+    "all", False,
+    "Compare all CToolchains of the --before and --after CROSSTOOL files.")
+flags.DEFINE_integer(
+    "jobs",
+    1, "Number of processes comparing toolchains in parallel with --all.",
+    lower_bound=1)
+flags.DEFINE_enum(
+    "input_format", AUTO_FORMAT, FORMATS,
+    ("Format of the --before and --after files, 'auto' detects it from the "
+     "file content"))
+flags.DEFINE_enum("format", "text", ["text", "json"],
+                  "Format of the reported differences")
+flags.DEFINE_boolean(
+    "semantic", False,
+    "Compare the flags and environment variables the toolchains pass to every "
+    "action instead of their fields.")
+flags.DEFINE_string(
+    "semantic_matrix", None,
+    "JSON file with the feature configurations and build variables to expand "
+    "the actions with in --semantic mode.")
+flags.DEFINE_boolean(
+    "parallel_parse", True,
+    "Parse the --before and --after files concurrently in two processes when "
+    "more than one CPU is available.")
+flags.DEFINE_boolean(
+    "timings", False,
+    "Print the wall and CPU time of every phase, the peak RSS and the slowest "
+    "toolchains to stderr.")
+flags.DEFINE_integer(
+    "timings_top_n", 10,
+    "Number of the slowest toolchains to print with --timings.",
+    lower_bound=0)
+flags.DEFINE_string(
+    "profile", None,
+    "File to write a cProfile profile of the comparison to, in the pstats "
+    "format. Worker processes are not profiled, --noparallel_parse parses "
+    "both files in this process.")
 flags.mark_flag_as_required("before")
 flags.mark_flag_as_required("after")
-flags.mark_flag_as_required("toolchain_identifier")
 
 
 def _to_absolute_path(path):
@@ -67,54 +144,312 @@ def _find_toolchain(crosstool, toolchain_identifier):
   return None
 
 
-def _read_crosstool_or_ctoolchain_proto(input_file, toolchain_identifier):
-  """Reads a proto file and finds the CToolchain with the given identifier."""
-  with open(input_file, "r") as f:
-    text = f.read()
+def _read_crosstool_or_ctoolchain_proto(input_file,
+                                        toolchain_identifier,
+                                        input_format=AUTO_FORMAT,
+                                        timer=None):
+  """Reads a proto file and finds the CToolchain with the given identifier.
+
+  Returns the CToolchain and None, or None and the error message to print.
+  """
+  timer = timer or PhaseTimer(enabled=False)
+  with timer.phase("read"):
+    data = map_file(input_file)
   crosstool_release = crosstool_config_pb2.CrosstoolRelease()
   c_toolchain = crosstool_config_pb2.CToolchain()
   try:
-    text_format.Merge(text, crosstool_release)
+    with timer.phase("parse"):
+      parse_proto(data, crosstool_release, input_format)
     toolchain = _find_toolchain(crosstool_release, toolchain_identifier)
     if toolchain is None:
-      print(("Cannot find a CToolchain with an identifier '%s' in CROSSTOOL "
-             "file") % toolchain_identifier)
-      return None
-    return toolchain
-  except text_format.ParseError as crosstool_error:
+      return None, ("Cannot find a CToolchain with an identifier '%s' in "
+                    "CROSSTOOL file" % toolchain_identifier)
+    return toolchain, None
+  except (text_format.ParseError, message.DecodeError) as crosstool_error:
     try:
-      text_format.Merge(text, c_toolchain)
+      with timer.phase("parse"):
+        parse_proto(data, c_toolchain, input_format)
       if c_toolchain.toolchain_identifier != toolchain_identifier:
-        print(("Expected CToolchain with identifier '%s', got CToolchain with "
-               "identifier '%s'" % (toolchain_identifier,
-                                    c_toolchain.toolchain_identifier)))
-        return None
-      return c_toolchain
-    except text_format.ParseError as toolchain_error:
-      print(("Error parsing file '%s':" % input_file))  # pylint: disable=superfluous-parens
-      print("Attempt to parse it as a CROSSTOOL proto:")  # pylint: disable=superfluous-parens
-      print(crosstool_error)  # pylint: disable=superfluous-parens
-      print("Attempt to parse it as a CToolchain proto:")  # pylint: disable=superfluous-parens
-      print(toolchain_error)  # pylint: disable=superfluous-parens
-      return None
+        return None, ("Expected CToolchain with identifier '%s', got "
+                      "CToolchain with identifier '%s'" %
+                      (toolchain_identifier, c_toolchain.toolchain_identifier))
+      return c_toolchain, None
+    except (text_format.ParseError, message.DecodeError) as toolchain_error:
+      return None, "\n".join([
+          "Error parsing file '%s':" % input_file,
+          "Attempt to parse it as a CROSSTOOL proto:",
+          str(crosstool_error),
+          "Attempt to parse it as a CToolchain proto:",
+          str(toolchain_error),
+      ])
+
+
+def _read_crosstool(input_file, input_format=AUTO_FORMAT, timer=None):
+  """Reads a CROSSTOOL proto file.
+
+  Returns the CROSSTOOL and None, or None and the error message to print when
+  it can't be parsed.
+  """
+  timer = timer or PhaseTimer(enabled=False)
+  with timer.phase("read"):
+    data = map_file(input_file)
+  crosstool_release = crosstool_config_pb2.CrosstoolRelease()
+  try:
+    with timer.phase("parse"):
+      parse_proto(data, crosstool_release, input_format)
+  except (text_format.ParseError, message.DecodeError) as crosstool_error:
+    return None, "Error parsing file '%s':\n%s" % (input_file, crosstool_error)
+  return crosstool_release, None
+
+
+def _read_serialized_proto(read_function_and_args):
+  """Calls the read function in a worker process.
+
+  Returns the serialized proto, or None, and the error message.
+  """
+  read_function = read_function_and_args[0]
+  proto, error = read_function(*read_function_and_args[1:])
+  if proto is not None:
+    proto = proto.SerializePartialToString()
+  return proto, error
+
+
+def _read_before_and_after(read_function, proto_class, before_args,
+                           after_args, timer):
+  """Returns the protos read by read_function from --before and --after.
+
+  The protos are returned as a list of (proto, error message) tuples. With
+  --parallel_parse the --before file is read in a worker process and sent back
+  serialized while the --after file is read in this process.
+  """
+  if not flags.FLAGS.parallel_parse or multiprocessing.cpu_count() < 2:
+    return [
+        read_function(*(before_args + (timer,))),
+        read_function(*(after_args + (timer,))),
+    ]
+  pool = multiprocessing.Pool(1)
+  try:
+    before_result = pool.apply_async(_read_serialized_proto,
+                                     ((read_function,) + before_args,))
+    after = read_function(*(after_args + (timer,)))
+    with timer.phase("parse"):
+      serialized_before, before_error = before_result.get()
+  finally:
+    pool.close()
+    pool.join()
+  before = None
+  if serialized_before is not None:
+    before = proto_class()
+    before.MergeFromString(serialized_before)
+  return [(before, before_error), after]
+
+
+class _DifferenceFunctions(object):
+  """The functions computing and printing the differences of toolchains."""
+
+  def __init__(self, diff, has_difference, format_differences,
+               difference_to_json):
+    self.diff = diff
+    self.has_difference = has_difference
+    self.format_differences = format_differences
+    self.difference_to_json = difference_to_json
+
+
+def _difference_functions():
+  """Returns the _DifferenceFunctions of the structural or --semantic mode."""
+  if not flags.FLAGS.semantic:
+    return _DifferenceFunctions(diff_ctoolchains, has_difference,
+                                format_differences, difference_to_json)
+  configurations = None
+  variable_sets = None
+  if flags.FLAGS.semantic_matrix:
+    matrix_file = _to_absolute_path(flags.FLAGS.semantic_matrix)
+    try:
+      with open(matrix_file) as f:
+        configurations, variable_sets = parse_matrix(f.read())
+    except (IOError, ValueError) as e:
+      print("Error reading --semantic_matrix '%s': %s" % (matrix_file, e))
+      exit(1)
+  # A partial of a module function can be sent to the worker processes.
+  diff = functools.partial(
+      diff_expanded_ctoolchains,
+      configurations=configurations,
+      variable_sets=variable_sets)
+  return _DifferenceFunctions(diff, has_semantic_difference,
+                              format_semantic_differences,
+                              semantic_difference_to_json)
+
+
+def _diff_serialized_ctoolchains(diff_and_serialized_toolchains):
+  """Returns the differences of the toolchains and the time it took."""
+  start = timeit.default_timer()
+  diff, serialized_before, serialized_after = diff_and_serialized_toolchains
+  toolchain_before = crosstool_config_pb2.CToolchain()
+  toolchain_before.MergeFromString(serialized_before)
+  toolchain_after = crosstool_config_pb2.CToolchain()
+  toolchain_after.MergeFromString(serialized_after)
+  differences = diff(toolchain_before, toolchain_after)
+  return differences, timeit.default_timer() - start
+
+
+def diff_toolchain_pairs(pairs, jobs, timer=None, diff=diff_ctoolchains):
+  """Returns the list of differences of every pair from pair_toolchains.
+
+  diff is the function computing the differences of two toolchains. With more
+  than one job the toolchains are sent serialized to a pool of worker
+  processes. The comparison is timed as the "compare" phase of the timer, with
+  the time of every toolchain recorded as an item.
+  """
+  timer = timer or PhaseTimer(enabled=False)
+  if jobs <= 1:
+    all_differences = []
+    for identifier, before, after in pairs:
+      with timer.phase("compare", item=identifier):
+        all_differences.append(diff(before, after))
+    return all_differences
+  with timer.phase("compare"):
+    serialized_pairs = [(diff, before.SerializePartialToString(),
+                         after.SerializePartialToString())
+                        for _, before, after in pairs]
+    pool = multiprocessing.Pool(jobs)
+    try:
+      results = pool.map(_diff_serialized_ctoolchains, serialized_pairs)
+    finally:
+      pool.close()
+      pool.join()
+  for (identifier, _, _), (_, seconds) in zip(pairs, results):
+    timer.record_item("compare", identifier, seconds)
+  return [differences for differences, _ in results]
+
+
+def _compare_all(before_file, after_file, input_format, output_format, jobs,
+                 functions, timer):
+  """Compares all toolchains, returns whether any difference was found."""
+  crosstools = _read_before_and_after(_read_crosstool,
+                                      crosstool_config_pb2.CrosstoolRelease,
+                                      (before_file, input_format),
+                                      (after_file, input_format), timer)
+  for _, error in crosstools:
+    if error:
+      print(error)  # pylint: disable=superfluous-parens
+  (crosstool_before, _), (crosstool_after, _) = crosstools
+  if not crosstool_before or not crosstool_after:
+    print("There was an error getting the required CROSSTOOLs.")
+    exit(1)
+
+  pairs, only_before, only_after = pair_toolchains(crosstool_before,
+                                                   crosstool_after)
+  all_differences = diff_toolchain_pairs(pairs, jobs, timer, functions.diff)
+  differing_identifiers = [
+      identifier for (identifier, _, _), differences in zip(
+          pairs, all_differences) if functions.has_difference(differences)
+  ]
+  found_difference = bool(differing_identifiers or only_before or only_after)
+
+  with timer.phase("output"):
+    _print_all_differences(pairs, all_differences, only_before, only_after,
+                           differing_identifiers, found_difference,
+                           output_format, functions)
+  return found_difference
+
+
+def _print_all_differences(pairs, all_differences, only_before, only_after,
+                           differing_identifiers, found_difference,
+                           output_format, functions):
+  """Prints the differences of all toolchains in the output format."""
+  if output_format == "json":
+    toolchain_results = []
+    for (identifier, _, _), differences in zip(pairs, all_differences):
+      toolchain_results.append({
+          "toolchain_identifier": identifier,
+          "found_difference": functions.has_difference(differences),
+          "differences": [
+              functions.difference_to_json(d) for d in differences
+          ],
+      })
+    print(
+        json.dumps(
+            {
+                "found_difference": found_difference,
+                "only_before": only_before,
+                "only_after": only_after,
+                "toolchains": toolchain_results,
+            },
+            sort_keys=True))
+    return
+
+  for (identifier, _, _), differences in zip(pairs, all_differences):
+    print("Toolchain '%s':" % identifier)  # pylint: disable=superfluous-parens
+    print(functions.format_differences(differences))  # pylint: disable=superfluous-parens
+    print("")  # pylint: disable=superfluous-parens
+  if only_before:
+    print("Toolchains only in --before:\n\t%s" % "\n\t".join(only_before))
+  if only_after:
+    print("Toolchains only in --after:\n\t%s" % "\n\t".join(only_after))
+  print("Compared %d toolchains, %d differ, %d only before, %d only after." %
+        (len(pairs), len(differing_identifiers), len(only_before),
+         len(only_after)))
 
 
 def main(unused_argv):
+  timer = PhaseTimer(flags.FLAGS.timings, flags.FLAGS.timings_top_n)
+  try:
+    run_profiled(flags.FLAGS.profile, _compare, timer)
+  finally:
+    timer.report()
+
 
+def _compare(timer):
+  """Compares the toolchains, exits with 1 when any difference was found."""
   before_file = _to_absolute_path(flags.FLAGS.before)
   after_file = _to_absolute_path(flags.FLAGS.after)
   toolchain_identifier = flags.FLAGS.toolchain_identifier
+  input_format = flags.FLAGS.input_format
 
-  toolchain_before = _read_crosstool_or_ctoolchain_proto(
-      before_file, toolchain_identifier)
-  toolchain_after = _read_crosstool_or_ctoolchain_proto(after_file,
-                                                        toolchain_identifier)
+  if flags.FLAGS.all == bool(toolchain_identifier):
+    raise app.UsageError(
+        "ERROR exactly one of --toolchain_identifier and --all must be passed")
+  if flags.FLAGS.semantic_matrix and not flags.FLAGS.semantic:
+    raise app.UsageError("ERROR --semantic_matrix requires --semantic")
+  functions = _difference_functions()
+  if flags.FLAGS.all:
+    if _compare_all(before_file, after_file, input_format, flags.FLAGS.format,
+                    flags.FLAGS.jobs, functions, timer):
+      exit(1)
+    return
+
+  toolchains = _read_before_and_after(_read_crosstool_or_ctoolchain_proto,
+                                      crosstool_config_pb2.CToolchain,
+                                      (before_file, toolchain_identifier,
+                                       input_format),
+                                      (after_file, toolchain_identifier,
+                                       input_format), timer)
+  for _, error in toolchains:
+    if error:
+      print(error)  # pylint: disable=superfluous-parens
+  (toolchain_before, _), (toolchain_after, _) = toolchains
 
   if not toolchain_before or not toolchain_after:
     print("There was an error getting the required toolchains.")
     exit(1)
 
-  found_difference = compare_ctoolchains(toolchain_before, toolchain_after)
+  with timer.phase("compare", item=toolchain_identifier):
+    differences = functions.diff(toolchain_before, toolchain_after)
+  found_difference = functions.has_difference(differences)
+  with timer.phase("output"):
+    if flags.FLAGS.format == "json":
+      print(
+          json.dumps(
+              {
+                  "toolchain_identifier": toolchain_identifier,
+                  "found_difference": found_difference,
+                  "differences": [
+                      functions.difference_to_json(d) for d in differences
+                  ],
+              },
+              sort_keys=True))
+    else:
+      print(functions.format_differences(differences))  # pylint: disable=superfluous-parens
   if found_difference:
     exit(1)
 
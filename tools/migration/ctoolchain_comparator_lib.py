@@ -11,23 +11,79 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Module providing compare_ctoolchains function.
+"""Module providing compare_ctoolchains and diff_ctoolchains functions.
 
 compare_ctoolchains takes in two parsed CToolchains and compares them
-"""
 
+diff_ctoolchains returns the differences between two parsed CToolchains as a
+list of Difference records, which can be rendered as text with
+format_differences or converted to JSON with difference_to_json. Values of
+the records are kept as they are in the toolchains, so no formatting work is
+done unless the differences are rendered.
+"""
 
-def _print_difference(field_name, before_value, after_value):
+import collections
+from google.protobuf import json_format
+from google.protobuf import message
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+REORDERED = "reordered"
+
+# Fields identifying the elements of repeated message fields.
+_KEY_FIELDS = {
+    "feature": "name",
+    "action_config": "config_name",
+    "tool_path": "name",
+    "make_variable": "name",
+    "artifact_name_pattern": "category_name",
+}
+
+
+class Difference(
+    collections.namedtuple("Difference",
+                           ["field", "name", "kind", "before", "after"])):
+  """A single difference between two CToolchains.
+
+  field is the name of the CToolchain field, name identifies the element of a
+  repeated field (None for singular fields and whole lists) and kind is one of
+  ADDED, REMOVED, CHANGED and REORDERED.
+  """
+  __slots__ = ()
+
+  @property
+  def path(self):
+    """Returns the field path of the difference, e.g. "feature[name=opt]"."""
+    if self.name is None:
+      return self.field
+    return "%s[%s=%s]" % (self.field, _KEY_FIELDS[self.field], self.name)
+
+
+def _value_difference(field_name, before_value, after_value):
   if not before_value and after_value:
-    print(("Difference in '%s' field:\nValue before change is not set\n"
-           "Value after change is set to '%s'") % (field_name, after_value))
+    kind = ADDED
   elif before_value and not after_value:
-    print(("Difference in '%s' field:\nValue before change is set to '%s'\n"
-           "Value after change is not set") % (field_name, before_value))
+    kind = REMOVED
   else:
-    print(("Difference in '%s' field:\nValue before change:\t'%s'\n"
-           "Value after change:\t'%s'\n") % (field_name, before_value,
-                                             after_value))
+    kind = CHANGED
+  return Difference(field_name, None, kind, before_value, after_value)
+
+
+def _format_value_difference(difference):
+  if difference.kind == ADDED:
+    return ("Difference in '%s' field:\nValue before change is not set\n"
+            "Value after change is set to '%s'") % (difference.field,
+                                                   difference.after)
+  elif difference.kind == REMOVED:
+    return ("Difference in '%s' field:\nValue before change is set to '%s'\n"
+            "Value after change is not set") % (difference.field,
+                                               difference.before)
+  else:
+    return ("Difference in '%s' field:\nValue before change:\t'%s'\n"
+            "Value after change:\t'%s'\n") % (difference.field,
+                                              difference.before,
+                                              difference.after)
 
 
 def _array_to_string(arr, ordered=False):
@@ -45,9 +101,9 @@ def _check_with_feature_set_equivalence(before, after):
   before_set = set()
   after_set = set()
   for el in before:
-    before_set.add((str(set(el.feature)), str(set(el.not_feature))))
+    before_set.add((frozenset(el.feature), frozenset(el.not_feature)))
   for el in after:
-    after_set.add((str(set(el.feature)), str(set(el.not_feature))))
+    after_set.add((frozenset(el.feature), frozenset(el.not_feature)))
   return before_set == after_set
 
 
@@ -179,345 +235,310 @@ def _check_feature_equivalence(before, after):
   return True
 
 
-def _compare_features(features_before, features_after):
-  """Compares two "CToolchain.FlagFeature" lists."""
-  feature_name_to_feature_before = {}
-  feature_name_to_feature_after = {}
-  for feature in features_before:
-    feature_name_to_feature_before[feature.name] = feature
-  for feature in features_after:
-    feature_name_to_feature_after[feature.name] = feature
-
-  feature_names_before = set(feature_name_to_feature_before.keys())
-  feature_names_after = set(feature_name_to_feature_after.keys())
-
-  before_after_diff = feature_names_before - feature_names_after
-  after_before_diff = feature_names_after - feature_names_before
-
-  diff_string = "Difference in 'feature' field:"
-  found_difference = False
-  if before_after_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List before change contains entries for the following features "
-           "that the list after the change doesn't:\n%s") % _array_to_string(
-               before_after_diff, ordered=True))
-  if after_before_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List after change contains entries for the following features "
-           "that the list before the change doesn't:\n%s") % _array_to_string(
-               after_before_diff, ordered=True))
-
-  names_before = [feature.name for feature in features_before]
-  names_after = [feature.name for feature in features_after]
-  if names_before != names_after:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("Features not in right order:\n"
-           "* List of features before change:\t%s"
-           "* List of features before change:\t%s") %
-          (_array_to_string(names_before), _array_to_string(names_after)))
-  for name in feature_name_to_feature_before:
-    feature_before = feature_name_to_feature_before[name]
-    feature_after = feature_name_to_feature_after.get(name, None)
-    if feature_after and not _check_feature_equivalence(feature_before,
-                                                        feature_after):
-      if not found_difference:
-        print(diff_string)  # pylint: disable=superfluous-parens
-        found_difference = True
-      print(("* Feature '%s' differs before and after the change:\n"
-             "Value before change:\n%s\n"
-             "Value after change:\n%s") % (name, str(feature_before),
-                                           str(feature_after)))
-  if found_difference:
-    print("")  # pylint: disable=superfluous-parens
-  return found_difference
-
-
-def _compare_action_configs(action_configs_before, action_configs_after):
-  """Compares two "CToolchain.ActionConfig" lists."""
-  action_name_to_action_before = {}
-  action_name_to_action_after = {}
-  for action_config in action_configs_before:
-    action_name_to_action_before[action_config.config_name] = action_config
-  for action_config in action_configs_after:
-    action_name_to_action_after[action_config.config_name] = action_config
-
-  config_names_before = set(action_name_to_action_before.keys())
-  config_names_after = set(action_name_to_action_after.keys())
-
-  before_after_diff = config_names_before - config_names_after
-  after_before_diff = config_names_after - config_names_before
-
-  diff_string = "Difference in 'action_config' field:"
-  found_difference = False
-  if before_after_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List before change contains entries for the following "
-           "action_configs that the list after the change doesn't:\n%s") %
-          _array_to_string(before_after_diff, ordered=True))
-  if after_before_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List after change contains entries for the following "
-           "action_configs that the list before the change doesn't:\n%s") %
-          _array_to_string(after_before_diff, ordered=True))
-
-  names_before = [config.config_name for config in action_configs_before]
-  names_after = [config.config_name for config in action_configs_after]
-  if names_before != names_after:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("Action configs not in right order:\n"
-           "* List of action configs before change:\t%s"
-           "* List of action_configs before change:\t%s") %
-          (_array_to_string(names_before), _array_to_string(names_after)))
-  for name in config_names_before:
-    action_config_before = action_name_to_action_before[name]
-    action_config_after = action_name_to_action_after.get(name, None)
-    if action_config_after and not _check_action_config_equivalence(
-        action_config_before, action_config_after):
-      if not found_difference:
-        print(diff_string)  # pylint: disable=superfluous-parens
-        found_difference = True
-      print(("* Action config '%s' differs before and after the change:\n"
-             "Value before change:\n%s\n"
-             "Value after change:\n%s") % (name, str(action_config_before),
-                                           str(action_config_after)))
-  if found_difference:
-    print("")  # pylint: disable=superfluous-parens
-  return found_difference
-
-
-def _compare_tool_paths(tool_paths_before, tool_paths_after):
-  """Compares two "CToolchain.ToolPath" lists."""
-  tool_to_path_before = {}
-  tool_to_path_after = {}
-  for tool_path in tool_paths_before:
-    tool_to_path_before[tool_path.name] = (
-        tool_path.path if tool_path.path != "NOT_USED" else "")
-  for tool_path in tool_paths_after:
-    tool_to_path_after[tool_path.name] = (
-        tool_path.path if tool_path.path != "NOT_USED" else "")
-
-  tool_names_before = set(tool_to_path_before.keys())
-  tool_names_after = set(tool_to_path_after.keys())
-
-  before_after_diff = tool_names_before - tool_names_after
-  after_before_diff = tool_names_after - tool_names_before
-
-  diff_string = "Difference in 'tool_path' field:"
-  found_difference = False
-  if before_after_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List before change contains entries for the following tools "
-           "that the list after the change doesn't:\n%s") % _array_to_string(
-               before_after_diff, ordered=True))
-  if after_before_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List after change contains entries for the following tools that "
-           "the list before the change doesn't:\n%s") % _array_to_string(
-               after_before_diff, ordered=True))
-
-  for tool in tool_to_path_before:
-    path_before = tool_to_path_before[tool]
-    path_after = tool_to_path_after.get(tool, None)
-    if path_after and path_after != path_before:
-      if not found_difference:
-        print(diff_string)  # pylint: disable=superfluous-parens
-        found_difference = True
-      print(("* Path for tool '%s' differs before and after the change:\n"
-             "Value before change:\t'%s'\n"
-             "Value after change:\t'%s'") % (tool, path_before, path_after))
-  if found_difference:
-    print("")  # pylint: disable=superfluous-parens
-  return found_difference
-
-
-def _compare_make_variables(make_variables_before, make_variables_after):
-  """Compares two "CToolchain.MakeVariable" lists."""
-  name_to_variable_before = {}
-  name_to_variable_after = {}
-  for variable in make_variables_before:
-    name_to_variable_before[variable.name] = variable.value
-  for variable in make_variables_after:
-    name_to_variable_after[variable.name] = variable.value
-
-  variable_names_before = set(name_to_variable_before.keys())
-  variable_names_after = set(name_to_variable_after.keys())
-
-  before_after_diff = variable_names_before - variable_names_after
-  after_before_diff = variable_names_after - variable_names_before
-
-  diff_string = "Difference in 'make_variable' field:"
-  found_difference = False
-  if before_after_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List before change contains entries for the following variables "
-           "that the list after the change doesn't:\n%s") % _array_to_string(
-               before_after_diff, ordered=True))
-  if after_before_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List after change contains entries for the following variables "
-           "that the list before the change doesn't:\n%s") % _array_to_string(
-               after_before_diff, ordered=True))
-
-  for variable in name_to_variable_before:
-    value_before = name_to_variable_before[variable]
-    value_after = name_to_variable_after.get(variable, None)
-    if value_after and value_after != value_before:
-      if not found_difference:
-        print(diff_string)  # pylint: disable=superfluous-parens
-        found_difference = True
-      print(
-          ("* Value for variable '%s' differs before and after the change:\n"
-           "Value before change:\t'%s'\n"
-           "Value after change:\t'%s'") % (variable, value_before, value_after))
-  if found_difference:
-    print("")  # pylint: disable=superfluous-parens
-  return found_difference
-
-
-def _compare_cxx_builtin_include_directories(directories_before,
-                                             directories_after):
-  if directories_before != directories_after:
-    print(("Difference in 'cxx_builtin_include_directory' field:\n"
-           "List of elements before change:\n%s\n"
-           "List of elements after change:\n%s\n") %
-          (_array_to_string(directories_before),
-           _array_to_string(directories_after)))
-    return True
+def _diff_keyed_elements(field_name, elements_before, elements_after,
+                         check_equivalence, check_order):
+  """Returns the differences between two lists of keyed messages."""
+  key_field = _KEY_FIELDS[field_name]
+  element_by_key_before = {}
+  element_by_key_after = {}
+  for element in elements_before:
+    element_by_key_before[getattr(element, key_field)] = element
+  for element in elements_after:
+    element_by_key_after[getattr(element, key_field)] = element
+
+  keys_before = set(element_by_key_before.keys())
+  keys_after = set(element_by_key_after.keys())
+
+  differences = []
+  for key in sorted(keys_before - keys_after):
+    differences.append(
+        Difference(field_name, key, REMOVED, element_by_key_before[key], None))
+  for key in sorted(keys_after - keys_before):
+    differences.append(
+        Difference(field_name, key, ADDED, None, element_by_key_after[key]))
+
+  if check_order:
+    keys_in_order_before = [
+        getattr(element, key_field) for element in elements_before
+    ]
+    keys_in_order_after = [
+        getattr(element, key_field) for element in elements_after
+    ]
+    if keys_in_order_before != keys_in_order_after:
+      differences.append(
+          Difference(field_name, None, REORDERED, keys_in_order_before,
+                     keys_in_order_after))
+
+  # Iterate in the order of the list to keep the output deterministic.
+  compared_keys = set()
+  for element in elements_before:
+    key = getattr(element, key_field)
+    if key in compared_keys:
+      continue
+    compared_keys.add(key)
+    element_before = element_by_key_before[key]
+    element_after = element_by_key_after.get(key, None)
+    if element_after is None:
+      continue
+    # Identical elements are equivalent, the native message comparison is much
+    # cheaper than the recursive walk of the _check_*_equivalence functions
+    # which is only needed when the elements differ, e.g. in the order of
+    # elements compared as sets.
+    if element_before == element_after:
+      continue
+    if not check_equivalence(element_before, element_after):
+      differences.append(
+          Difference(field_name, key, CHANGED, element_before, element_after))
+  return differences
+
+
+def _tool_path(tool_path):
+  return tool_path.path if tool_path.path != "NOT_USED" else ""
+
+
+def _check_tool_path_equivalence(before, after):
+  # A tool path that is not set after the change is not reported.
+  path_after = _tool_path(after)
+  return not path_after or path_after == _tool_path(before)
+
+
+def _check_make_variable_equivalence(before, after):
+  # A variable value that is not set after the change is not reported.
+  return not after.value or after.value == before.value
+
+
+def _check_artifact_name_pattern_equivalence(before, after):
+  return (before.prefix, before.extension) == (after.prefix, after.extension)
+
+
+_SCALAR_FIELDS = [
+    "toolchain_identifier",
+    "host_system_name",
+    "target_system_name",
+    "target_cpu",
+    "target_libc",
+    "compiler",
+    "abi_version",
+    "abi_libc_version",
+    "cc_target_os",
+    "builtin_sysroot",
+]
+
+
+def diff_ctoolchains(toolchain_before, toolchain_after):
+  """Returns the list of Differences between two CToolchains.
+
+  The differences are ordered as they are reported by compare_ctoolchains.
+  """
+  differences = []
+  for field_name in _SCALAR_FIELDS:
+    before_value = getattr(toolchain_before, field_name)
+    after_value = getattr(toolchain_after, field_name)
+    if before_value != after_value:
+      differences.append(
+          _value_difference(field_name, before_value, after_value))
+  differences.extend(
+      _diff_keyed_elements("feature", toolchain_before.feature,
+                           toolchain_after.feature, _check_feature_equivalence,
+                           True))
+  differences.extend(
+      _diff_keyed_elements("action_config", toolchain_before.action_config,
+                           toolchain_after.action_config,
+                           _check_action_config_equivalence, True))
+  differences.extend(
+      _diff_keyed_elements("tool_path", toolchain_before.tool_path,
+                           toolchain_after.tool_path,
+                           _check_tool_path_equivalence, False))
+  if (toolchain_before.cxx_builtin_include_directory !=
+      toolchain_after.cxx_builtin_include_directory):
+    differences.append(
+        Difference("cxx_builtin_include_directory", None, CHANGED,
+                   list(toolchain_before.cxx_builtin_include_directory),
+                   list(toolchain_after.cxx_builtin_include_directory)))
+  differences.extend(
+      _diff_keyed_elements("make_variable", toolchain_before.make_variable,
+                           toolchain_after.make_variable,
+                           _check_make_variable_equivalence, False))
+  differences.extend(
+      _diff_keyed_elements("artifact_name_pattern",
+                           toolchain_before.artifact_name_pattern,
+                           toolchain_after.artifact_name_pattern,
+                           _check_artifact_name_pattern_equivalence, False))
+  return differences
+
+
+def pair_toolchains(crosstool_before, crosstool_after):
+  """Pairs the toolchains of two CrosstoolReleases by toolchain_identifier.
+
+  Returns a tuple of the list of (identifier, toolchain before, toolchain after)
+  triples in the order of crosstool_before, the list of identifiers only found
+  in crosstool_before and the list of identifiers only found in
+  crosstool_after. When multiple toolchains share an identifier, the first one
+  is used.
+  """
+  toolchain_by_identifier_after = {}
+  for toolchain in crosstool_after.toolchain:
+    toolchain_by_identifier_after.setdefault(toolchain.toolchain_identifier,
+                                             toolchain)
+  pairs = []
+  only_before = []
+  seen_identifiers = set()
+  for toolchain in crosstool_before.toolchain:
+    identifier = toolchain.toolchain_identifier
+    if identifier in seen_identifiers:
+      continue
+    seen_identifiers.add(identifier)
+    toolchain_after = toolchain_by_identifier_after.get(identifier)
+    if toolchain_after is None:
+      only_before.append(identifier)
+    else:
+      pairs.append((identifier, toolchain, toolchain_after))
+  only_after = []
+  for toolchain in crosstool_after.toolchain:
+    identifier = toolchain.toolchain_identifier
+    if identifier not in seen_identifiers:
+      seen_identifiers.add(identifier)
+      only_after.append(identifier)
+  return pairs, only_before, only_after
+
+
+def has_difference(differences):
+  """Returns whether differences contain anything but toolchain_identifier."""
+  for difference in differences:
+    if difference.field != "toolchain_identifier":
+      return True
   return False
 
 
-def _compare_artifact_name_patterns(artifact_name_patterns_before,
-                                    artifact_name_patterns_after):
-  """Compares two "CToolchain.ArtifactNamePattern" lists."""
-  category_to_values_before = {}
-  category_to_values_after = {}
-  for name_pattern in artifact_name_patterns_before:
-    category_to_values_before[name_pattern.category_name] = (
-        name_pattern.prefix, name_pattern.extension)
-  for name_pattern in artifact_name_patterns_after:
-    category_to_values_after[name_pattern.category_name] = (
-        name_pattern.prefix, name_pattern.extension)
-
-  category_names_before = set(category_to_values_before.keys())
-  category_names_after = set(category_to_values_after.keys())
-
-  before_after_diff = category_names_before - category_names_after
-  after_before_diff = category_names_after - category_names_before
-
-  diff_string = "Difference in 'artifact_name_pattern' field:"
-  found_difference = False
-  if before_after_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List before change contains entries for the following categories "
-           "that the list after the change doesn't:\n%s") % _array_to_string(
-               before_after_diff, ordered=True))
-  if after_before_diff:
-    if not found_difference:
-      print(diff_string)  # pylint: disable=superfluous-parens
-      found_difference = True
-    print(("* List after change contains entries for the following categories "
-           "that the list before the change doesn't:\n%s") % _array_to_string(
-               after_before_diff, ordered=True))
-
-  for category in category_to_values_before:
-    value_before = category_to_values_before[category]
-    value_after = category_to_values_after.get(category, None)
-    if value_after and value_after != value_before:
-      if not found_difference:
-        print(diff_string)  # pylint: disable=superfluous-parens
-        found_difference = True
-      print(("* Value for category '%s' differs before and after the change:\n"
-             "Value before change:\tprefix:'%s'\textension:'%s'\n"
-             "Value after change:\tprefix:'%s'\textension:'%s'") %
-            (category, value_before[0], value_before[1], value_after[0],
-             value_after[1]))
-  if found_difference:
-    print("")  # pylint: disable=superfluous-parens
-  return found_difference
+# Maps keyed fields to the noun naming their elements in the text output.
+_ELEMENT_NOUNS = {
+    "feature": "features",
+    "action_config": "action_configs",
+    "tool_path": "tools",
+    "make_variable": "variables",
+    "artifact_name_pattern": "categories",
+}
+
+
+def _format_reordered(difference):
+  if difference.field == "feature":
+    message_format = ("Features not in right order:\n"
+                      "* List of features before change:\t%s"
+                      "* List of features before change:\t%s")
+  else:
+    message_format = ("Action configs not in right order:\n"
+                      "* List of action configs before change:\t%s"
+                      "* List of action_configs before change:\t%s")
+  return message_format % (_array_to_string(difference.before),
+                           _array_to_string(difference.after))
+
+
+def _format_changed(difference):
+  """Returns the text describing a changed element of a keyed field."""
+  before = difference.before
+  after = difference.after
+  if difference.field == "feature":
+    return ("* Feature '%s' differs before and after the change:\n"
+            "Value before change:\n%s\n"
+            "Value after change:\n%s") % (difference.name, str(before),
+                                          str(after))
+  elif difference.field == "action_config":
+    return ("* Action config '%s' differs before and after the change:\n"
+            "Value before change:\n%s\n"
+            "Value after change:\n%s") % (difference.name, str(before),
+                                          str(after))
+  elif difference.field == "tool_path":
+    return ("* Path for tool '%s' differs before and after the change:\n"
+            "Value before change:\t'%s'\n"
+            "Value after change:\t'%s'") % (difference.name, _tool_path(before),
+                                            _tool_path(after))
+  elif difference.field == "make_variable":
+    return ("* Value for variable '%s' differs before and after the change:\n"
+            "Value before change:\t'%s'\n"
+            "Value after change:\t'%s'") % (difference.name, before.value,
+                                            after.value)
+  else:
+    return ("* Value for category '%s' differs before and after the change:\n"
+            "Value before change:\tprefix:'%s'\textension:'%s'\n"
+            "Value after change:\tprefix:'%s'\textension:'%s'") % (
+                difference.name, before.prefix, before.extension,
+                after.prefix, after.extension)
+
+
+def _format_keyed_differences(field_name, differences):
+  """Returns the text lines describing the differences of a keyed field."""
+  noun = _ELEMENT_NOUNS[field_name]
+  removed = [d.name for d in differences if d.kind == REMOVED]
+  added = [d.name for d in differences if d.kind == ADDED]
+  lines = ["Difference in '%s' field:" % field_name]
+  if removed:
+    lines.append(("* List before change contains entries for the following %s "
+                  "that the list after the change doesn't:\n%s") %
+                 (noun, _array_to_string(removed, ordered=True)))
+  if added:
+    lines.append(("* List after change contains entries for the following %s "
+                  "that the list before the change doesn't:\n%s") %
+                 (noun, _array_to_string(added, ordered=True)))
+  for difference in differences:
+    if difference.kind == REORDERED:
+      lines.append(_format_reordered(difference))
+    elif difference.kind == CHANGED:
+      lines.append(_format_changed(difference))
+  lines.append("")
+  return lines
+
+
+def format_differences(differences):
+  """Returns the human-readable text describing the list of Differences."""
+  lines = []
+  index = 0
+  while index < len(differences):
+    difference = differences[index]
+    if difference.field in _KEY_FIELDS:
+      end = index
+      while (end < len(differences) and
+             differences[end].field == difference.field):
+        end += 1
+      lines.extend(
+          _format_keyed_differences(difference.field, differences[index:end]))
+      index = end
+      continue
+    if difference.field == "cxx_builtin_include_directory":
+      lines.append(("Difference in 'cxx_builtin_include_directory' field:\n"
+                    "List of elements before change:\n%s\n"
+                    "List of elements after change:\n%s\n") %
+                   (_array_to_string(difference.before),
+                    _array_to_string(difference.after)))
+    else:
+      lines.append(_format_value_difference(difference))
+    index += 1
+  if not has_difference(differences):
+    lines.append("No difference")
+  return "\n".join(lines)
+
+
+def _value_to_json(value):
+  if isinstance(value, message.Message):
+    return json_format.MessageToDict(value, preserving_proto_field_name=True)
+  if isinstance(value, (list, tuple)):
+    return [_value_to_json(element) for element in value]
+  return value
+
+
+def difference_to_json(difference):
+  """Returns the Difference as a JSON-serializable dict."""
+  return {
+      "field": difference.field,
+      "name": difference.name,
+      "path": difference.path,
+      "kind": difference.kind,
+      "before": _value_to_json(difference.before),
+      "after": _value_to_json(difference.after),
+  }
 
 
 def compare_ctoolchains(toolchain_before, toolchain_after):
-  """Compares two CToolchains."""
-  found_difference = False
-  if (toolchain_before.toolchain_identifier !=
-      toolchain_after.toolchain_identifier):
-    _print_difference("toolchain_identifier",
-                      toolchain_before.toolchain_identifier,
-                      toolchain_after.toolchain_identifier)
-  if toolchain_before.host_system_name != toolchain_after.host_system_name:
-    _print_difference("host_system_name", toolchain_before.host_system_name,
-                      toolchain_after.host_system_name)
-    found_difference = True
-  if toolchain_before.target_system_name != toolchain_after.target_system_name:
-    _print_difference("target_system_name", toolchain_before.target_system_name,
-                      toolchain_after.target_system_name)
-    found_difference = True
-  if toolchain_before.target_cpu != toolchain_after.target_cpu:
-    _print_difference("target_cpu", toolchain_before.target_cpu,
-                      toolchain_after.target_cpu)
-    found_difference = True
-  if toolchain_before.target_libc != toolchain_after.target_libc:
-    _print_difference("target_libc", toolchain_before.target_libc,
-                      toolchain_after.target_libc)
-    found_difference = True
-  if toolchain_before.compiler != toolchain_after.compiler:
-    _print_difference("compiler", toolchain_before.compiler,
-                      toolchain_after.compiler)
-    found_difference = True
-  if toolchain_before.abi_version != toolchain_after.abi_version:
-    _print_difference("abi_version", toolchain_before.abi_version,
-                      toolchain_after.abi_version)
-    found_difference = True
-  if toolchain_before.abi_libc_version != toolchain_after.abi_libc_version:
-    _print_difference("abi_libc_version", toolchain_before.abi_libc_version,
-                      toolchain_after.abi_libc_version)
-    found_difference = True
-  if toolchain_before.cc_target_os != toolchain_after.cc_target_os:
-    _print_difference("cc_target_os", toolchain_before.cc_target_os,
-                      toolchain_after.cc_target_os)
-    found_difference = True
-  if toolchain_before.builtin_sysroot != toolchain_after.builtin_sysroot:
-    _print_difference("builtin_sysroot", toolchain_before.builtin_sysroot,
-                      toolchain_after.builtin_sysroot)
-    found_difference = True
-  found_difference = _compare_features(
-      toolchain_before.feature, toolchain_after.feature) or found_difference
-  found_difference = _compare_action_configs(
-      toolchain_before.action_config,
-      toolchain_after.action_config) or found_difference
-  found_difference = _compare_tool_paths(
-      toolchain_before.tool_path, toolchain_after.tool_path) or found_difference
-  found_difference = _compare_cxx_builtin_include_directories(
-      toolchain_before.cxx_builtin_include_directory,
-      toolchain_after.cxx_builtin_include_directory) or found_difference
-  found_difference = _compare_make_variables(
-      toolchain_before.make_variable,
-      toolchain_after.make_variable) or found_difference
-  found_difference = _compare_artifact_name_patterns(
-      toolchain_before.artifact_name_pattern,
-      toolchain_after.artifact_name_pattern) or found_difference
-  if not found_difference:
-    print("No difference")  # pylint: disable=superfluous-parens
-  return found_difference
+  """Compares two CToolchains, prints the differences and returns if any."""
+  differences = diff_ctoolchains(toolchain_before, toolchain_after)
+  print(format_differences(differences))  # pylint: disable=superfluous-parens
+  return has_difference(differences)
@@ -16,6 +16,10 @@ import unittest
 from google.protobuf import text_format
 from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
 from tools.migration.ctoolchain_comparator_lib import compare_ctoolchains
+from tools.migration.ctoolchain_comparator_lib import diff_ctoolchains
+from tools.migration.ctoolchain_comparator_lib import difference_to_json
+from tools.migration.ctoolchain_comparator_lib import has_difference
+from tools.migration.ctoolchain_comparator_lib import pair_toolchains
 
 from py import mock
 try:
@@ -1705,5 +1709,121 @@ class CtoolchainComparatorLibTest(unittest.TestCase):
       compare_ctoolchains(first, second)
       self.assertIn("No difference", mock_stdout.getvalue())
 
+  def test_diff_ctoolchains_records(self):
+    first = make_toolchain("""
+        compiler: "gcc"
+        feature { name: "a" }
+        feature { name: "b" enabled: true }
+        make_variable { name: "v" value: "1" }
+    """)
+    second = make_toolchain("""
+        compiler: "clang"
+        feature { name: "b" }
+        feature { name: "c" }
+        tool_path { name: "gcc" path: "/usr/bin/gcc" }
+    """)
+    differences = diff_ctoolchains(first, second)
+    self.assertEqual([(d.path, d.kind) for d in differences], [
+        ("compiler", "changed"),
+        ("feature[name=a]", "removed"),
+        ("feature[name=c]", "added"),
+        ("feature", "reordered"),
+        ("feature[name=b]", "changed"),
+        ("tool_path[name=gcc]", "added"),
+        ("make_variable[name=v]", "removed"),
+    ])
+    self.assertEqual(differences[0].before, "gcc")
+    self.assertEqual(differences[0].after, "clang")
+    self.assertEqual(differences[3].before, ["a", "b"])
+    self.assertEqual(differences[3].after, ["b", "c"])
+    self.assertTrue(has_difference(differences))
+
+  def test_difference_to_json(self):
+    first = make_toolchain("""
+        feature { name: "a" enabled: true }
+    """)
+    second = make_toolchain("""
+        feature { name: "a" }
+    """)
+    difference, = diff_ctoolchains(first, second)
+    self.assertEqual(
+        difference_to_json(difference), {
+            "field": "feature",
+            "name": "a",
+            "path": "feature[name=a]",
+            "kind": "changed",
+            "before": {
+                "name": "a",
+                "enabled": True
+            },
+            "after": {
+                "name": "a"
+            },
+        })
+
+  def test_toolchain_identifier_alone_is_not_a_difference(self):
+    first = make_toolchain("""
+        toolchain_identifier: "first-id"
+    """)
+    second = make_toolchain("""
+        toolchain_identifier: "second-id"
+    """)
+    differences = diff_ctoolchains(first, second)
+    self.assertEqual([d.kind for d in differences], ["changed"])
+    self.assertFalse(has_difference(differences))
+
+  def test_pair_toolchains(self):
+    before = crosstool_config_pb2.CrosstoolRelease()
+    text_format.Merge(
+        """
+        toolchain { toolchain_identifier: "a" compiler: "first" }
+        toolchain { toolchain_identifier: "b" }
+        toolchain { toolchain_identifier: "a" compiler: "duplicate" }
+        toolchain { toolchain_identifier: "c" }
+    """, before)
+    after = crosstool_config_pb2.CrosstoolRelease()
+    text_format.Merge(
+        """
+        toolchain { toolchain_identifier: "d" }
+        toolchain { toolchain_identifier: "c" }
+        toolchain { toolchain_identifier: "a" }
+        toolchain { toolchain_identifier: "d" }
+    """, after)
+    pairs, only_before, only_after = pair_toolchains(before, after)
+    self.assertEqual([identifier for identifier, _, _ in pairs], ["a", "c"])
+    self.assertEqual(pairs[0][1].compiler, "first")
+    self.assertEqual(only_before, ["b"])
+    self.assertEqual(only_after, ["d"])
+
+  def test_identical_elements_skip_detailed_comparison(self):
+    first = make_toolchain("""
+        feature {
+          name: "same"
+          flag_set { action: "a" action: "b" flag_group { flag: "f" } }
+        }
+        feature {
+          name: "reordered"
+          flag_set { action: "a" action: "b" flag_group { flag: "f" } }
+        }
+    """)
+    second = make_toolchain("""
+        feature {
+          name: "same"
+          flag_set { action: "a" action: "b" flag_group { flag: "f" } }
+        }
+        feature {
+          name: "reordered"
+          flag_set { action: "b" action: "a" flag_group { flag: "f" } }
+        }
+    """)
+    with mock.patch(
+        "tools.migration.ctoolchain_comparator_lib._check_feature_equivalence",
+        return_value=True) as check_feature_equivalence:
+      self.assertEqual(diff_ctoolchains(first, second), [])
+    self.assertEqual(check_feature_equivalence.call_count, 1)
+    self.assertEqual(check_feature_equivalence.call_args[0][0].name,
+                     "reordered")
+    self.assertEqual(diff_ctoolchains(first, second), [])
+
 if __name__ == "__main__":
   unittest.main()
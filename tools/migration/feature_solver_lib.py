@@ -0,0 +1,220 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing FeatureSolver class.
+
+FeatureSolver resolves the requested features and action configs of a
+CToolchain to the set of enabled ones, the way Bazel does: features enabled by
+default and all features they imply are enabled, then features whose
+requirements or implications are not met are disabled until a fixed point is
+reached.
+
+Feature sets are bitsets, Python ints whose bits are the interned indexes of
+the feature names, so that resolving many configurations and testing
+with_feature sets are cheap bitwise operations.
+"""
+
+import numbers
+
+
+class FeatureSolver(object):
+  """Resolves requested features of a toolchain to the enabled features.
+
+  Features and action configs are interned in declaration order, followed by
+  the other names used in with_feature sets of the toolchain, so that masks of
+  names can be computed for all of them.
+  """
+
+  def __init__(self, toolchain):
+    """Interns the names of the toolchain and indexes their relations.
+
+    Raises ValueError when a name is specified multiple times or a feature
+    implies or requires a feature that is not defined.
+    """
+    selectables = ([(feature.name, feature) for feature in toolchain.feature] +
+                   [(action_config.config_name, action_config)
+                    for action_config in toolchain.action_config])
+    self._names = []
+    self._index = {}
+    for name, _ in selectables:
+      if name in self._index:
+        raise ValueError(
+            "feature or action config %s is specified multiple times" % name)
+      self._intern(name)
+    self._selectables_mask = (1 << len(self._names)) - 1
+    for name in _with_feature_names(toolchain):
+      if name not in self._index:
+        self._intern(name)
+
+    self.default_mask = 0
+    self._implies = []
+    self._implied_by = [0] * len(selectables)
+    self._requires = []
+    self._providers = {}
+    for index, (name, selectable) in enumerate(selectables):
+      if selectable.enabled:
+        self.default_mask |= 1 << index
+      implies = self._referenced_mask(selectable.implies, name)
+      self._implies.append(implies)
+      for implied in _indexes(implies):
+        self._implied_by[implied] |= 1 << index
+      self._requires.append(
+          tuple(
+              self._referenced_mask(feature_set.feature, name)
+              for feature_set in selectable.requires))
+    for index, feature in enumerate(toolchain.feature):
+      for symbol in feature.provides:
+        self._providers[symbol] = self._providers.get(symbol, 0) | 1 << index
+    self._solutions = {}
+
+  def _intern(self, name):
+    self._index[name] = len(self._names)
+    self._names.append(name)
+
+  def _referenced_mask(self, names, referencing_name):
+    mask = 0
+    for name in names:
+      index = self._index.get(name)
+      if index is None or not (1 << index) & self._selectables_mask:
+        raise ValueError(
+            "feature %s, which is referenced from %s, is not defined" %
+            (name, referencing_name))
+      mask |= 1 << index
+    return mask
+
+  def mask(self, names):
+    """Returns the bitset of the names, names that are not interned are ignored.
+
+    A bitset is returned unchanged.
+    """
+    if isinstance(names, numbers.Integral):
+      return names
+    mask = 0
+    for name in names:
+      index = self._index.get(name)
+      if index is not None:
+        mask |= 1 << index
+    return mask
+
+  def names(self, mask):
+    """Returns the names in the bitset in the order they were interned."""
+    return [self._names[index] for index in _indexes(mask)]
+
+  def with_feature_masks(self, with_feature_sets):
+    """Returns with_feature sets as (features, not_features) bitset tuples.
+
+    The with_feature sets must be ones of the toolchain.
+    """
+    return tuple((self.mask(with_feature.feature),
+                  self.mask(with_feature.not_feature))
+                 for with_feature in with_feature_sets)
+
+  def solve(self, requested=(), unsupported=()):
+    """Returns the bitset of the enabled features and action configs.
+
+    requested and unsupported are names or bitsets. The features enabled by
+    default and the requested ones, except the unsupported ones, are enabled
+    together with all features they imply. Then every feature is disabled
+    that is neither requested nor implied by an enabled feature, or whose
+    implied features are not all enabled, or whose requirements are not met.
+    Raises ValueError when multiple enabled features provide the same symbol.
+    """
+    requested = ((self.default_mask | self.mask(requested)) &
+                 ~self.mask(unsupported) & self._selectables_mask)
+    enabled = self._solutions.get(requested)
+    if enabled is None:
+      enabled = self._disable_unsatisfied(requested,
+                                          self._enable_implied(requested))
+      self._check_provides(enabled)
+      self._solutions[requested] = enabled
+    return enabled
+
+  def _enable_implied(self, requested):
+    enabled = 0
+    pending = requested
+    while pending:
+      bit = pending & -pending
+      pending ^= bit
+      enabled |= bit
+      pending |= self._implies[bit.bit_length() - 1] & ~enabled
+    return enabled
+
+  def _disable_unsatisfied(self, requested, enabled):
+    # Disabling a feature can only make other features unsatisfied, so
+    # repeating the checks until nothing changes reaches the same fixed point
+    # as Bazel's work queue.
+    changed = True
+    while changed:
+      changed = False
+      for index in _indexes(enabled):
+        if not self._is_satisfied(index, requested, enabled):
+          enabled &= ~(1 << index)
+          changed = True
+    return enabled
+
+  def _is_satisfied(self, index, requested, enabled):
+    if not (requested >> index) & 1 and not self._implied_by[index] & enabled:
+      return False
+    if self._implies[index] & ~enabled:
+      return False
+    requires = self._requires[index]
+    return not requires or any(
+        required & enabled == required for required in requires)
+
+  def _check_provides(self, enabled):
+    for symbol, providers in sorted(self._providers.items()):
+      enabled_providers = providers & enabled
+      if enabled_providers & (enabled_providers - 1):
+        raise ValueError(
+            "Symbol %s is provided by all of the following features: %s" %
+            (symbol, " ".join(self.names(enabled_providers))))
+
+
+def is_with_feature_satisfied(with_feature_masks, enabled):
+  """Returns whether any of the with_feature bitset tuples is satisfied.
+
+  A with_feature set is satisfied when all its features and none of its
+  not_features are enabled, no with_feature sets at all are always satisfied.
+  """
+  if not with_feature_masks:
+    return True
+  for features, not_features in with_feature_masks:
+    if features & enabled == features and not not_features & enabled:
+      return True
+  return False
+
+
+def _with_feature_names(toolchain):
+  """Yields the names used in all with_feature sets of the toolchain."""
+  flag_and_env_sets = []
+  for feature in toolchain.feature:
+    flag_and_env_sets.extend(feature.flag_set)
+    flag_and_env_sets.extend(feature.env_set)
+  for action_config in toolchain.action_config:
+    flag_and_env_sets.extend(action_config.flag_set)
+    flag_and_env_sets.extend(action_config.env_set)
+    flag_and_env_sets.extend(action_config.tool)
+  for flag_or_env_set in flag_and_env_sets:
+    for with_feature in flag_or_env_set.with_feature:
+      for name in with_feature.feature:
+        yield name
+      for name in with_feature.not_feature:
+        yield name
+
+
+def _indexes(mask):
+  """Yields the indexes of the bits set in the mask in increasing order."""
+  while mask:
+    bit = mask & -mask
+    mask ^= bit
+    yield bit.bit_length() - 1
@@ -0,0 +1,137 @@
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.feature_solver_lib import FeatureSolver
+from tools.migration.feature_solver_lib import is_with_feature_satisfied
+
+
+def make_solver(toolchain_proto):
+  toolchain = crosstool_config_pb2.CToolchain()
+  text_format.Merge(toolchain_proto, toolchain)
+  return FeatureSolver(toolchain)
+
+
+def solve(solver, requested=(), unsupported=()):
+  return solver.names(solver.solve(requested, unsupported))
+
+
+class FeatureSolverLibTest(unittest.TestCase):
+
+  def test_enabled_by_default(self):
+    solver = make_solver("""
+        feature { name: 'a' enabled: true }
+        feature { name: 'b' }
+        action_config { config_name: 'c' action_name: 'c' enabled: true }
+    """)
+    self.assertEqual(solve(solver), ["a", "c"])
+    self.assertEqual(solve(solver, ["b", "unknown"]), ["a", "b", "c"])
+    self.assertEqual(solve(solver, ["b"], ["a"]), ["b", "c"])
+
+  def test_implies(self):
+    solver = make_solver("""
+        feature { name: 'a' implies: 'b' }
+        feature { name: 'b' implies: 'c' }
+        feature { name: 'c' }
+        action_config { config_name: 'd' action_name: 'd' implies: 'a' }
+    """)
+    self.assertEqual(solve(solver, ["a"]), ["a", "b", "c"])
+    self.assertEqual(solve(solver, ["d"]), ["a", "b", "c", "d"])
+    # Implied features are enabled even when they are unsupported.
+    self.assertEqual(solve(solver, ["a"], ["b"]), ["a", "b", "c"])
+
+  def test_unmet_requirements(self):
+    solver = make_solver("""
+        feature { name: 'a' requires { feature: 'b' feature: 'c' } }
+        feature { name: 'b' }
+        feature { name: 'c' }
+        feature {
+          name: 'd'
+          requires { feature: 'a' }
+          requires { feature: 'c' }
+        }
+    """)
+    self.assertEqual(solve(solver, ["a", "b"]), ["b"])
+    self.assertEqual(solve(solver, ["a", "b", "c"]), ["a", "b", "c"])
+    self.assertEqual(solve(solver, ["d", "c"]), ["c", "d"])
+    self.assertEqual(solve(solver, ["d", "a", "b"]), ["b"])
+
+  def test_disabled_features_disable_implying_and_implied(self):
+    solver = make_solver("""
+        feature { name: 'a' implies: 'b' implies: 'c' }
+        feature { name: 'b' requires { feature: 'd' } }
+        feature { name: 'c' }
+        feature { name: 'd' }
+        feature { name: 'e' implies: 'c' }
+    """)
+    self.assertEqual(solve(solver, ["a"]), [])
+    self.assertEqual(solve(solver, ["a", "c"]), ["c"])
+    self.assertEqual(solve(solver, ["a", "e"]), ["c", "e"])
+    self.assertEqual(solve(solver, ["a", "d"]), ["a", "b", "c", "d"])
+
+  def test_provides(self):
+    solver = make_solver("""
+        feature { name: 'a' provides: 'symbol' }
+        feature { name: 'b' provides: 'symbol' }
+        feature { name: 'c' implies: 'a' implies: 'b' }
+    """)
+    self.assertEqual(solve(solver, ["a"]), ["a"])
+    with self.assertRaises(ValueError) as context:
+      solver.solve(["c"])
+    self.assertEqual(
+        str(context.exception),
+        "Symbol symbol is provided by all of the following features: a b")
+
+  def test_invalid_toolchains(self):
+    with self.assertRaises(ValueError) as context:
+      make_solver("feature { name: 'a' } action_config { config_name: 'a' }")
+    self.assertIn("specified multiple times", str(context.exception))
+    with self.assertRaises(ValueError) as context:
+      make_solver("feature { name: 'a' implies: 'b' }")
+    self.assertIn("feature b, which is referenced from a, is not defined",
+                  str(context.exception))
+    with self.assertRaises(ValueError) as context:
+      make_solver("feature { name: 'a' requires { feature: 'b' } }")
+    self.assertIn("feature b, which is referenced from a, is not defined",
+                  str(context.exception))
+
+  def test_bitsets(self):
+    solver = make_solver("""
+        feature { name: 'a' }
+        feature {
+          name: 'b'
+          flag_set { with_feature { feature: 'a' not_feature: 'x' } }
+        }
+    """)
+    self.assertEqual(solver.mask(["a", "b", "unknown"]), 3)
+    self.assertEqual(solver.mask(5), 5)
+    self.assertEqual(solver.names(6), ["b", "x"])
+    # Names only used in with_feature sets are never enabled.
+    self.assertEqual(solve(solver, ["a", "x"]), ["a"])
+
+  def test_with_feature_masks(self):
+    toolchain = crosstool_config_pb2.CToolchain()
+    text_format.Merge(
+        """
+        feature { name: 'a' }
+        feature { name: 'b' }
+        feature {
+          name: 'c'
+          flag_set {
+            with_feature { feature: 'a' feature: 'b' }
+            with_feature { not_feature: 'a' }
+          }
+        }
+    """, toolchain)
+    solver = FeatureSolver(toolchain)
+    with_feature_masks = solver.with_feature_masks(
+        toolchain.feature[2].flag_set[0].with_feature)
+    self.assertTrue(is_with_feature_satisfied((), 0))
+    self.assertTrue(is_with_feature_satisfied(with_feature_masks, 0))
+    self.assertFalse(
+        is_with_feature_satisfied(with_feature_masks, solver.mask(["a"])))
+    self.assertTrue(
+        is_with_feature_satisfied(with_feature_masks, solver.mask(["a", "b"])))
+
+
+if __name__ == "__main__":
+  unittest.main()
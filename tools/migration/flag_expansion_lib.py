@@ -0,0 +1,565 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing compile_expansion_plan function.
+
+compile_expansion_plan compiles the flag sets and env sets of a CToolchain into
+an ExpansionPlan, which expands the command line and the environment of an
+action for a set of enabled features and build variables the way Bazel does.
+The enabled features are names or a bitset of the FeatureSolver of the plan,
+e.g. the result of resolving the requested features with its solve method.
+
+Build variables are passed as a dict mapping variable names to values. Strings
+and integers are expanded by %{name}, lists are sequences to iterate_over and
+dicts are structures whose fields are referenced as %{name.field}. Variables
+that are missing or None are not available.
+"""
+
+import collections
+import numbers
+from tools.migration.feature_solver_lib import FeatureSolver
+from tools.migration.feature_solver_lib import is_with_feature_satisfied
+
+try:
+  _STRING_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+  # Python 3
+  _STRING_TYPES = (str,)
+
+# A reference to a build variable, path is the tuple of the parts of a dotted
+# name referencing a field of a structure, None for other names.
+_Variable = collections.namedtuple("_Variable", ["name", "path"])
+
+_NO_BINDINGS = {}
+
+
+def compile_expansion_plan(toolchain, shared_cache_keys=False):
+  """Returns the ExpansionPlan of the toolchain.
+
+  With shared_cache_keys the plan memoizes expansions under keys that don't
+  depend on the toolchain, so that a cache can be shared by the plans of
+  toolchains having the same features or action configs, see
+  ExpansionPlan.command_line.
+
+  Raises ValueError when the toolchain is not a valid configuration, e.g. it
+  has a malformed flag or a flag_group with both flags and flag_groups.
+  """
+  solver = FeatureSolver(toolchain)
+  flag_sets_by_action = collections.defaultdict(list)
+  env_sets_by_action = collections.defaultdict(list)
+  # Like Bazel, the flag sets of the action config of an action are expanded
+  # first, followed by those of the features in their order. Bazel ignores the
+  # env sets of action configs, only those of features set the environment.
+  tools_by_action = {}
+  for action_config in toolchain.action_config:
+    if action_config.action_name in tools_by_action:
+      raise ValueError("action %s is configured more than once" %
+                       action_config.action_name)
+    owner = solver.mask([action_config.config_name])
+    tools_by_action[action_config.action_name] = (owner, [
+        (solver.with_feature_masks(tool.with_feature), tool)
+        for tool in action_config.tool
+    ])
+    owner_key = _owner_key(action_config, shared_cache_keys)
+    for flag_set in action_config.flag_set:
+      flag_sets_by_action[action_config.action_name].append(
+          (owner, owner_key, _compile_flag_set(solver, flag_set)))
+  for feature in toolchain.feature:
+    owner = solver.mask([feature.name])
+    owner_key = _owner_key(feature, shared_cache_keys)
+    for flag_set in feature.flag_set:
+      compiled_flag_set = _compile_flag_set(solver, flag_set)
+      for action in flag_set.action:
+        flag_sets_by_action[action].append(
+            (owner, owner_key, compiled_flag_set))
+    for env_set in feature.env_set:
+      compiled_env_set = _compile_env_set(solver, env_set)
+      for action in env_set.action:
+        env_sets_by_action[action].append((owner, owner_key, compiled_env_set))
+  return ExpansionPlan(
+      solver,
+      dict((action, _group_by_owner(flag_sets))
+           for action, flag_sets in flag_sets_by_action.items()),
+      dict((action, _group_by_owner(env_sets))
+           for action, env_sets in env_sets_by_action.items()),
+      tools_by_action)
+
+
+def _owner_key(owner_message, shared_cache_keys):
+  """Returns the serialized feature or action config, None if not shared."""
+  if not shared_cache_keys:
+    return None
+  return owner_message.SerializePartialToString()
+
+
+def _group_by_owner(owned_sets):
+  """Returns the (owner, relevant features, sets, owner key) of owned sets.
+
+  owned_sets is the list of (owner, owner key, compiled flag set or env set)
+  tuples of an action, the sets of an owner are adjacent. The relevant
+  features are the bitset of the owner and of all features in the
+  with_feature sets of its sets, the expansion of the sets only depends on
+  which of them are enabled.
+  """
+  groups = []
+  for owner, owner_key, owned_set in owned_sets:
+    if not groups or groups[-1][0] != owner:
+      groups.append((owner, [owner], [], owner_key))
+    with_features = owned_set[0]
+    for features, not_features in with_features:
+      groups[-1][1][0] |= features | not_features
+    groups[-1][2].append(owned_set)
+  return [(owner, relevant[0], tuple(sets), owner_key)
+          for owner, relevant, sets, owner_key in groups]
+
+
+class ExpansionPlan(object):
+  """The flag sets and env sets of a toolchain, compiled and indexed by action.
+
+  Flag groups without variables and conditions are expanded at compile time,
+  all other flags are parsed once, so that expanding many actions for many
+  configurations only evaluates the conditions and substitutes the variables.
+  """
+
+  def __init__(self, solver, flag_sets_by_action, env_sets_by_action,
+               tools_by_action):
+    self.solver = solver
+    self._flag_sets_by_action = flag_sets_by_action
+    self._env_sets_by_action = env_sets_by_action
+    self._tools_by_action = tools_by_action
+    # Maps bitsets of relevant enabled features to their sorted names.
+    self._enabled_names = {}
+
+  def actions(self):
+    """Returns the sorted names of the actions having flag sets or env sets."""
+    return sorted(
+        set(self._flag_sets_by_action) | set(self._env_sets_by_action))
+
+  def command_line(self,
+                   action,
+                   enabled_features,
+                   variables=None,
+                   cache=None):
+    """Returns the list of flags passed to the action.
+
+    enabled_features are the names or the bitset of the enabled features and
+    action configs, only their flag sets are expanded. The flags of the action
+    config of the action come first, followed by those of the features in the
+    order of the toolchain. Raises ValueError when
+    the variables don't match the flags, e.g. a variable used by a flag is
+    missing.
+
+    cache is an optional dict memoizing the flags of every feature for the
+    enabled features its flag sets depend on, so that configurations differing
+    only in unrelated features reuse the expansions. A cache must only be used
+    with a single mapping of variables. Plans compiled with shared_cache_keys
+    key the flags by the serialized feature or action config and the names of
+    the enabled features its flag sets depend on, such a cache can be shared
+    by the plans of multiple toolchains. The names in with_feature sets are
+    interned also when they are not defined, so the serialized feature
+    determines the features its flag sets depend on.
+    """
+    enabled_features = self.solver.mask(enabled_features)
+    variables = variables or {}
+    command_line = []
+    for owner, relevant, flag_sets, shared_key in (
+        self._flag_sets_by_action.get(action, ())):
+      if not owner & enabled_features:
+        continue
+      if cache is None:
+        _expand_flag_sets(flag_sets, enabled_features, variables, command_line)
+        continue
+      if shared_key is None:
+        key = (action, owner, enabled_features & relevant)
+      else:
+        key = self._shared_cache_key(action, relevant, shared_key,
+                                     enabled_features)
+      flags = cache.get(key)
+      if flags is None:
+        flags = []
+        _expand_flag_sets(flag_sets, enabled_features, variables, flags)
+        flags = tuple(flags)
+        cache[key] = flags
+      command_line.extend(flags)
+    return command_line
+
+  def environment(self,
+                  action,
+                  enabled_features,
+                  variables=None,
+                  cache=None):
+    """Returns the OrderedDict of environment variables set for the action.
+
+    The env sets of the features are expanded in their order, when multiple
+    env sets set a key, the last one wins. Raises ValueError and uses the cache
+    like command_line.
+    """
+    enabled_features = self.solver.mask(enabled_features)
+    variables = variables or {}
+    environment = collections.OrderedDict()
+    for owner, relevant, env_sets, shared_key in self._env_sets_by_action.get(
+        action, ()):
+      if not owner & enabled_features:
+        continue
+      if cache is None:
+        environment.update(
+            _expand_env_sets(env_sets, enabled_features, variables))
+        continue
+      if shared_key is None:
+        key = ("env", action, owner, enabled_features & relevant)
+      else:
+        key = ("env",) + self._shared_cache_key(action, relevant, shared_key,
+                                                enabled_features)
+      env_entries = cache.get(key)
+      if env_entries is None:
+        env_entries = tuple(
+            _expand_env_sets(env_sets, enabled_features, variables))
+        cache[key] = env_entries
+      environment.update(env_entries)
+    return environment
+
+  def _shared_cache_key(self, action, relevant, shared_key, enabled_features):
+    enabled_relevant = enabled_features & relevant
+    enabled_names = self._enabled_names.get(enabled_relevant)
+    if enabled_names is None:
+      enabled_names = tuple(sorted(self.solver.names(enabled_relevant)))
+      self._enabled_names[enabled_relevant] = enabled_names
+    return (action, shared_key, enabled_names)
+
+  def tool(self, action, enabled_features):
+    """Returns the Tool the action runs, None when it is not configured.
+
+    The tool is the first one of the enabled action config of the action whose
+    with_feature sets are satisfied. Raises ValueError when there is none.
+    """
+    enabled_features = self.solver.mask(enabled_features)
+    owner, tools = self._tools_by_action.get(action, (0, ()))
+    if not owner & enabled_features:
+      return None
+    for with_features, tool in tools:
+      if is_with_feature_satisfied(with_features, enabled_features):
+        return tool
+    raise ValueError(
+        "Matching tool for action %s not found for given feature configuration"
+        % action)
+
+
+def _expand_flag_sets(flag_sets, enabled_features, variables, command_line):
+  for with_features, required_variables, expand in flag_sets:
+    if not _is_available(required_variables, variables, _NO_BINDINGS):
+      continue
+    if with_features and not is_with_feature_satisfied(with_features,
+                                                       enabled_features):
+      continue
+    if expand.__class__ is tuple:
+      command_line.extend(expand)
+    else:
+      expand(variables, _NO_BINDINGS, command_line)
+
+
+def _expand_env_sets(env_sets, enabled_features, variables):
+  """Yields the (key, value) tuples of the env sets in order."""
+  for with_features, env_entries in env_sets:
+    if with_features and not is_with_feature_satisfied(with_features,
+                                                       enabled_features):
+      continue
+    for key, value in env_entries:
+      if not isinstance(value, _STRING_TYPES):
+        value = value(variables, _NO_BINDINGS)
+      yield key, value
+
+
+def _compile_flag_set(solver, flag_set):
+  """Returns the (with_features, required variables, expand) tuple."""
+  expanders = [_compile_flag_group(group) for group in flag_set.flag_group]
+  return (solver.with_feature_masks(flag_set.with_feature),
+          tuple(_compile_variable(name)
+                for name in flag_set.expand_if_all_available),
+          _combine_expanders(expanders))
+
+
+def _compile_env_set(solver, env_set):
+  """Returns the (with_features, [(key, value)]) tuple."""
+  return (solver.with_feature_masks(env_set.with_feature),
+          [(entry.key, _compile_flag(entry.value))
+           for entry in env_set.env_entry])
+
+
+def _compile_flag_group(flag_group):
+  """Returns a tuple of flags or a function expanding the flag group.
+
+  A flag group without conditions and iterate_over whose flags don't use
+  variables is expanded to the tuple of its flags at compile time, all other
+  flag groups are compiled to functions appending their flags to a command
+  line.
+  """
+  if flag_group.flag and flag_group.flag_group:
+    raise ValueError(
+        "a flag_group must not contain both a flag and another flag_group")
+  if flag_group.flag:
+    children = [_compile_flag(flag) for flag in flag_group.flag]
+    children = [
+        child if isinstance(child, _STRING_TYPES) else _appending(child)
+        for child in children
+    ]
+  else:
+    children = [_compile_flag_group(group) for group in flag_group.flag_group]
+  conditions = _compile_conditions(flag_group)
+  if (not conditions and not flag_group.HasField("iterate_over") and
+      all(isinstance(child, (tuple,) + _STRING_TYPES) for child in children)):
+    flags = []
+    for child in children:
+      if isinstance(child, tuple):
+        flags.extend(child)
+      else:
+        flags.append(child)
+    return tuple(flags)
+  expand_children = _combine_expanders(children)
+  iterate_over = None
+  if flag_group.HasField("iterate_over"):
+    iterate_over = _compile_variable(flag_group.iterate_over)
+
+  def expand(variables, bindings, command_line):
+    if conditions and not _can_expand(conditions, variables, bindings):
+      return
+    if iterate_over is None:
+      _expand(expand_children, variables, bindings, command_line)
+      return
+    for value in _sequence_value(iterate_over, variables, bindings):
+      nested_bindings = dict(bindings)
+      nested_bindings[iterate_over.name] = value
+      _expand(expand_children, variables, nested_bindings, command_line)
+
+  return expand
+
+
+def _combine_expanders(children):
+  """Returns a tuple of flags or a function expanding all children in order.
+
+  children are the compiled flags and flag groups, consecutive constant ones
+  are merged into a single tuple.
+  """
+  expanders = []
+  for child in children:
+    if isinstance(child, _STRING_TYPES):
+      child = (child,)
+    if isinstance(child, tuple) and expanders and isinstance(
+        expanders[-1], tuple):
+      expanders[-1] += child
+    else:
+      expanders.append(child)
+  if not expanders:
+    return ()
+  if len(expanders) == 1 and isinstance(expanders[0], tuple):
+    return expanders[0]
+
+  def expand(variables, bindings, command_line):
+    for expander in expanders:
+      _expand(expander, variables, bindings, command_line)
+
+  return expand
+
+
+def _appending(expand_flag):
+  """Returns a function appending the flag expanded by expand_flag."""
+
+  def expand(variables, bindings, command_line):
+    command_line.append(expand_flag(variables, bindings))
+
+  return expand
+
+
+def _expand(expander, variables, bindings, command_line):
+  if expander.__class__ is tuple:
+    command_line.extend(expander)
+  else:
+    expander(variables, bindings, command_line)
+
+
+def _compile_conditions(flag_group):
+  """Returns the expand_if_* conditions of the flag group as a tuple.
+
+  The tuple is empty when the flag group has no conditions.
+  """
+  if not (flag_group.expand_if_all_available or
+          flag_group.expand_if_none_available or
+          flag_group.HasField("expand_if_true") or
+          flag_group.HasField("expand_if_false") or
+          flag_group.HasField("expand_if_equal")):
+    return ()
+  return (
+      tuple(
+          _compile_variable(name)
+          for name in flag_group.expand_if_all_available),
+      tuple(
+          _compile_variable(name)
+          for name in flag_group.expand_if_none_available),
+      _compile_variable(flag_group.expand_if_true)
+      if flag_group.HasField("expand_if_true") else None,
+      _compile_variable(flag_group.expand_if_false)
+      if flag_group.HasField("expand_if_false") else None,
+      (_compile_variable(flag_group.expand_if_equal.variable),
+       flag_group.expand_if_equal.value)
+      if flag_group.HasField("expand_if_equal") else None,
+  )
+
+
+def _can_expand(conditions, variables, bindings):
+  """Returns whether the variables satisfy the compiled conditions."""
+  all_available, none_available, if_true, if_false, if_equal = conditions
+  if not _is_available(all_available, variables, bindings):
+    return False
+  for variable in none_available:
+    if _lookup(variable, variables, bindings) is not None:
+      return False
+  if if_true is not None and not _lookup(if_true, variables, bindings):
+    return False
+  if if_false is not None:
+    value = _lookup(if_false, variables, bindings)
+    if value is None or value:
+      return False
+  if if_equal is not None:
+    variable, expected = if_equal
+    value = _lookup(variable, variables, bindings)
+    if value is None or _string_value(variable, value) != expected:
+      return False
+  return True
+
+
+def _is_available(required_variables, variables, bindings):
+  for variable in required_variables:
+    if _lookup(variable, variables, bindings) is None:
+      return False
+  return True
+
+
+def _compile_variable(name):
+  if "." in name:
+    return _Variable(name, tuple(name.split(".")))
+  return _Variable(name, None)
+
+
+def _compile_flag(flag):
+  """Returns the flag if it uses no variables or a function expanding it.
+
+  "%{name}" in a flag is replaced by the value of the variable, "%%" by "%".
+  Raises ValueError for malformed flags.
+  """
+  if "%" not in flag:
+    return flag
+  chunks = []
+  text = []
+  position = 0
+  while position < len(flag):
+    character = flag[position]
+    if character != "%":
+      text.append(character)
+      position += 1
+      continue
+    if flag.startswith("%%", position):
+      text.append("%")
+      position += 2
+      continue
+    if not flag.startswith("%{", position):
+      raise ValueError("expected '{' after '%%' at position %d in flag '%s'" %
+                       (position, flag))
+    end = flag.find("}", position + 2)
+    if end == -1:
+      raise ValueError("expected '}' at position %d in flag '%s'" %
+                       (len(flag), flag))
+    name = flag[position + 2:end]
+    if not name:
+      raise ValueError("expected a variable name at position %d in flag '%s'" %
+                       (position + 2, flag))
+    if text:
+      chunks.append("".join(text))
+      text = []
+    chunks.append(_compile_variable(name))
+    position = end + 1
+  if text:
+    chunks.append("".join(text))
+  if all(isinstance(chunk, _STRING_TYPES) for chunk in chunks):
+    return "".join(chunks)
+
+  def expand_flag(variables, bindings):
+    return "".join([
+        chunk if isinstance(chunk, _STRING_TYPES) else _string_value(
+            chunk, _lookup_required(chunk, variables, bindings))
+        for chunk in chunks
+    ])
+
+  return expand_flag
+
+
+def _lookup(variable, variables, bindings):
+  """Returns the value of the variable, None when it is not available.
+
+  Variables bound by iterate_over shadow the build variables. A dotted name
+  that is not itself a variable references a field of a structure.
+  """
+  name, path = variable
+  value = bindings.get(name)
+  if value is None:
+    value = variables.get(name)
+  if value is not None or path is None:
+    return value
+  value = bindings.get(path[0])
+  if value is None:
+    value = variables.get(path[0])
+  for index in range(1, len(path)):
+    if value is None:
+      return None
+    if not isinstance(value, dict):
+      raise ValueError(
+          "Cannot expand variable '%s': variable '%s' is %s, expected "
+          "structure" % (name, ".".join(path[:index]), _type_name(value)))
+    value = value.get(path[index])
+  return value
+
+
+def _lookup_required(variable, variables, bindings):
+  value = _lookup(variable, variables, bindings)
+  if value is None:
+    raise ValueError("Cannot find variable named '%s'" % variable.name)
+  return value
+
+
+def _string_value(variable, value):
+  if isinstance(value, _STRING_TYPES):
+    return value
+  if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+    return str(value)
+  raise ValueError("Cannot expand variable '%s': expected string, found %s" %
+                   (variable.name, _type_name(value)))
+
+
+def _sequence_value(variable, variables, bindings):
+  value = _lookup_required(variable, variables, bindings)
+  if not isinstance(value, (list, tuple)):
+    raise ValueError("Cannot expand variable '%s': expected sequence, found %s"
+                     % (variable.name, _type_name(value)))
+  return value
+
+
+def _type_name(value):
+  if isinstance(value, bool):
+    return "boolean"
+  if isinstance(value, numbers.Integral):
+    return "integer"
+  if isinstance(value, _STRING_TYPES):
+    return "string"
+  if isinstance(value, dict):
+    return "structure"
+  if isinstance(value, (list, tuple)):
+    return "sequence"
+  return type(value).__name__
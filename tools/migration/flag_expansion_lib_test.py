@@ -0,0 +1,367 @@
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.flag_expansion_lib import compile_expansion_plan
+
+
+def make_plan(toolchain_proto, shared_cache_keys=False):
+  toolchain = crosstool_config_pb2.CToolchain()
+  text_format.Merge(toolchain_proto, toolchain)
+  return compile_expansion_plan(toolchain, shared_cache_keys)
+
+
+def make_flag_group_plan(flag_group_proto):
+  return make_plan("""
+      feature {
+        name: 'feature'
+        flag_set {
+          action: 'c-compile'
+          flag_group { %s }
+        }
+      }
+  """ % flag_group_proto)
+
+
+def expand(plan, variables=None):
+  return plan.command_line("c-compile", ["feature"], variables)
+
+
+class FlagExpansionLibTest(unittest.TestCase):
+
+  def test_constant_flags(self):
+    plan = make_flag_group_plan("flag: '-a' flag: '-b'")
+    self.assertEqual(expand(plan), ["-a", "-b"])
+    self.assertEqual(plan.command_line("c++-compile", ["feature"]), [])
+    self.assertEqual(plan.command_line("c-compile", []), [])
+    self.assertEqual(plan.actions(), ["c-compile"])
+
+  def test_action_config_flag_sets_then_features_in_order(self):
+    plan = make_plan("""
+        feature {
+          name: 'b'
+          flag_set { action: 'c-compile' flag_group { flag: '-b' } }
+          env_set {
+            action: 'c-compile'
+            env_entry { key: 'K' value: 'b' }
+          }
+        }
+        feature {
+          name: 'a'
+          flag_set { action: 'c-compile' flag_group { flag: '-a1' } }
+          flag_set { action: 'c-compile' flag_group { flag: '-a2' } }
+        }
+        action_config {
+          config_name: 'c-compile-config'
+          action_name: 'c-compile'
+          flag_set { flag_group { flag: '-config' } }
+          env_set {
+            env_entry { key: 'K' value: 'config' }
+            env_entry { key: 'L' value: 'config' }
+          }
+        }
+    """)
+    self.assertEqual(
+        plan.command_line("c-compile", ["a", "b", "c-compile-config"]),
+        ["-config", "-b", "-a1", "-a2"])
+    self.assertEqual(
+        list(
+            plan.environment("c-compile", ["b", "c-compile-config"]).items()),
+        [("K", "b")])
+    self.assertEqual(plan.command_line("c-compile", ["a"]), ["-a1", "-a2"])
+
+  def test_action_config_env_sets_are_ignored(self):
+    plan = make_plan("""
+        action_config {
+          config_name: 'c-compile'
+          action_name: 'c-compile'
+          env_set { env_entry { key: 'K' value: 'V' } }
+        }
+    """)
+    self.assertEqual(list(plan.environment("c-compile", ["c-compile"])), [])
+
+  def test_with_feature(self):
+    plan = make_plan("""
+        feature {
+          name: 'feature'
+          flag_set {
+            action: 'c-compile'
+            with_feature { feature: 'a' feature: 'b' }
+            with_feature { not_feature: 'c' }
+            flag_group { flag: '-flag' }
+          }
+        }
+    """)
+    self.assertEqual(plan.command_line("c-compile", ["feature"]), ["-flag"])
+    self.assertEqual(plan.command_line("c-compile", ["feature", "c"]), [])
+    self.assertEqual(
+        plan.command_line("c-compile", ["feature", "a", "b", "c"]), ["-flag"])
+
+  def test_flag_set_expand_if_all_available(self):
+    plan = make_plan("""
+        feature {
+          name: 'feature'
+          flag_set {
+            action: 'c-compile'
+            expand_if_all_available: 'v'
+            flag_group { flag: '-flag' }
+          }
+        }
+    """)
+    self.assertEqual(expand(plan), [])
+    self.assertEqual(expand(plan, {"v": ""}), ["-flag"])
+
+  def test_variables(self):
+    plan = make_flag_group_plan(
+        "flag: '-I%{include}' flag: '100%%' flag: '-O%{level}'")
+    self.assertEqual(
+        expand(plan, {
+            "include": "foo",
+            "level": 2
+        }), ["-Ifoo", "100%", "-O2"])
+
+  def test_missing_variable(self):
+    plan = make_flag_group_plan("flag: '-I%{include}'")
+    with self.assertRaises(ValueError) as context:
+      expand(plan)
+    self.assertIn("Cannot find variable named 'include'",
+                  str(context.exception))
+
+  def test_non_string_variable(self):
+    plan = make_flag_group_plan("flag: '-I%{include}'")
+    with self.assertRaises(ValueError) as context:
+      expand(plan, {"include": ["foo"]})
+    self.assertIn(
+        "Cannot expand variable 'include': expected string, found sequence",
+        str(context.exception))
+
+  def test_malformed_flags(self):
+    for flag in ["%", "%x", "%{", "%{}", "%{foo"]:
+      with self.assertRaises(ValueError):
+        make_flag_group_plan("flag: '%s'" % flag)
+
+  def test_flags_and_flag_groups(self):
+    with self.assertRaises(ValueError) as context:
+      make_flag_group_plan("flag: '-a' flag_group { flag: '-b' }")
+    self.assertIn("must not contain both", str(context.exception))
+
+  def test_duplicate_feature(self):
+    with self.assertRaises(ValueError) as context:
+      make_plan("feature { name: 'a' } feature { name: 'a' }")
+    self.assertIn("specified multiple times", str(context.exception))
+
+  def test_iterate_over(self):
+    plan = make_flag_group_plan("""
+        iterate_over: 'include'
+        flag: '-I'
+        flag: '%{include}'
+    """)
+    self.assertEqual(
+        expand(plan, {"include": ["foo", "bar"]}),
+        ["-I", "foo", "-I", "bar"])
+    self.assertEqual(expand(plan, {"include": []}), [])
+    with self.assertRaises(ValueError) as context:
+      expand(plan, {"include": "foo"})
+    self.assertIn("expected sequence, found string", str(context.exception))
+
+  def test_iterate_over_structures(self):
+    plan = make_flag_group_plan("""
+        iterate_over: 'libraries'
+        flag_group {
+          expand_if_true: 'libraries.whole_archive'
+          flag: '-whole-archive'
+        }
+        flag_group {
+          iterate_over: 'libraries.objects'
+          flag: '%{libraries.name}:%{libraries.objects}'
+        }
+    """)
+    self.assertEqual(
+        expand(
+            plan, {
+                "libraries": [{
+                    "name": "a",
+                    "whole_archive": True,
+                    "objects": ["a1.o", "a2.o"]
+                }, {
+                    "name": "b",
+                    "objects": ["b1.o"]
+                }]
+            }), ["-whole-archive", "a:a1.o", "a:a2.o", "b:b1.o"])
+    with self.assertRaises(ValueError) as context:
+      expand(plan, {"libraries": ["a"]})
+    self.assertIn("is string, expected structure", str(context.exception))
+
+  def test_expand_if_available(self):
+    plan = make_flag_group_plan("""
+        flag_group {
+          expand_if_all_available: 'a'
+          expand_if_all_available: 'b'
+          flag: '-all'
+        }
+        flag_group { expand_if_none_available: 'a' flag: '-none' }
+    """)
+    self.assertEqual(expand(plan), ["-none"])
+    self.assertEqual(expand(plan, {"a": "", "b": None}), [])
+    self.assertEqual(expand(plan, {"a": "", "b": []}), ["-all"])
+
+  def test_expand_if_true_and_false(self):
+    plan = make_flag_group_plan("""
+        flag_group { expand_if_true: 'v' flag: '-true' }
+        flag_group { expand_if_false: 'v' flag: '-false' }
+    """)
+    self.assertEqual(expand(plan), [])
+    for value in [True, 1, "0", ["a"], {"a": "b"}]:
+      self.assertEqual(expand(plan, {"v": value}), ["-true"])
+    for value in [False, 0, "", [], {}]:
+      self.assertEqual(expand(plan, {"v": value}), ["-false"])
+
+  def test_expand_if_equal(self):
+    plan = make_flag_group_plan("""
+        expand_if_equal { variable: 'mode' value: 'opt' }
+        flag: '-O2'
+    """)
+    self.assertEqual(expand(plan), [])
+    self.assertEqual(expand(plan, {"mode": "dbg"}), [])
+    self.assertEqual(expand(plan, {"mode": "opt"}), ["-O2"])
+
+  def test_environment(self):
+    plan = make_plan("""
+        feature {
+          name: 'a'
+          env_set {
+            action: 'c-compile'
+            env_entry { key: 'PATH' value: '/bin' }
+            env_entry { key: 'SYSROOT' value: '%{sysroot}' }
+          }
+        }
+        feature {
+          name: 'b'
+          env_set {
+            action: 'c-compile'
+            with_feature { feature: 'a' }
+            env_entry { key: 'PATH' value: '/usr/bin' }
+          }
+        }
+    """)
+    self.assertEqual(
+        list(
+            plan.environment("c-compile", ["a", "b"], {
+                "sysroot": "/sysroot"
+            }).items()), [("PATH", "/usr/bin"), ("SYSROOT", "/sysroot")])
+    self.assertEqual(list(plan.environment("c-compile", ["b"]).items()), [])
+
+  def test_cache(self):
+    plan = make_plan("""
+        feature { name: 'opt' }
+        feature { name: 'unrelated' }
+        feature {
+          name: 'a'
+          flag_set { action: 'c-compile' flag_group { flag: '-a' } }
+          flag_set {
+            action: 'c-compile'
+            with_feature { feature: 'opt' }
+            flag_group { flag: '-O%{level}' }
+          }
+          env_set {
+            action: 'c-compile'
+            env_entry { key: 'LEVEL' value: '%{level}' }
+          }
+        }
+    """)
+    cache = {}
+    variables = {"level": 2}
+    for enabled in [["a", "opt"], ["a", "opt", "unrelated"]]:
+      self.assertEqual(
+          plan.command_line("c-compile", enabled, variables, cache),
+          ["-a", "-O2"])
+      self.assertEqual(
+          list(
+              plan.environment("c-compile", enabled, variables,
+                               cache).items()), [("LEVEL", "2")])
+    self.assertEqual(len(cache), 2)
+    self.assertEqual(
+        plan.command_line("c-compile", ["a"], variables, cache), ["-a"])
+    self.assertEqual(len(cache), 3)
+
+  def test_shared_cache(self):
+    feature_a = """
+        feature {
+          name: 'a'
+          flag_set { action: 'c-compile' flag_group { flag: '-a' } }
+          flag_set {
+            action: 'c-compile'
+            with_feature { feature: 'opt' }
+            flag_group { flag: '-O%{level}' }
+          }
+        }
+    """
+    toolchains = [
+        "feature { name: 'opt' } feature { name: 'b' }" + feature_a,
+        feature_a + "feature { name: 'c' } feature { name: 'opt' }",
+        feature_a,
+    ]
+    cache = {}
+    variables = {"level": 2}
+    plans = [make_plan(toolchain, True) for toolchain in toolchains[:2]]
+    for plan in plans:
+      self.assertEqual(
+          plan.command_line("c-compile", ["a", "opt"], variables, cache),
+          ["-a", "-O2"])
+      self.assertEqual(
+          plan.command_line("c-compile", ["a"], variables, cache), ["-a"])
+    self.assertEqual(len(cache), 2)
+    # An undefined 'opt' feature is never enabled, like a disabled one.
+    plan = make_plan(toolchains[2], True)
+    self.assertEqual(
+        plan.command_line("c-compile", ["a"], variables, cache), ["-a"])
+    self.assertEqual(len(cache), 2)
+    self.assertEqual(
+        make_plan(toolchains[2]).command_line("c-compile", ["a"], variables),
+        ["-a"])
+
+  def test_solved_features(self):
+    plan = make_plan("""
+        feature {
+          name: 'a'
+          enabled: true
+          implies: 'b'
+          flag_set { action: 'c-compile' flag_group { flag: '-a' } }
+        }
+        feature {
+          name: 'b'
+          flag_set { action: 'c-compile' flag_group { flag: '-b' } }
+        }
+    """)
+    self.assertEqual(
+        plan.command_line("c-compile", plan.solver.solve()), ["-a", "-b"])
+
+  def test_tool(self):
+    plan = make_plan("""
+        feature { name: 'a' }
+        action_config {
+          config_name: 'c-compile'
+          action_name: 'c-compile'
+          tool { tool_path: 'a-gcc' with_feature { feature: 'a' } }
+          tool { tool_path: 'gcc' with_feature { not_feature: 'a' } }
+        }
+    """)
+    self.assertIsNone(plan.tool("c-compile", []))
+    self.assertIsNone(plan.tool("c++-compile", ["c-compile"]))
+    self.assertEqual(plan.tool("c-compile", ["c-compile"]).tool_path, "gcc")
+    self.assertEqual(
+        plan.tool("c-compile", ["a", "c-compile"]).tool_path, "a-gcc")
+    plan = make_plan("""
+        action_config {
+          config_name: 'c-compile'
+          action_name: 'c-compile'
+          tool { tool_path: 'gcc' with_feature { feature: 'a' } }
+        }
+    """)
+    with self.assertRaises(ValueError) as context:
+      plan.tool("c-compile", ["c-compile"])
+    self.assertIn("Matching tool for action c-compile not found",
+                  str(context.exception))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,53 @@
+"""Benchmark measuring how migrate_legacy_fields scales with feature count.
+
+For every requested feature count the script generates a CROSSTOOL with
+toolchains exercising all legacy fields, migrates it and prints the time spent
+per toolchain and per feature. With linear scaling the time per feature stays
+roughly constant as the feature count grows.
+
+Example usage:
+
+bazel run @rules_cc//tools/migration:legacy_fields_migration_benchmark -- \
+--feature_counts=100,1000,10000
+"""
+
+import timeit
+from absl import app
+from absl import flags
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.crosstool_benchmark_lib import make_crosstool
+from tools.migration.legacy_fields_migration_lib import migrate_legacy_fields
+
+flags.DEFINE_list("feature_counts", ["100", "200", "400", "800", "1600"],
+                  "Numbers of features per toolchain to benchmark.")
+flags.DEFINE_integer("toolchains", 10, "Number of toolchains per CROSSTOOL.")
+flags.DEFINE_integer("repetitions", 3,
+                     "How many times to repeat each measurement.")
+
+
+def measure(toolchain_count, feature_count, repetitions):
+  """Returns the best time in seconds of migrating the generated CROSSTOOL."""
+  serialized = make_crosstool(toolchain_count,
+                              feature_count).SerializeToString()
+  timings = []
+  for _ in range(repetitions):
+    crosstool = crosstool_config_pb2.CrosstoolRelease()
+    crosstool.ParseFromString(serialized)
+    start = timeit.default_timer()
+    migrate_legacy_fields(crosstool)
+    timings.append(timeit.default_timer() - start)
+  return min(timings)
+
+
+def main(unused_argv):
+  toolchain_count = flags.FLAGS.toolchains
+  print("%10s %15s %15s" % ("features", "ms/toolchain", "us/feature"))
+  for feature_count in [int(count) for count in flags.FLAGS.feature_counts]:
+    seconds = measure(toolchain_count, feature_count, flags.FLAGS.repetitions)
+    per_toolchain = seconds / toolchain_count
+    print("%10d %15.3f %15.3f" % (feature_count, per_toolchain * 1e3,
+                                  per_toolchain / feature_count * 1e6))
+
+
+if __name__ == "__main__":
+  app.run(main)
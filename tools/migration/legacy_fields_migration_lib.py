@@ -85,235 +85,321 @@ LINKING_MODE_TO_FEATURE_NAME = {
     "MOSTLY_STATIC_LIBRARIES": "static_linking_mode_nodeps_library",
 }
 
+# Legacy CToolchain fields, cleared by the migration.
+LEGACY_FIELDS = [
+    "debian_extra_requires",
+    "gcc_plugin_compiler_flag",
+    "ar_flag",
+    "ar_thin_archives_flag",
+    "gcc_plugin_header_directory",
+    "mao_plugin_header_directory",
+    "supports_normalizing_ar",
+    "supports_thin_archives",
+    "supports_incremental_linker",
+    "supports_dsym",
+    "supports_gold_linker",
+    "default_python_top",
+    "default_python_version",
+    "python_preload_swigdeps",
+    "needsPic",
+    "compilation_mode_flags",
+    "linking_mode_flags",
+    "unfiltered_cxx_flag",
+    "ld_embed_flag",
+    "objcopy_embed_flag",
+    "supports_start_end_lib",
+    "supports_interface_shared_objects",
+    "supports_fission",
+    "supports_embedded_runtimes",
+    "compiler_flag",
+    "cxx_flag",
+    "linker_flag",
+    "dynamic_library_linker_flag",
+    "static_runtimes_filegroup",
+    "dynamic_runtimes_filegroup",
+]
+
+# Features that were previously enabled by Bazel, enabled by the migration.
+PREVIOUSLY_DEFAULT_FEATURES = [
+    "dependency_file", "random_seed", "module_maps", "module_map_home_cwd",
+    "header_module_compile", "include_paths", "pic", "preprocessor_define"
+]
+
+# Fields the migration reads and any of which makes it modify the toolchain.
+_FIELDS_REQUIRING_MIGRATION = frozenset(LEGACY_FIELDS +
+                                        ["test_only_linker_flag"])
+
+
 def migrate_legacy_fields(crosstool):
-  """Migrates parsed crosstool (inplace) to not use legacy fields."""
+  """Migrates parsed crosstool (inplace) to not use legacy fields.
+
+  Returns the number of toolchains that were already migrated and skipped.
+  """
   crosstool.ClearField("default_toolchain")
+  skipped = 0
   for toolchain in crosstool.toolchain:
-    _ = [_migrate_expand_if_all_available(f) for f in toolchain.feature]
-    _ = [_migrate_expand_if_all_available(ac) for ac in toolchain.action_config]
-    _ = [_migrate_repeated_expands(f) for f in toolchain.feature]
-    _ = [_migrate_repeated_expands(ac) for ac in toolchain.action_config]
-
-    if (toolchain.dynamic_library_linker_flag or
-        _contains_dynamic_flags(toolchain)) and not _get_feature(
-            toolchain, "supports_dynamic_linker"):
-      feature = toolchain.feature.add()
-      feature.name = "supports_dynamic_linker"
-      feature.enabled = True
+    if not migrate_toolchain(toolchain):
+      skipped += 1
+  return skipped
+
+
+def is_migrated(toolchain):
+  """Returns whether migrate_toolchain would leave the toolchain unchanged.
+
+  The check looks at the fields set on the toolchain, the names of its features
+  and the expand_if_*_available fields of its flag sets and flag groups,
+  without copying or modifying anything, and returns at the first hit.
+
+  Unlike a check of the top level fields only, this walks every nested flag
+  group of every feature and action config: nested groups can still need
+  migration in a toolchain without legacy fields, so a shallow check would
+  skip toolchains migrate_toolchain changes. The walk costs time linear in
+  the number of flag groups for toolchains that are already migrated.
+  """
+  for field, _ in toolchain.ListFields():
+    if field.name in _FIELDS_REQUIRING_MIGRATION:
+      return False
+  for feature in toolchain.feature:
+    if feature.name in PREVIOUSLY_DEFAULT_FEATURES and not feature.enabled:
+      return False
+  # Flag sets and flag groups _migrate_flag_groups would change.
+  todo_stack = []
+  for messages in (toolchain.feature, toolchain.action_config):
+    for message in messages:
+      for flag_set in message.flag_set:
+        if flag_set.expand_if_all_available:
+          return False
+        todo_stack.extend(flag_set.flag_group)
+  while todo_stack:
+    flag_group = todo_stack.pop()
+    if (len(flag_group.expand_if_all_available) > 1 or
+        len(flag_group.expand_if_none_available) > 1):
+      return False
+    todo_stack.extend(flag_group.flag_group)
+  return True
+
+
+def migrate_toolchain(toolchain):
+  """Migrates a single parsed CToolchain (inplace) to not use legacy fields.
+
+  Toolchains are migrated independently of each other, so this can be applied to
+  the toolchains of a CROSSTOOL in any order or in separate processes.
+
+  Returns False when the toolchain was already migrated and was skipped.
+  """
+  if is_migrated(toolchain):
+    return False
+  features_by_name = _index_features(toolchain)
+  # Features to put before all other features, in reverse order, see
+  # _prepend_feature.
+  prepended_features = []
+  # Maps old to new names of renamed features, references to them are renamed
+  # once all features are migrated.
+  renamed_features = {}
+  for feature in toolchain.feature:
+    _migrate_flag_groups(feature)
+  for action_config in toolchain.action_config:
+    _migrate_flag_groups(action_config)
+
+  if (toolchain.dynamic_library_linker_flag or
+      _contains_dynamic_flags(toolchain)) and not _get_feature(
+      features_by_name, "supports_dynamic_linker"):
+    feature = _add_feature(toolchain, features_by_name,
+                           "supports_dynamic_linker")
+    feature.enabled = True
+
+  if toolchain.supports_start_end_lib and not _get_feature(
+      features_by_name, "supports_start_end_lib"):
+    feature = _add_feature(toolchain, features_by_name,
+                           "supports_start_end_lib")
+    feature.enabled = True
+
+  if toolchain.supports_interface_shared_objects and not _get_feature(
+      features_by_name, "supports_interface_shared_libraries"):
+    feature = _add_feature(toolchain, features_by_name,
+                           "supports_interface_shared_libraries")
+    feature.enabled = True
+
+  if toolchain.supports_embedded_runtimes and not _get_feature(
+      features_by_name, "static_link_cpp_runtimes"):
+    feature = _add_feature(toolchain, features_by_name,
+                           "static_link_cpp_runtimes")
+    feature.enabled = True
+
+  if toolchain.needsPic and not _get_feature(features_by_name,
+                                             "supports_pic"):
+    feature = _add_feature(toolchain, features_by_name, "supports_pic")
+    feature.enabled = True
+
+  if toolchain.supports_fission and not _get_feature(
+      features_by_name, "per_object_debug_info"):
+    # feature {
+    #   name: "per_object_debug_info"
+    #   enabled: true
+    #   flag_set {
+    #     action: "assemble"
+    #     action: "preprocess-assemble"
+    #     action: "c-compile"
+    #     action: "c++-compile"
+    #     action: "c++-module-codegen"
+    #     action: "lto-backend"
+    #     flag_group {
+    #       expand_if_all_available: 'is_using_fission'",
+    #       flag: "-gsplit-dwarf"
+    #     }
+    #   }
+    # }
+    feature = _add_feature(toolchain, features_by_name,
+                           "per_object_debug_info")
+    feature.enabled = True
+    flag_set = feature.flag_set.add()
+    flag_set.action[:] = [
+        "c-compile", "c++-compile", "c++-module-codegen", "assemble",
+        "preprocess-assemble", "lto-backend"
+    ]
+    flag_group = flag_set.flag_group.add()
+    flag_group.expand_if_all_available[:] = ["is_using_fission"]
+    flag_group.flag[:] = ["-gsplit-dwarf"]
 
-    if toolchain.supports_start_end_lib and not _get_feature(
-        toolchain, "supports_start_end_lib"):
-      feature = toolchain.feature.add()
-      feature.name = "supports_start_end_lib"
-      feature.enabled = True
+  if toolchain.objcopy_embed_flag and not _get_feature(
+      features_by_name, "objcopy_embed_flags"):
+    feature = _add_feature(toolchain, features_by_name, "objcopy_embed_flags")
+    feature.enabled = True
+    flag_set = feature.flag_set.add()
+    flag_set.action[:] = ["objcopy_embed_data"]
+    flag_group = flag_set.flag_group.add()
+    flag_group.flag[:] = toolchain.objcopy_embed_flag
+
+    action_config = toolchain.action_config.add()
+    action_config.action_name = "objcopy_embed_data"
+    action_config.config_name = "objcopy_embed_data"
+    action_config.enabled = True
+    tool = action_config.tool.add()
+    tool.tool_path = _find_tool_path(toolchain, "objcopy")
+
+  if toolchain.ld_embed_flag and not _get_feature(
+      features_by_name, "ld_embed_flags"):
+    feature = _add_feature(toolchain, features_by_name, "ld_embed_flags")
+    feature.enabled = True
+    flag_set = feature.flag_set.add()
+    flag_set.action[:] = ["ld_embed_data"]
+    flag_group = flag_set.flag_group.add()
+    flag_group.flag[:] = toolchain.ld_embed_flag
 
-    if toolchain.supports_interface_shared_objects and not _get_feature(
-        toolchain, "supports_interface_shared_libraries"):
-      feature = toolchain.feature.add()
-      feature.name = "supports_interface_shared_libraries"
-      feature.enabled = True
+    action_config = toolchain.action_config.add()
+    action_config.action_name = "ld_embed_data"
+    action_config.config_name = "ld_embed_data"
+    action_config.enabled = True
+    tool = action_config.tool.add()
+    tool.tool_path = _find_tool_path(toolchain, "ld")
 
-    if toolchain.supports_embedded_runtimes and not _get_feature(
-        toolchain, "static_link_cpp_runtimes"):
-      feature = toolchain.feature.add()
-      feature.name = "static_link_cpp_runtimes"
-      feature.enabled = True
 
-    if toolchain.needsPic and not _get_feature(toolchain, "supports_pic"):
-      feature = toolchain.feature.add()
-      feature.name = "supports_pic"
-      feature.enabled = True
+  # Create default_link_flags feature for linker_flag
+  flag_sets = _extract_legacy_link_flag_sets_for(toolchain, features_by_name)
+  if flag_sets:
+    if _get_feature(features_by_name, "default_link_flags"):
+      return True
+    feature = _get_feature(features_by_name, "legacy_link_flags")
+    if feature:
+      feature.ClearField("flag_set")
+      _rename_feature(features_by_name, renamed_features, "legacy_link_flags",
+                      "default_link_flags")
+    else:
+      feature = _prepend_feature(features_by_name, prepended_features,
+                                 "default_link_flags")
+    feature.enabled = True
+    _add_flag_sets(feature, flag_sets)
+
+  # Create default_compile_flags feature for compiler_flag, cxx_flag
+  flag_sets = _extract_legacy_compile_flag_sets_for(toolchain,
+                                                    features_by_name)
+  if flag_sets and not _get_feature(features_by_name,
+                                    "default_compile_flags"):
+    feature = _get_feature(features_by_name, "legacy_compile_flags")
+    if feature:
+      feature.ClearField("flag_set")
+      _rename_feature(features_by_name, renamed_features,
+                      "legacy_compile_flags", "default_compile_flags")
+    else:
+      feature = _prepend_feature(features_by_name, prepended_features,
+                                 "default_compile_flags")
+    feature.enabled = True
+    _add_flag_sets(feature, flag_sets)
+
+  # Unfiltered cxx flags have to have their own special feature.
+  # "unfiltered_compile_flags" is a well-known (by Bazel) feature name that is
+  # excluded from nocopts filtering.
+  if toolchain.unfiltered_cxx_flag:
+    # If there already is a feature named unfiltered_compile_flags, the
+    # crosstool is already migrated for unfiltered_compile_flags
+    if _get_feature(features_by_name, "unfiltered_compile_flags"):
+      for f in toolchain.feature:
+        if f.name == "unfiltered_compile_flags":
+          for flag_set in f.flag_set:
+            for flag_group in flag_set.flag_group:
+              if flag_group.iterate_over == "unfiltered_compile_flags":
+                flag_group.ClearField("iterate_over")
+                flag_group.ClearField("expand_if_all_available")
+                flag_group.ClearField("flag")
+                flag_group.flag[:] = toolchain.unfiltered_cxx_flag
+    else:
+      if not _get_feature(features_by_name, "user_compile_flags"):
+        feature = _add_feature(toolchain, features_by_name,
+                               "user_compile_flags")
+        feature.enabled = True
+        flag_set = feature.flag_set.add()
+        flag_set.action[:] = compile_actions(toolchain)
+        flag_group = flag_set.flag_group.add()
+        flag_group.expand_if_all_available[:] = ["user_compile_flags"]
+        flag_group.iterate_over = "user_compile_flags"
+        flag_group.flag[:] = ["%{user_compile_flags}"]
+
+      if not _get_feature(features_by_name, "sysroot"):
+        sysroot_actions = compile_actions(toolchain) + link_actions(toolchain)
+        sysroot_actions.remove("assemble")
+        feature = _add_feature(toolchain, features_by_name, "sysroot")
+        feature.enabled = True
+        flag_set = feature.flag_set.add()
+        flag_set.action[:] = sysroot_actions
+        flag_group = flag_set.flag_group.add()
+        flag_group.expand_if_all_available[:] = ["sysroot"]
+        flag_group.flag[:] = ["--sysroot=%{sysroot}"]
 
-    if toolchain.supports_fission and not _get_feature(
-        toolchain, "per_object_debug_info"):
-      # feature {
-      #   name: "per_object_debug_info"
-      #   enabled: true
-      #   flag_set {
-      #     action: "assemble"
-      #     action: "preprocess-assemble"
-      #     action: "c-compile"
-      #     action: "c++-compile"
-      #     action: "c++-module-codegen"
-      #     action: "lto-backend"
-      #     flag_group {
-      #       expand_if_all_available: 'is_using_fission'",
-      #       flag: "-gsplit-dwarf"
-      #     }
-      #   }
-      # }
-      feature = toolchain.feature.add()
-      feature.name = "per_object_debug_info"
+      feature = _add_feature(toolchain, features_by_name,
+                             "unfiltered_compile_flags")
       feature.enabled = True
       flag_set = feature.flag_set.add()
-      flag_set.action[:] = [
-          "c-compile", "c++-compile", "c++-module-codegen", "assemble",
-          "preprocess-assemble", "lto-backend"
-      ]
+      flag_set.action[:] = compile_actions(toolchain)
       flag_group = flag_set.flag_group.add()
-      flag_group.expand_if_all_available[:] = ["is_using_fission"]
-      flag_group.flag[:] = ["-gsplit-dwarf"]
+      flag_group.flag[:] = toolchain.unfiltered_cxx_flag
 
-    if toolchain.objcopy_embed_flag and not _get_feature(
-        toolchain, "objcopy_embed_flags"):
-      feature = toolchain.feature.add()
-      feature.name = "objcopy_embed_flags"
-      feature.enabled = True
-      flag_set = feature.flag_set.add()
-      flag_set.action[:] = ["objcopy_embed_data"]
-      flag_group = flag_set.flag_group.add()
-      flag_group.flag[:] = toolchain.objcopy_embed_flag
-
-      action_config = toolchain.action_config.add()
-      action_config.action_name = "objcopy_embed_data"
-      action_config.config_name = "objcopy_embed_data"
-      action_config.enabled = True
-      tool = action_config.tool.add()
-      tool.tool_path = _find_tool_path(toolchain, "objcopy")
-
-    if toolchain.ld_embed_flag and not _get_feature(
-        toolchain, "ld_embed_flags"):
-      feature = toolchain.feature.add()
-      feature.name = "ld_embed_flags"
-      feature.enabled = True
-      flag_set = feature.flag_set.add()
-      flag_set.action[:] = ["ld_embed_data"]
-      flag_group = flag_set.flag_group.add()
-      flag_group.flag[:] = toolchain.ld_embed_flag
-
-      action_config = toolchain.action_config.add()
-      action_config.action_name = "ld_embed_data"
-      action_config.config_name = "ld_embed_data"
-      action_config.enabled = True
-      tool = action_config.tool.add()
-      tool.tool_path = _find_tool_path(toolchain, "ld")
-
-
-    # Create default_link_flags feature for linker_flag
-    flag_sets = _extract_legacy_link_flag_sets_for(toolchain)
-    if flag_sets:
-      if _get_feature(toolchain, "default_link_flags"):
-        continue
-      if _get_feature(toolchain, "legacy_link_flags"):
-        for f in toolchain.feature:
-          if f.name == "legacy_link_flags":
-            f.ClearField("flag_set")
-            feature = f
-            _rename_feature_in_toolchain(toolchain, "legacy_link_flags",
-                                         "default_link_flags")
-            break
-      else:
-        feature = _prepend_feature(toolchain)
-      feature.name = "default_link_flags"
-      feature.enabled = True
-      _add_flag_sets(feature, flag_sets)
-
-    # Create default_compile_flags feature for compiler_flag, cxx_flag
-    flag_sets = _extract_legacy_compile_flag_sets_for(toolchain)
-    if flag_sets and not _get_feature(toolchain, "default_compile_flags"):
-      if _get_feature(toolchain, "legacy_compile_flags"):
-        for f in toolchain.feature:
-          if f.name == "legacy_compile_flags":
-            f.ClearField("flag_set")
-            feature = f
-            _rename_feature_in_toolchain(toolchain, "legacy_compile_flags",
-                                         "default_compile_flags")
-            break
-      else:
-        feature = _prepend_feature(toolchain)
+  # clear fields
+  for field_name in LEGACY_FIELDS:
+    toolchain.ClearField(field_name)
+
+  # Enable features that were previously enabled by Bazel
+  for feature_name in PREVIOUSLY_DEFAULT_FEATURES:
+    feature = _get_feature(features_by_name, feature_name)
+    if feature:
       feature.enabled = True
-      feature.name = "default_compile_flags"
-      _add_flag_sets(feature, flag_sets)
-
-    # Unfiltered cxx flags have to have their own special feature.
-    # "unfiltered_compile_flags" is a well-known (by Bazel) feature name that is
-    # excluded from nocopts filtering.
-    if toolchain.unfiltered_cxx_flag:
-      # If there already is a feature named unfiltered_compile_flags, the
-      # crosstool is already migrated for unfiltered_compile_flags
-      if _get_feature(toolchain, "unfiltered_compile_flags"):
-        for f in toolchain.feature:
-          if f.name == "unfiltered_compile_flags":
-            for flag_set in f.flag_set:
-              for flag_group in flag_set.flag_group:
-                if flag_group.iterate_over == "unfiltered_compile_flags":
-                  flag_group.ClearField("iterate_over")
-                  flag_group.ClearField("expand_if_all_available")
-                  flag_group.ClearField("flag")
-                  flag_group.flag[:] = toolchain.unfiltered_cxx_flag
-      else:
-        if not _get_feature(toolchain, "user_compile_flags"):
-          feature = toolchain.feature.add()
-          feature.name = "user_compile_flags"
-          feature.enabled = True
-          flag_set = feature.flag_set.add()
-          flag_set.action[:] = compile_actions(toolchain)
-          flag_group = flag_set.flag_group.add()
-          flag_group.expand_if_all_available[:] = ["user_compile_flags"]
-          flag_group.iterate_over = "user_compile_flags"
-          flag_group.flag[:] = ["%{user_compile_flags}"]
-
-        if not _get_feature(toolchain, "sysroot"):
-          sysroot_actions = compile_actions(toolchain) + link_actions(toolchain)
-          sysroot_actions.remove("assemble")
-          feature = toolchain.feature.add()
-          feature.name = "sysroot"
-          feature.enabled = True
-          flag_set = feature.flag_set.add()
-          flag_set.action[:] = sysroot_actions
-          flag_group = flag_set.flag_group.add()
-          flag_group.expand_if_all_available[:] = ["sysroot"]
-          flag_group.flag[:] = ["--sysroot=%{sysroot}"]
-
-        feature = toolchain.feature.add()
-        feature.name = "unfiltered_compile_flags"
-        feature.enabled = True
-        flag_set = feature.flag_set.add()
-        flag_set.action[:] = compile_actions(toolchain)
-        flag_group = flag_set.flag_group.add()
-        flag_group.flag[:] = toolchain.unfiltered_cxx_flag
-
-    # clear fields
-    toolchain.ClearField("debian_extra_requires")
-    toolchain.ClearField("gcc_plugin_compiler_flag")
-    toolchain.ClearField("ar_flag")
-    toolchain.ClearField("ar_thin_archives_flag")
-    toolchain.ClearField("gcc_plugin_header_directory")
-    toolchain.ClearField("mao_plugin_header_directory")
-    toolchain.ClearField("supports_normalizing_ar")
-    toolchain.ClearField("supports_thin_archives")
-    toolchain.ClearField("supports_incremental_linker")
-    toolchain.ClearField("supports_dsym")
-    toolchain.ClearField("supports_gold_linker")
-    toolchain.ClearField("default_python_top")
-    toolchain.ClearField("default_python_version")
-    toolchain.ClearField("python_preload_swigdeps")
-    toolchain.ClearField("needsPic")
-    toolchain.ClearField("compilation_mode_flags")
-    toolchain.ClearField("linking_mode_flags")
-    toolchain.ClearField("unfiltered_cxx_flag")
-    toolchain.ClearField("ld_embed_flag")
-    toolchain.ClearField("objcopy_embed_flag")
-    toolchain.ClearField("supports_start_end_lib")
-    toolchain.ClearField("supports_interface_shared_objects")
-    toolchain.ClearField("supports_fission")
-    toolchain.ClearField("supports_embedded_runtimes")
-    toolchain.ClearField("compiler_flag")
-    toolchain.ClearField("cxx_flag")
-    toolchain.ClearField("linker_flag")
-    toolchain.ClearField("dynamic_library_linker_flag")
-    toolchain.ClearField("static_runtimes_filegroup")
-    toolchain.ClearField("dynamic_runtimes_filegroup")
-
-    # Enable features that were previously enabled by Bazel
-    default_features = [
-        "dependency_file", "random_seed", "module_maps", "module_map_home_cwd",
-        "header_module_compile", "include_paths", "pic", "preprocessor_define"
-    ]
-    for feature_name in default_features:
-      feature = _get_feature(toolchain, feature_name)
-      if feature:
-        feature.enabled = True
+
+  _insert_prepended_features(toolchain, prepended_features)
+  # The renamed features are enabled, so they no longer need to be implied.
+  _rename_feature_references(toolchain, renamed_features, remove_implies=True)
+  return True
+
+
+def rename_features(toolchain, renames):
+  """Renames features and all references to them in the toolchain.
+
+  renames is a dict mapping old feature names to new ones. All renames are
+  applied in a single traversal of the features and action_configs, references
+  in implies, requires and with_feature are renamed in place.
+  """
+  for feature in toolchain.feature:
+    if feature.name in renames:
+      feature.name = renames[feature.name]
+  _rename_feature_references(toolchain, renames)
 
 
 def _find_tool_path(toolchain, tool_name):
@@ -346,7 +432,7 @@ def _add_flag_sets(feature, flag_sets):
   return feature
 
 
-def _extract_legacy_compile_flag_sets_for(toolchain):
+def _extract_legacy_compile_flag_sets_for(toolchain, features_by_name):
   """Get flag sets for default_compile_flags feature."""
   result = []
   if toolchain.compiler_flag:
@@ -361,9 +447,8 @@ def _extract_legacy_compile_flag_sets_for(toolchain):
       continue
 
     if (cmf.compiler_flag or
-        cmf.cxx_flag) and not _get_feature(toolchain, mode):
-      feature = toolchain.feature.add()
-      feature.name = mode
+        cmf.cxx_flag) and not _get_feature(features_by_name, mode):
+      _add_feature(toolchain, features_by_name, mode)
 
     if cmf.compiler_flag:
       result.append([mode, compile_actions(toolchain), cmf.compiler_flag, []])
@@ -384,7 +469,7 @@ def _extract_legacy_compile_flag_sets_for(toolchain):
   return result
 
 
-def _extract_legacy_link_flag_sets_for(toolchain):
+def _extract_legacy_link_flag_sets_for(toolchain, features_by_name):
   """Get flag sets for default_link_flags feature."""
   result = []
 
@@ -399,9 +484,8 @@ def _extract_legacy_link_flag_sets_for(toolchain):
     if mode == "coverage":
       continue
 
-    if cmf.linker_flag and not _get_feature(toolchain, mode):
-      feature = toolchain.feature.add()
-      feature.name = mode
+    if cmf.linker_flag and not _get_feature(features_by_name, mode):
+      _add_feature(toolchain, features_by_name, mode)
 
     if cmf.linker_flag:
       result.append([mode, link_actions(toolchain), cmf.linker_flag, []])
@@ -411,12 +495,11 @@ def _extract_legacy_link_flag_sets_for(toolchain):
     mode = crosstool_config_pb2.LinkingMode.Name(lmf.mode)
     feature_name = LINKING_MODE_TO_FEATURE_NAME.get(mode)
     # if the feature is already there, we don't migrate, lmf is not used
-    if _get_feature(toolchain, feature_name):
+    if _get_feature(features_by_name, feature_name):
       continue
 
     if lmf.linker_flag:
-      feature = toolchain.feature.add()
-      feature.name = feature_name
+      _add_feature(toolchain, features_by_name, feature_name)
       if mode == "DYNAMIC":
         result.append(
             [None, NODEPS_DYNAMIC_LIBRARY_LINK_ACTIONS, lmf.linker_flag, []])
@@ -456,72 +539,103 @@ def _extract_legacy_link_flag_sets_for(toolchain):
   return result
 
 
-def _prepend_feature(toolchain):
-  """Create a new feature and make it be the first in the toolchain."""
+def _prepend_feature(features_by_name, prepended_features, name):
+  """Create a new feature that will be the first in the toolchain.
+
+  The feature is not added to the toolchain yet, repeated fields can't insert
+  in front, so all prepended features are inserted at once by
+  _insert_prepended_features when the migration of the toolchain is done.
+  """
+  new_feature = crosstool_config_pb2.CToolchain.Feature()
+  new_feature.name = name
+  prepended_features.append(new_feature)
+  features_by_name.setdefault(name, new_feature)
+  return new_feature
+
+
+def _insert_prepended_features(toolchain, prepended_features):
+  """Puts the features created by _prepend_feature first in the toolchain."""
+  if not prepended_features:
+    return
   features = toolchain.feature
   toolchain.ClearField("feature")
-  new_feature = toolchain.feature.add()
+  toolchain.feature.extend(reversed(prepended_features))
   toolchain.feature.extend(features)
-  return new_feature
-
 
-def _get_feature(toolchain, name):
-  """Returns feature with a given name or None."""
-  for feature in toolchain.feature:
-    if feature.name == name:
-      return feature
-  return None
 
+def _index_features(toolchain):
+  """Returns a dict mapping feature names to features of the toolchain.
 
-def _migrate_expand_if_all_available(message):
-  """Move expand_if_all_available field to flag_groups."""
-  for flag_set in message.flag_set:
-    if flag_set.expand_if_all_available:
-      for flag_group in flag_set.flag_group:
-        new_vars = (
-            flag_group.expand_if_all_available[:] +
-            flag_set.expand_if_all_available[:])
-        flag_group.expand_if_all_available[:] = new_vars
-      flag_set.ClearField("expand_if_all_available")
+  When multiple features share a name, the first one wins, as it would with a
+  linear scan over toolchain.feature.
+  """
+  features_by_name = {}
+  for feature in toolchain.feature:
+    features_by_name.setdefault(feature.name, feature)
+  return features_by_name
 
 
-def _migrate_repeated_expands(message):
-  """Replace repeated legacy fields with nesting."""
-  todo_queue = []
-  for flag_set in message.flag_set:
-    todo_queue.extend(flag_set.flag_group)
-  while todo_queue:
-    flag_group = todo_queue.pop()
-    todo_queue.extend(flag_group.flag_group)
-    if len(flag_group.expand_if_all_available) <= 1 and len(
-        flag_group.expand_if_none_available) <= 1:
-      continue
+def _get_feature(features_by_name, name):
+  """Returns feature with a given name or None."""
+  return features_by_name.get(name)
 
-    current_children = flag_group.flag_group
-    current_flags = flag_group.flag
-    flag_group.ClearField("flag_group")
-    flag_group.ClearField("flag")
 
-    new_flag_group = flag_group.flag_group.add()
-    new_flag_group.flag_group.extend(current_children)
-    new_flag_group.flag.extend(current_flags)
+def _add_feature(toolchain, features_by_name, name):
+  """Appends a new feature with the given name and records it in the index."""
+  feature = toolchain.feature.add()
+  feature.name = name
+  features_by_name.setdefault(name, feature)
+  return feature
 
-    if len(flag_group.expand_if_all_available) > 1:
-      expands_to_move = flag_group.expand_if_all_available[1:]
-      flag_group.expand_if_all_available[:] = [
-          flag_group.expand_if_all_available[0]
-      ]
-      new_flag_group.expand_if_all_available.extend(expands_to_move)
 
-    if len(flag_group.expand_if_none_available) > 1:
-      expands_to_move = flag_group.expand_if_none_available[1:]
-      flag_group.expand_if_none_available[:] = [
-          flag_group.expand_if_none_available[0]
-      ]
-      new_flag_group.expand_if_none_available.extend(expands_to_move)
+def _migrate_flag_groups(message):
+  """Migrates the flag sets and flag groups of a feature or action_config.
 
-    todo_queue.append(new_flag_group)
-    todo_queue.append(flag_group)
+  Moves expand_if_all_available of flag sets to their flag groups and replaces
+  repeated expand_if_*_available fields of flag groups with nesting, visiting
+  every flag set and flag group once.
+  """
+  todo_stack = []
+  for flag_set in message.flag_set:
+    if flag_set.expand_if_all_available:
+      for flag_group in flag_set.flag_group:
+        flag_group.expand_if_all_available.extend(
+            flag_set.expand_if_all_available)
+      flag_set.ClearField("expand_if_all_available")
+    todo_stack.extend(flag_set.flag_group)
+  while todo_stack:
+    flag_group = todo_stack.pop()
+    if (len(flag_group.expand_if_all_available) > 1 or
+        len(flag_group.expand_if_none_available) > 1):
+      flag_group = _nest_repeated_expands(flag_group)
+    todo_stack.extend(flag_group.flag_group)
+
+
+def _nest_repeated_expands(flag_group):
+  """Replaces repeated expand_if_*_available fields with nesting.
+
+  The flag group keeps the first expand of each field, every following expand
+  moves one nested flag group deeper. The flags and flag groups are moved to the
+  innermost flag group, which is returned.
+  """
+  current_children = flag_group.flag_group
+  current_flags = list(flag_group.flag)
+  flag_group.ClearField("flag_group")
+  flag_group.ClearField("flag")
+  all_expands = flag_group.expand_if_all_available[1:]
+  none_expands = flag_group.expand_if_none_available[1:]
+  del flag_group.expand_if_all_available[1:]
+  del flag_group.expand_if_none_available[1:]
+
+  for i in range(max(len(all_expands), len(none_expands))):
+    flag_group = flag_group.flag_group.add()
+    if i < len(all_expands):
+      flag_group.expand_if_all_available.append(all_expands[i])
+    if i < len(none_expands):
+      flag_group.expand_if_none_available.append(none_expands[i])
+  flag_group.flag_group.extend(current_children)
+  flag_group.flag.extend(current_flags)
+  return flag_group
 
 
 def _contains_dynamic_flags(toolchain):
@@ -532,33 +646,40 @@ def _contains_dynamic_flags(toolchain):
   return False
 
 
-def _rename_feature_in_toolchain(toolchain, from_name, to_name):
-  for f in toolchain.feature:
-    _rename_feature_in(f, from_name, to_name)
-  for a in toolchain.action_config:
-    _rename_feature_in(a, from_name, to_name)
-
-
-def _rename_feature_in(msg, from_name, to_name):
-  if from_name in msg.implies:
-    msg.implies.remove(from_name)
-  for requires in msg.requires:
-    if from_name in requires.feature:
-      requires.feature.remove(from_name)
-      requires.feature.extend([to_name])
-    for flag_set in msg.flag_set:
-      for with_feature in flag_set.with_feature:
-        if from_name in with_feature.feature:
-          with_feature.feature.remove(from_name)
-          with_feature.feature.extend([to_name])
-        if from_name in with_feature.not_feature:
-          with_feature.not_feature.remove(from_name)
-          with_feature.not_feature.extend([to_name])
-    for env_set in msg.env_set:
-      for with_feature in env_set.with_feature:
-        if from_name in with_feature.feature:
-          with_feature.feature.remove(from_name)
-          with_feature.feature.extend([to_name])
-        if from_name in with_feature.not_feature:
-          with_feature.not_feature.remove(from_name)
-          with_feature.not_feature.extend([to_name])
+def _rename_feature(features_by_name, renamed_features, from_name, to_name):
+  """Renames the feature, references are renamed by migrate_toolchain."""
+  feature = features_by_name.pop(from_name)
+  feature.name = to_name
+  features_by_name.setdefault(to_name, feature)
+  renamed_features[from_name] = to_name
+
+
+def _rename_feature_references(toolchain, renames, remove_implies=False):
+  """Renames references to features in features and action_configs.
+
+  With remove_implies, renamed features are removed from implies instead.
+  """
+  if not renames:
+    return
+  old_names = frozenset(renames)
+  for messages in (toolchain.feature, toolchain.action_config):
+    for msg in messages:
+      if not old_names.isdisjoint(msg.implies):
+        if remove_implies:
+          msg.implies[:] = [name for name in msg.implies if name not in renames]
+        else:
+          _rename_in(msg.implies, renames)
+      for requires in msg.requires:
+        if not old_names.isdisjoint(requires.feature):
+          _rename_in(requires.feature, renames)
+      for sets in (msg.flag_set, msg.env_set):
+        for feature_set in sets:
+          for with_feature in feature_set.with_feature:
+            if not old_names.isdisjoint(with_feature.feature):
+              _rename_in(with_feature.feature, renames)
+            if not old_names.isdisjoint(with_feature.not_feature):
+              _rename_in(with_feature.not_feature, renames)
+
+
+def _rename_in(names, renames):
+  names[:] = [renames.get(name, name) for name in names]
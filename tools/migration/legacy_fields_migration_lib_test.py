@@ -11,7 +11,9 @@ from tools.migration.legacy_fields_migration_lib import NODEPS_DYNAMIC_LIBRARY_L
 from tools.migration.legacy_fields_migration_lib import TRANSITIVE_LINK_ACTIONS
 from tools.migration.legacy_fields_migration_lib import TRANSITIVE_DYNAMIC_LIBRARY_LINK_ACTIONS
 from tools.migration.legacy_fields_migration_lib import CC_LINK_EXECUTABLE
+from tools.migration.legacy_fields_migration_lib import is_migrated
 from tools.migration.legacy_fields_migration_lib import migrate_legacy_fields
+from tools.migration.legacy_fields_migration_lib import rename_features
 
 
 def assert_has_feature(self, toolchain, name):
@@ -169,6 +171,59 @@ class LegacyFieldsMigrationLibTest(unittest.TestCase):
     self.assertEqual(output.feature[0].env_set[0].with_feature[1].not_feature,
                      ["default_compile_flags"])
 
+  def test_replace_legacy_compile_flags_in_with_features_only(self):
+    crosstool = make_crosstool("""
+        feature {
+          name: 'foo'
+          flag_set { with_feature { not_feature: 'legacy_compile_flags' } }
+        }
+        feature { name: 'legacy_compile_flags' }
+        compiler_flag: 'clang-flag-1'
+    """)
+    migrate_legacy_fields(crosstool)
+    output = crosstool.toolchain[0]
+    self.assertEqual(output.feature[0].flag_set[0].with_feature[0].not_feature,
+                     ["default_compile_flags"])
+
+  def test_rename_features(self):
+    crosstool = make_crosstool("""
+        feature {
+          name: 'foo'
+          implies: 'a'
+          implies: 'b'
+          implies: 'c'
+          requires: { feature: 'c' feature: 'b' }
+          flag_set {
+            with_feature { feature: 'a' not_feature: 'b' }
+          }
+        }
+        feature { name: 'a' }
+        feature { name: 'b' }
+        action_config {
+          action_name: 'foo'
+          config_name: 'foo'
+          implies: 'a'
+          env_set {
+            with_feature { feature: 'b' feature: 'c' }
+          }
+        }
+    """)
+    toolchain = crosstool.toolchain[0]
+    rename_features(toolchain, {"a": "new_a", "b": "new_b"})
+    self.assertEqual([feature.name for feature in toolchain.feature],
+                     ["foo", "new_a", "new_b"])
+    self.assertEqual(toolchain.feature[0].implies, ["new_a", "new_b", "c"])
+    self.assertEqual(toolchain.feature[0].requires[0].feature, ["c", "new_b"])
+    self.assertEqual(toolchain.feature[0].flag_set[0].with_feature[0].feature,
+                     ["new_a"])
+    self.assertEqual(
+        toolchain.feature[0].flag_set[0].with_feature[0].not_feature,
+        ["new_b"])
+    self.assertEqual(toolchain.action_config[0].implies, ["new_a"])
+    self.assertEqual(
+        toolchain.action_config[0].env_set[0].with_feature[0].feature,
+        ["new_b", "c"])
+
   def test_replace_legacy_link_flags(self):
     crosstool = make_crosstool("""
         feature { name: 'foo' }
@@ -836,6 +891,20 @@ class LegacyFieldsMigrationLibTest(unittest.TestCase):
     self.assertEqual(output.feature[0].flag_set[0].flag_group[0].flag,
                      ["compiler-flag-1"])
 
+  def test_prepended_features_come_before_all_other_features(self):
+    crosstool = make_crosstool("""
+          compiler_flag: 'compiler-flag-1'
+          linker_flag: 'linker-flag-1'
+          unfiltered_cxx_flag: 'unfiltered-flag-1'
+          feature { name: 'something_else' }
+        """)
+    migrate_legacy_fields(crosstool)
+    output = crosstool.toolchain[0]
+    self.assertEqual([feature.name for feature in output.feature], [
+        "default_compile_flags", "default_link_flags", "something_else",
+        "user_compile_flags", "sysroot", "unfiltered_compile_flags"
+    ])
+
   def test_default_compile_flags_not_added_when_present(self):
     crosstool = make_crosstool("""
           compiler_flag: 'compiler-flag-1'
@@ -1103,6 +1172,24 @@ class LegacyFieldsMigrationLibTest(unittest.TestCase):
       self.assertEqual(output.feature[i].name, default_features[i])
       self.assertTrue(output.feature[i].enabled)
 
+  def test_enable_previously_default_features_after_prepending(self):
+    crosstool = make_crosstool("""
+          linker_flag: 'linker-flag-1'
+          compiler_flag: 'compiler-flag-1'
+          compilation_mode_flags { mode: OPT compiler_flag: 'opt-flag-1' }
+          feature { name: "dependency_file" }
+          feature { name: "pic" }
+          """)
+    migrate_legacy_fields(crosstool)
+    output = crosstool.toolchain[0]
+    self.assertEqual([f.name for f in output.feature], [
+        "default_compile_flags", "default_link_flags", "dependency_file", "pic",
+        "opt"
+    ])
+    self.assertTrue(output.feature[2].enabled)
+    self.assertTrue(output.feature[3].enabled)
+    self.assertFalse(output.feature[4].enabled)
+
   def test_migrate_repeated_expand_if_all_available_from_flag_groups(self):
     crosstool = make_crosstool("""
           action_config {
@@ -1235,6 +1322,58 @@ class LegacyFieldsMigrationLibTest(unittest.TestCase):
         output.feature[0].flag_set[0].flag_group[1].flag_group[0].flag_group[0]
         .flag, ["%{foo}"])
 
+  def test_is_migrated(self):
+    crosstool = make_crosstool("""
+          compiler_flag: 'clang-flag-1'
+          feature {
+            name: 'something'
+            flag_set {
+              flag_group {
+                expand_if_all_available: 'foo'
+                expand_if_all_available: 'bar'
+                flag: '%{foo}'
+              }
+            }
+          }
+          """)
+    self.assertFalse(is_migrated(crosstool.toolchain[0]))
+    migrate_legacy_fields(crosstool)
+    self.assertTrue(is_migrated(crosstool.toolchain[0]))
+
+  def test_is_migrated_detects_pending_migrations(self):
+    for string in [
+        "linking_mode_flags { mode: DYNAMIC linker_flag: 'flag' }",
+        "feature { name: 'pic' }",
+        """feature {
+             name: 'something'
+             flag_set { expand_if_all_available: 'foo' flag_group { } }
+           }""",
+        """action_config {
+             config_name: 'something'
+             flag_set {
+               flag_group {
+                 flag_group {
+                   expand_if_none_available: 'foo'
+                   expand_if_none_available: 'bar'
+                 }
+               }
+             }
+           }""",
+    ]:
+      crosstool = make_crosstool(string)
+      self.assertFalse(is_migrated(crosstool.toolchain[0]), string)
+
+  def test_skips_migrated_toolchains(self):
+    crosstool = make_crosstool("compiler_flag: 'clang-flag-1'")
+    crosstool.toolchain.add().CopyFrom(crosstool.toolchain[0])
+    migrate_legacy_fields(crosstool)
+    expected = to_string(crosstool)
+    crosstool.toolchain.add().CopyFrom(
+        make_crosstool("compiler_flag: 'clang-flag-2'").toolchain[0])
+    self.assertEqual(migrate_legacy_fields(crosstool), 2)
+    crosstool.toolchain.pop()
+    self.assertEqual(to_string(crosstool), expected)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -4,6 +4,12 @@ This script migrates the CROSSTOOL to use only the features to describe C++
 command lines. It is intended to be added as a last step of CROSSTOOL generation
 pipeline. Since it doesn't retain comments, we assume CROSSTOOL owners will want
 to migrate their pipeline manually.
+
+With --validate nothing is written, instead every toolchain is migrated in
+memory and the flags Bazel passes to its actions for every compilation and
+linking mode before the migration are compared to those after it. A PASS or
+FAIL line is printed for every toolchain, or an ERROR line when the toolchain
+can't be expanded.
 """
 
 # Tracking issue: https://github.com/bazelbuild/bazel/issues/5187
@@ -16,18 +22,88 @@ to migrate their pipeline manually.
 
 from absl import app
 from absl import flags
-from google.protobuf import text_format
 from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
-from tools.migration.legacy_fields_migration_lib import migrate_legacy_fields
+from tools.migration import legacy_fields_migration_lib
+from tools.migration.crosstool_cache_lib import DEFAULT_MAX_CACHE_SIZE
+from tools.migration.crosstool_cache_lib import MessageCache
+from tools.migration.crosstool_cache_lib import default_cache_dir
+from tools.migration.crosstool_io_lib import AUTO_FORMAT
+from tools.migration.crosstool_io_lib import FORMATS
+from tools.migration.crosstool_io_lib import StreamingProtoWriter
+from tools.migration.crosstool_io_lib import map_file
+from tools.migration.crosstool_io_lib import parse_proto_streaming
+from tools.migration.legacy_fields_migration_lib import is_migrated
+from tools.migration.legacy_fields_migration_lib import migrate_toolchain
+from tools.migration.migration_validation_lib import format_validation_result
+from tools.migration.migration_validation_lib import format_validation_summary
+from tools.migration.migration_validation_lib import validate_migration
+from tools.migration.semantic_comparator_lib import format_semantic_differences
+from tools.migration.timings_lib import PhaseTimer
+from tools.migration.timings_lib import run_profiled
+import collections
+import hashlib
+import inspect
+import itertools
+import multiprocessing
 import os
+import timeit
 
 flags.DEFINE_string("input", None, "Input CROSSTOOL file to be migrated")
 flags.DEFINE_string("output", None,
                     "Output path where to write migrated CROSSTOOL.")
 flags.DEFINE_boolean("inline", None, "Overwrite --input file")
+flags.DEFINE_enum(
+    "input_format", AUTO_FORMAT, FORMATS,
+    "Format of the --input file, 'auto' detects it from the file content.")
+flags.DEFINE_enum(
+    "output_format", AUTO_FORMAT, FORMATS,
+    "Format of the migrated CROSSTOOL, 'auto' uses the format of the input.")
+flags.DEFINE_integer(
+    "jobs", 1, "Number of processes migrating toolchains in parallel.",
+    lower_bound=1)
+flags.DEFINE_boolean(
+    "validate", False,
+    "Instead of writing the migrated CROSSTOOL, check that the migration "
+    "preserves the flags of every action of every toolchain in all "
+    "compilation and linking modes. Exits with 1 when any toolchain fails.")
+flags.DEFINE_boolean(
+    "validation_details", False,
+    "Print the differing flags of the toolchains failing --validate.")
+flags.DEFINE_boolean(
+    "cache", False,
+    "Reuse toolchains migrated by earlier runs from an on-disk cache and add "
+    "the newly migrated ones to it. Implied by --cache_dir.")
+flags.DEFINE_string(
+    "cache_dir", None,
+    "Directory of the migrated toolchain cache, implies --cache, defaults to "
+    "$XDG_CACHE_HOME/rules_cc/migration.")
+flags.DEFINE_integer(
+    "max_cache_size", DEFAULT_MAX_CACHE_SIZE,
+    "Maximum size of the migrated toolchain cache in bytes.",
+    lower_bound=0)
+flags.DEFINE_boolean(
+    "timings", False,
+    "Print the wall and CPU time of every phase, the peak RSS and the slowest "
+    "toolchains to stderr.")
+flags.DEFINE_integer(
+    "timings_top_n", 10,
+    "Number of the slowest toolchains to print with --timings.",
+    lower_bound=0)
+flags.DEFINE_string(
+    "profile", None,
+    "File to write a cProfile profile of the migration to, in the pstats "
+    "format. Worker processes started by --jobs are not profiled.")
 
 
 def main(unused_argv):
+  timer = PhaseTimer(flags.FLAGS.timings, flags.FLAGS.timings_top_n)
+  try:
+    run_profiled(flags.FLAGS.profile, _migrate_crosstool, timer)
+  finally:
+    timer.report()
+
+
+def _migrate_crosstool(timer):
   crosstool = crosstool_config_pb2.CrosstoolRelease()
 
   input_filename = flags.FLAGS.input
@@ -36,23 +112,237 @@ def main(unused_argv):
 
   if not input_filename:
     raise app.UsageError("ERROR --input unspecified")
-  if not output_filename and not inline:
+  if flags.FLAGS.validate:
+    if output_filename or inline:
+      raise app.UsageError(
+          "ERROR --validate doesn't write --output or --inline")
+  elif not output_filename and not inline:
     raise app.UsageError("ERROR --output unspecified and --inline not passed")
   if output_filename and inline:
     raise app.UsageError("ERROR both --output and --inline passed")
 
-  with open(to_absolute_path(input_filename), "r") as f:
-    input_text = f.read()
+  # Toolchains are parsed, migrated and written one at a time, so that only
+  # the toolchains being migrated are held in memory as parsed protos.
+  with timer.phase("read"):
+    input_data = map_file(to_absolute_path(input_filename))
+  with timer.phase("parse"):
+    input_format, toolchains = parse_proto_streaming(
+        input_data, crosstool, "toolchain", flags.FLAGS.input_format)
+  toolchains = timer.iterate("parse", toolchains)
+  if flags.FLAGS.validate:
+    _validate_crosstool(toolchains, flags.FLAGS.jobs,
+                        flags.FLAGS.validation_details, timer)
+    return
+  output_format = flags.FLAGS.output_format
+  if output_format == AUTO_FORMAT:
+    output_format = input_format
 
-  text_format.Merge(input_text, crosstool)
-
-  migrate_legacy_fields(crosstool)
-  output_text = text_format.MessageToString(crosstool)
+  # The same as migrate_legacy_fields, one toolchain at a time.
+  crosstool.ClearField("default_toolchain")
+  counts = collections.Counter()
+  cache = None
+  if flags.FLAGS.cache or flags.FLAGS.cache_dir:
+    cache = migration_cache(flags.FLAGS.cache_dir or
+                            default_cache_dir("migration"),
+                            flags.FLAGS.max_cache_size)
+  if flags.FLAGS.jobs > 1:
+    migrated_toolchains = migrate_toolchains_in_parallel(
+        toolchains, flags.FLAGS.jobs, counts, cache, timer)
+  else:
+    migrated_toolchains = _migrate_toolchains(toolchains, counts, cache, timer)
 
   resolved_output_filename = to_absolute_path(
       input_filename if inline else output_filename)
-  with open(resolved_output_filename, "w") as f:
-    f.write(output_text)
+  with timer.phase("write"):
+    writer = StreamingProtoWriter(resolved_output_filename, crosstool,
+                                  "toolchain", output_format)
+  with writer:
+    for toolchain in migrated_toolchains:
+      with timer.phase("write"):
+        writer.write(toolchain)
+  if cache:
+    with timer.phase("cache eviction"):
+      cache.evict()
+  print("Migrated %d toolchains (%d from the cache), skipped %d already "
+        "migrated toolchains." %
+        (counts["migrated"], counts["cached"], counts["skipped"]))
+
+
+def _validate_crosstool(toolchains, jobs, details, timer):
+  """Prints the validation results, exits with 1 when any toolchain fails."""
+  results = []
+  for result in validate_toolchains(toolchains, jobs, timer):
+    results.append(result)
+    print(format_validation_result(result))  # pylint: disable=superfluous-parens
+    if details and result.differences:
+      print(format_semantic_differences(result.differences))  # pylint: disable=superfluous-parens
+  print(format_validation_summary(results))  # pylint: disable=superfluous-parens
+  if not all(result.passed for result in results):
+    exit(1)
+
+
+def validate_toolchains(toolchains, jobs, timer=None):
+  """Yields the ValidationResult of every toolchain in order.
+
+  With more than one job the toolchains are sent serialized to a pool of worker
+  processes. The validation is timed as the "validate" phase of the timer,
+  with the time of every toolchain recorded as an item.
+  """
+  timer = timer or PhaseTimer(enabled=False)
+  if jobs <= 1:
+    for toolchain in toolchains:
+      with timer.phase("validate", item=toolchain.toolchain_identifier):
+        result = validate_migration(toolchain)
+      yield result
+    return
+  pool = multiprocessing.Pool(jobs)
+  try:
+    serialized_toolchains = (
+        toolchain.SerializePartialToString() for toolchain in toolchains)
+    results = pool.imap(_validate_serialized_toolchain, serialized_toolchains,
+                        _TOOLCHAINS_PER_JOB)
+    for result, seconds in timer.iterate("validate", results):
+      timer.record_item("validate", result.toolchain_identifier, seconds)
+      yield result
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _validate_serialized_toolchain(serialized_toolchain):
+  """Returns the ValidationResult of the toolchain and the time it took."""
+  start = timeit.default_timer()
+  toolchain = crosstool_config_pb2.CToolchain()
+  toolchain.MergeFromString(serialized_toolchain)
+  result = validate_migration(toolchain)
+  return result, timeit.default_timer() - start
+
+
+def migration_cache(cache_dir, max_cache_size):
+  """Returns the MessageCache of migrated toolchains.
+
+  Entries are keyed by the serialized input toolchain. The cache namespace
+  includes a hash of the source of legacy_fields_migration_lib, so changes of
+  the migration invalidate all entries. Returns None when the source can't be
+  read.
+  """
+  try:
+    with open(inspect.getsourcefile(legacy_fields_migration_lib), "rb") as f:
+      source_digest = hashlib.sha256(f.read()).hexdigest()
+  except (IOError, OSError, TypeError):
+    return None
+  namespace = "%s:%s" % (crosstool_config_pb2.CToolchain.DESCRIPTOR.full_name,
+                         source_digest)
+  return MessageCache(cache_dir, namespace, max_cache_size)
+
+
+def _read_cached_toolchain(toolchain, cache):
+  """Replaces the toolchain by its cached migration.
+
+  Returns None on a cache hit, the cache key of the toolchain otherwise.
+  """
+  key = toolchain.SerializePartialToString()
+  migrated = crosstool_config_pb2.CToolchain()
+  if not cache.get(key, migrated):
+    return key
+  toolchain.CopyFrom(migrated)
+  return None
+
+
+def _migrate_toolchains(toolchains, counts, cache=None, timer=None):
+  timer = timer or PhaseTimer(enabled=False)
+  for toolchain in toolchains:
+    with timer.phase("migrate", item=toolchain.toolchain_identifier):
+      _migrate_toolchain(toolchain, counts, cache)
+    yield toolchain
+
+
+def _migrate_toolchain(toolchain, counts, cache):
+  if is_migrated(toolchain):
+    counts["skipped"] += 1
+    return
+  counts["migrated"] += 1
+  if cache:
+    key = _read_cached_toolchain(toolchain, cache)
+    if key is None:
+      counts["cached"] += 1
+      return
+  migrate_toolchain(toolchain)
+  if cache:
+    cache.put(key, toolchain)
+
+
+# Number of toolchains per job sent to the worker pool at once.
+_TOOLCHAINS_PER_JOB = 4
+
+
+def migrate_toolchains_in_parallel(toolchains,
+                                   jobs,
+                                   counts,
+                                   cache=None,
+                                   timer=None):
+  """Yields the migrated toolchains, migrated by a pool of worker processes.
+
+  Every toolchain that is not migrated yet and not found in the cache is sent
+  to a worker serialized and migrated there. The toolchains are yielded in their
+  original order and only a bounded batch of them is in flight at any time. The
+  numbers of "migrated", "cached" and "skipped" toolchains are added to the
+  counts Counter. The "migrate" phase of the timer includes waiting for the
+  workers, the times of the toolchains are measured by the workers.
+  """
+  timer = timer or PhaseTimer(enabled=False)
+  pool = multiprocessing.Pool(jobs)
+  try:
+    toolchains = iter(toolchains)
+    while True:
+      batch = list(itertools.islice(toolchains, jobs * _TOOLCHAINS_PER_JOB))
+      if not batch:
+        break
+      with timer.phase("migrate"):
+        _migrate_batch_in_parallel(pool, batch, counts, cache, timer)
+      for toolchain in batch:
+        yield toolchain
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _migrate_batch_in_parallel(pool, batch, counts, cache, timer):
+  """Migrates the toolchains of the batch in place using the worker pool."""
+  to_migrate = []
+  keys = []
+  for toolchain in batch:
+    if is_migrated(toolchain):
+      counts["skipped"] += 1
+      continue
+    counts["migrated"] += 1
+    if cache:
+      key = _read_cached_toolchain(toolchain, cache)
+      if key is None:
+        counts["cached"] += 1
+        continue
+    else:
+      key = toolchain.SerializePartialToString()
+    to_migrate.append(toolchain)
+    keys.append(key)
+  results = pool.map(_migrate_serialized_toolchain, keys)
+  for toolchain, key, (serialized_toolchain, seconds) in zip(
+      to_migrate, keys, results):
+    toolchain.Clear()
+    toolchain.MergeFromString(serialized_toolchain)
+    timer.record_item("migrate", toolchain.toolchain_identifier, seconds)
+    if cache:
+      cache.put(key, toolchain)
+
+
+def _migrate_serialized_toolchain(serialized_toolchain):
+  """Returns the migrated serialized toolchain and the time it took."""
+  start = timeit.default_timer()
+  toolchain = crosstool_config_pb2.CToolchain()
+  toolchain.MergeFromString(serialized_toolchain)
+  migrate_toolchain(toolchain)
+  return toolchain.SerializePartialToString(), timeit.default_timer() - start
+
 
 def to_absolute_path(path):
   path = os.path.expanduser(path)
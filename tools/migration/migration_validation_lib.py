@@ -0,0 +1,322 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing validate_migration function.
+
+validate_migration checks that migrate_toolchain preserves the flags Bazel
+passes to every action. It models how Bazel consumed the legacy fields: Bazel
+adds its legacy features to every toolchain that doesn't define them, and sets
+the legacy_compile_flags, legacy_link_flags and unfiltered_compile_flags
+variables they expand from the legacy fields for the compilation mode, the
+linking mode and the action. The migrated toolchain gets the same features,
+but the variables are empty, like with the legacy fields disabled. Both are
+then expanded for every configuration and variable set and compared with
+semantic_comparator_lib. A toolchain whose legacy expansion fails, e.g. because
+it references an undefined feature, can't be validated and is reported with
+the error.
+"""
+
+import collections
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.legacy_fields_migration_lib import ALL_CXX_COMPILE_ACTIONS
+from tools.migration.legacy_fields_migration_lib import CC_LINK_EXECUTABLE
+from tools.migration.legacy_fields_migration_lib import DYNAMIC_LIBRARY_LINK_ACTIONS
+from tools.migration.legacy_fields_migration_lib import LINKING_MODE_TO_FEATURE_NAME
+from tools.migration.legacy_fields_migration_lib import NODEPS_DYNAMIC_LIBRARY_LINK_ACTIONS
+from tools.migration.legacy_fields_migration_lib import PREVIOUSLY_DEFAULT_FEATURES
+from tools.migration.legacy_fields_migration_lib import TRANSITIVE_DYNAMIC_LIBRARY_LINK_ACTIONS
+from tools.migration.legacy_fields_migration_lib import compile_actions
+from tools.migration.legacy_fields_migration_lib import executable_link_actions
+from tools.migration.legacy_fields_migration_lib import link_actions
+from tools.migration.legacy_fields_migration_lib import migrate_toolchain
+from tools.migration.semantic_comparator_lib import COMPILATION_MODE_FEATURES
+from tools.migration.semantic_comparator_lib import DEFAULT_CONFIGURATIONS
+from tools.migration.semantic_comparator_lib import LINKING_MODE_FEATURES
+from tools.migration.semantic_comparator_lib import ToolchainExpander
+from tools.migration.semantic_comparator_lib import diff_expansions
+
+# Actions Bazel passes -gsplit-dwarf to when using fission.
+_FISSION_ACTIONS = [
+    "c-compile", "c++-compile", "c++-module-codegen", "assemble",
+    "preprocess-assemble", "lto-backend"
+]
+
+
+class ValidationResult(
+    collections.namedtuple("ValidationResult",
+                           ["toolchain_identifier", "differences", "error"])):
+  """The SemanticDifferences of the toolchain before and after migration.
+
+  error is the message of the error that prevented expanding the legacy
+  toolchain, then there are no differences and the toolchain didn't pass.
+  """
+  __slots__ = ()
+
+  @property
+  def passed(self):
+    return not self.differences and self.error is None
+
+
+def validate_migration(toolchain,
+                       migrated_toolchain=None,
+                       configurations=None,
+                       variable_sets=None):
+  """Returns the ValidationResult of migrating the toolchain.
+
+  migrated_toolchain defaults to the toolchain migrated by migrate_toolchain.
+  The differences are those of diff_expansions, before is the legacy toolchain
+  as Bazel consumed it and after the migrated toolchain. When the legacy
+  toolchain is invalid or none of the configurations resolves its features,
+  nothing can be compared and the result has the error instead.
+  """
+  identifier = toolchain.toolchain_identifier
+  try:
+    expander = bazel_expander(toolchain, legacy_fields=True)
+  except ValueError as e:
+    return ValidationResult(identifier, [], str(e))
+  errors = [
+      expander.solve(requested)[1]
+      for _, requested in configurations or DEFAULT_CONFIGURATIONS
+  ]
+  if all(errors):
+    return ValidationResult(identifier, [], errors[0])
+  if migrated_toolchain is None:
+    migrated_toolchain = crosstool_config_pb2.CToolchain()
+    migrated_toolchain.CopyFrom(toolchain)
+    migrate_toolchain(migrated_toolchain)
+  differences = diff_expansions(
+      lambda: expander,
+      lambda: bazel_expander(migrated_toolchain, legacy_fields=False),
+      configurations, variable_sets)
+  return ValidationResult(identifier, differences, None)
+
+
+def bazel_expander(toolchain, legacy_fields, caches=None):
+  """Returns the ToolchainExpander expanding the toolchain like Bazel.
+
+  With legacy_fields Bazel also requests the features it used to enable,
+  otherwise the variables set from the legacy fields are empty. caches is
+  passed to the ToolchainExpander.
+  """
+
+  def action_variables(action, requested, enabled_names, variables):
+    result = legacy_variables(toolchain, action, requested, enabled_names,
+                              variables)
+    if not legacy_fields:
+      for name in result:
+        result[name] = []
+    return result
+
+  return ToolchainExpander(
+      with_bazel_legacy_features(toolchain),
+      requested=PREVIOUSLY_DEFAULT_FEATURES if legacy_fields else (),
+      action_variables=action_variables,
+      caches=caches)
+
+
+def with_bazel_legacy_features(toolchain):
+  """Returns a copy of the toolchain with the legacy features Bazel adds.
+
+  legacy_compile_flags and legacy_link_flags are added before all features,
+  per_object_debug_info, user_compile_flags, sysroot, unfiltered_compile_flags,
+  objcopy_embed_flags and ld_embed_flags after them, each only when the
+  toolchain doesn't define it. Nothing is added when the toolchain defines the
+  no_legacy_features feature.
+  """
+  result = crosstool_config_pb2.CToolchain()
+  result.CopyFrom(toolchain)
+  names = set(feature.name for feature in toolchain.feature)
+  if "no_legacy_features" in names:
+    return result
+  all_compile_actions = compile_actions(toolchain)
+  all_link_actions = link_actions(toolchain)
+  sysroot_actions = [
+      action for action in all_compile_actions + all_link_actions
+      if action != "assemble"
+  ]
+
+  prepended = []
+  _add_iterating_feature(prepended, names, "legacy_compile_flags",
+                         all_compile_actions, "legacy_compile_flags")
+  _add_iterating_feature(prepended, names, "legacy_link_flags",
+                         all_link_actions, "legacy_link_flags")
+  if prepended:
+    features = list(result.feature)
+    result.ClearField("feature")
+    result.feature.extend(prepended + features)
+
+  appended = []
+  if "per_object_debug_info" not in names:
+    feature = crosstool_config_pb2.CToolchain.Feature()
+    feature.name = "per_object_debug_info"
+    feature.enabled = toolchain.supports_fission
+    flag_set = feature.flag_set.add()
+    flag_set.action[:] = _FISSION_ACTIONS
+    flag_group = flag_set.flag_group.add()
+    flag_group.expand_if_all_available[:] = ["is_using_fission"]
+    flag_group.flag[:] = ["-gsplit-dwarf"]
+    appended.append(feature)
+  _add_iterating_feature(appended, names, "user_compile_flags",
+                         all_compile_actions, "user_compile_flags")
+  if "sysroot" not in names:
+    feature = crosstool_config_pb2.CToolchain.Feature()
+    feature.name = "sysroot"
+    feature.enabled = True
+    flag_set = feature.flag_set.add()
+    flag_set.action[:] = sysroot_actions
+    flag_group = flag_set.flag_group.add()
+    flag_group.expand_if_all_available[:] = ["sysroot"]
+    flag_group.flag[:] = ["--sysroot=%{sysroot}"]
+    appended.append(feature)
+  _add_iterating_feature(appended, names, "unfiltered_compile_flags",
+                         all_compile_actions, "unfiltered_compile_flags")
+  _add_iterating_feature(appended, names, "objcopy_embed_flags",
+                         ["objcopy_embed_data"], "objcopy_embed_flags")
+  _add_iterating_feature(appended, names, "ld_embed_flags", ["ld_embed_data"],
+                         "ld_embed_flags")
+  result.feature.extend(appended)
+  return result
+
+
+def _add_iterating_feature(features, names, name, actions, variable):
+  """Appends an enabled feature expanding every element of the variable."""
+  if name in names:
+    return
+  feature = crosstool_config_pb2.CToolchain.Feature()
+  feature.name = name
+  feature.enabled = True
+  flag_set = feature.flag_set.add()
+  flag_set.action[:] = actions
+  flag_group = flag_set.flag_group.add()
+  flag_group.expand_if_all_available[:] = [variable]
+  flag_group.iterate_over = variable
+  flag_group.flag[:] = ["%{" + variable + "}"]
+  features.append(feature)
+
+
+def legacy_variables(toolchain, action, requested, enabled_names, variables):
+  """Returns the variables Bazel set from the legacy fields for the action.
+
+  The compilation mode and linking mode are the first features of
+  COMPILATION_MODE_FEATURES and LINKING_MODE_FEATURES in requested,
+  enabled_names are the enabled features and variables the other variables of
+  the action.
+  """
+  compilation_mode = _first_requested(requested, COMPILATION_MODE_FEATURES)
+  mode_flags = [
+      cmf for cmf in toolchain.compilation_mode_flags
+      if crosstool_config_pb2.CompilationMode.Name(cmf.mode).lower() ==
+      compilation_mode
+  ]
+  if action in compile_actions(toolchain):
+    flags = list(toolchain.compiler_flag)
+    for cmf in mode_flags:
+      flags.extend(cmf.compiler_flag)
+    if action in ALL_CXX_COMPILE_ACTIONS:
+      flags.extend(toolchain.cxx_flag)
+      for cmf in mode_flags:
+        flags.extend(cmf.cxx_flag)
+    return {
+        "legacy_compile_flags": flags,
+        "unfiltered_compile_flags": list(toolchain.unfiltered_cxx_flag),
+    }
+  if action in link_actions(toolchain):
+    flags = list(toolchain.linker_flag)
+    for cmf in mode_flags:
+      flags.extend(cmf.linker_flag)
+    linking_mode = _first_requested(requested, LINKING_MODE_FEATURES)
+    static_runtimes = (
+        toolchain.supports_embedded_runtimes or
+        "static_link_cpp_runtimes" in enabled_names)
+    defined_features = set(feature.name for feature in toolchain.feature)
+    for lmf in toolchain.linking_mode_flags:
+      feature_name = LINKING_MODE_TO_FEATURE_NAME.get(
+          crosstool_config_pb2.LinkingMode.Name(lmf.mode))
+      # Toolchains defining the feature of the linking mode use it instead.
+      if feature_name in defined_features:
+        continue
+      if _uses_linking_mode_flags(toolchain, action, feature_name,
+                                  linking_mode, static_runtimes):
+        flags.extend(lmf.linker_flag)
+    if action in DYNAMIC_LIBRARY_LINK_ACTIONS:
+      flags.extend(toolchain.dynamic_library_linker_flag)
+    if variables.get("is_cc_test") is not None:
+      flags.extend(toolchain.test_only_linker_flag)
+    return {"legacy_link_flags": flags}
+  if action == "objcopy_embed_data":
+    return {"objcopy_embed_flags": list(toolchain.objcopy_embed_flag)}
+  if action == "ld_embed_data":
+    return {"ld_embed_flags": list(toolchain.ld_embed_flag)}
+  return {}
+
+
+def _first_requested(requested, features):
+  for feature in requested:
+    if feature in features:
+      return feature
+  return None
+
+
+def _uses_linking_mode_flags(toolchain, action, feature_name, linking_mode,
+                             static_runtimes):
+  """Returns whether the action uses the flags of the linking mode feature.
+
+  Dynamic libraries are always linked dynamically, except for transitive ones
+  linking the C++ runtimes statically. Otherwise the flags are used for the
+  linking mode of the configuration, mostly static linking only applies to
+  executables.
+  """
+  if feature_name == LINKING_MODE_TO_FEATURE_NAME["DYNAMIC"]:
+    if action in NODEPS_DYNAMIC_LIBRARY_LINK_ACTIONS:
+      return True
+    if action in TRANSITIVE_DYNAMIC_LIBRARY_LINK_ACTIONS:
+      return not static_runtimes
+    return (linking_mode == feature_name and
+            action in executable_link_actions(toolchain))
+  if linking_mode != feature_name:
+    return False
+  if feature_name == LINKING_MODE_TO_FEATURE_NAME["MOSTLY_STATIC"]:
+    return action in CC_LINK_EXECUTABLE
+  return True
+
+
+def format_validation_result(result):
+  """Returns the one line summary of the ValidationResult.
+
+  Failing toolchains list the actions whose flags or environment differ and
+  the number of configurations they differ in, toolchains that couldn't be
+  validated the error.
+  """
+  if result.error is not None:
+    return "ERROR %s: %s" % (result.toolchain_identifier, result.error)
+  if result.passed:
+    return "PASS %s" % result.toolchain_identifier
+  actions = []
+  configurations = set()
+  for difference in result.differences:
+    if difference.action is not None and difference.action not in actions:
+      actions.append(difference.action)
+    configurations.add(difference.configuration)
+  if not actions:
+    return "FAIL %s: features differ" % result.toolchain_identifier
+  return "FAIL %s: %d actions differ in %d configurations: %s" % (
+      result.toolchain_identifier, len(actions), len(configurations),
+      ", ".join(actions))
+
+
+def format_validation_summary(results):
+  """Returns the line counting the passed, failed and erroneous results."""
+  errors = sum(1 for result in results if result.error is not None)
+  failed = sum(1 for result in results if result.differences)
+  return "Validated %d toolchains, %d passed, %d failed, %d errors." % (
+      len(results), len(results) - failed - errors, failed, errors)
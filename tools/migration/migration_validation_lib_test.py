@@ -0,0 +1,235 @@
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.legacy_fields_migration_lib import migrate_toolchain
+from tools.migration.migration_validation_lib import ValidationResult
+from tools.migration.migration_validation_lib import bazel_expander
+from tools.migration.migration_validation_lib import format_validation_result
+from tools.migration.migration_validation_lib import format_validation_summary
+from tools.migration.migration_validation_lib import legacy_variables
+from tools.migration.migration_validation_lib import validate_migration
+from tools.migration.migration_validation_lib import with_bazel_legacy_features
+from tools.migration.semantic_comparator_lib import DEFAULT_VARIABLE_SETS
+
+LEGACY_TOOLCHAIN = """
+    toolchain_identifier: 'legacy'
+    compiler_flag: '-compiler-flag'
+    cxx_flag: '-cxx-flag'
+    linker_flag: '-linker-flag'
+    compilation_mode_flags {
+      mode: OPT
+      compiler_flag: '-opt-compiler-flag'
+      cxx_flag: '-opt-cxx-flag'
+      linker_flag: '-opt-linker-flag'
+    }
+    compilation_mode_flags { mode: COVERAGE compiler_flag: '-coverage' }
+    linking_mode_flags { mode: FULLY_STATIC linker_flag: '-fully-static' }
+    linking_mode_flags { mode: MOSTLY_STATIC linker_flag: '-mostly-static' }
+    linking_mode_flags { mode: DYNAMIC linker_flag: '-dynamic' }
+    linking_mode_flags {
+      mode: MOSTLY_STATIC_LIBRARIES
+      linker_flag: '-mostly-static-libraries'
+    }
+    dynamic_library_linker_flag: '-dynamic-library'
+    test_only_linker_flag: '-test-only'
+    unfiltered_cxx_flag: '-unfiltered'
+    objcopy_embed_flag: '-objcopy'
+    supports_fission: true
+    tool_path { name: 'objcopy' path: 'objcopy' }
+    feature {
+      name: 'pic'
+      flag_set {
+        action: 'c++-compile'
+        flag_group { expand_if_all_available: 'pic' flag: '-fPIC' }
+      }
+    }
+"""
+
+VARIABLE_SETS = DEFAULT_VARIABLE_SETS + [("test", {
+    "is_cc_test": "",
+    "pic": ""
+})]
+
+
+def make_toolchain(toolchain_proto):
+  toolchain = crosstool_config_pb2.CToolchain()
+  text_format.Merge(toolchain_proto, toolchain)
+  return toolchain
+
+
+class MigrationValidationLibTest(unittest.TestCase):
+
+  def test_migration_preserves_flags(self):
+    result = validate_migration(
+        make_toolchain(LEGACY_TOOLCHAIN), variable_sets=VARIABLE_SETS)
+    self.assertEqual(result.differences, [])
+    self.assertTrue(result.passed)
+    result = validate_migration(
+        make_toolchain(LEGACY_TOOLCHAIN.replace(
+            "supports_fission: true", "supports_embedded_runtimes: true")),
+        variable_sets=VARIABLE_SETS)
+    self.assertEqual(result.differences, [])
+
+  def test_migrated_toolchain_passes(self):
+    toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    migrate_toolchain(toolchain)
+    self.assertTrue(validate_migration(toolchain).passed)
+
+  def test_detects_dropped_flags(self):
+    toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    migrated_toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    migrate_toolchain(migrated_toolchain)
+    for feature in migrated_toolchain.feature:
+      if feature.name == "default_link_flags":
+        del feature.flag_set[-1]
+    result = validate_migration(
+        toolchain, migrated_toolchain, variable_sets=VARIABLE_SETS)
+    self.assertFalse(result.passed)
+    self.assertEqual(
+        set((d.action, d.variables) for d in result.differences),
+        set([("c++-link-executable", "test"),
+             ("c++-link-dynamic-library", "test"),
+             ("c++-link-nodeps-dynamic-library", "test")]))
+    self.assertEqual(result.differences[0].before[-1], "-test-only")
+    self.assertEqual(
+        format_validation_result(result),
+        "FAIL legacy: 3 actions differ in 12 configurations: "
+        "c++-link-dynamic-library, c++-link-executable, "
+        "c++-link-nodeps-dynamic-library")
+
+  def test_action_config_flags_precede_legacy_flags(self):
+    toolchain = make_toolchain("""
+        toolchain_identifier: 'legacy'
+        compiler_flag: '-legacy'
+        action_config {
+          config_name: 'c-compile'
+          action_name: 'c-compile'
+          flag_set { flag_group { flag: '-ac' } }
+        }
+    """)
+    configurations = [("opt", ["opt"])]
+    variable_sets = [("none", {})]
+    expander = bazel_expander(toolchain, legacy_fields=True)
+    enabled, _ = expander.solve(["opt"])
+    self.assertEqual(
+        expander.expand("c-compile", ["opt"], enabled, "none", {})[0],
+        ["-ac", "-legacy"])
+    self.assertTrue(
+        validate_migration(toolchain, None, configurations,
+                           variable_sets).passed)
+    # The action config flag moved after the migrated legacy flags.
+    migrated_toolchain = crosstool_config_pb2.CToolchain()
+    migrated_toolchain.CopyFrom(toolchain)
+    migrate_toolchain(migrated_toolchain)
+    del migrated_toolchain.action_config[0].flag_set[:]
+    for feature in migrated_toolchain.feature:
+      if feature.name == "default_compile_flags":
+        text_format.Merge(
+            "action: 'c-compile' flag_group { flag: '-ac' }",
+            feature.flag_set.add())
+    differences = validate_migration(toolchain, migrated_toolchain,
+                                     configurations, variable_sets).differences
+    self.assertEqual([(d.action, d.before, d.after) for d in differences],
+                     [("c-compile", ["-ac", "-legacy"], ["-legacy", "-ac"])])
+
+  def test_reports_toolchains_that_cant_be_expanded(self):
+    result = validate_migration(
+        make_toolchain("""
+            toolchain_identifier: 'a'
+            feature { name: 'user' enabled: true implies: 'foo' }
+        """))
+    self.assertFalse(result.passed)
+    self.assertEqual(result.differences, [])
+    self.assertEqual(
+        format_validation_result(result),
+        "ERROR a: feature foo, which is referenced from user, is not defined")
+    result = validate_migration(
+        make_toolchain("""
+            toolchain_identifier: 'b'
+            feature { name: 'f' }
+            feature { name: 'f' }
+        """))
+    self.assertFalse(result.passed)
+    self.assertTrue(
+        format_validation_result(result).startswith("ERROR b: "))
+
+  def test_legacy_variables(self):
+    toolchain = make_toolchain(LEGACY_TOOLCHAIN)
+    self.assertEqual(
+        legacy_variables(toolchain, "c++-compile", ["opt"], frozenset(), {}), {
+            "legacy_compile_flags": [
+                "-compiler-flag", "-opt-compiler-flag", "-cxx-flag",
+                "-opt-cxx-flag"
+            ],
+            "unfiltered_compile_flags": ["-unfiltered"],
+        })
+    self.assertEqual(
+        legacy_variables(toolchain, "c-compile", ["dbg"], frozenset(),
+                         {})["legacy_compile_flags"], ["-compiler-flag"])
+
+    def link_flags(action, requested, enabled_names=frozenset(),
+                   variables=None):
+      return legacy_variables(toolchain, action, requested, enabled_names,
+                              variables or {})["legacy_link_flags"]
+
+    self.assertEqual(
+        link_flags("c++-link-executable", ["opt", "dynamic_linking_mode"]),
+        ["-linker-flag", "-opt-linker-flag", "-dynamic"])
+    self.assertEqual(
+        link_flags("c++-link-executable", ["static_linking_mode"]),
+        ["-linker-flag", "-mostly-static"])
+    self.assertEqual(
+        link_flags("c++-link-dynamic-library", ["static_linking_mode"]),
+        ["-linker-flag", "-dynamic", "-dynamic-library"])
+    self.assertEqual(
+        link_flags("c++-link-dynamic-library", ["fully_static_link"],
+                   frozenset(["static_link_cpp_runtimes"])),
+        ["-linker-flag", "-fully-static", "-dynamic-library"])
+    self.assertEqual(
+        link_flags("c++-link-nodeps-dynamic-library",
+                   ["static_linking_mode_nodeps_library"],
+                   frozenset(["static_link_cpp_runtimes"]),
+                   {"is_cc_test": ""}), [
+                       "-linker-flag", "-dynamic", "-mostly-static-libraries",
+                       "-dynamic-library", "-test-only"
+                   ])
+    self.assertEqual(
+        legacy_variables(toolchain, "objcopy_embed_data", [], frozenset(), {}),
+        {"objcopy_embed_flags": ["-objcopy"]})
+    self.assertEqual(
+        legacy_variables(toolchain, "strip", [], frozenset(), {}), {})
+
+  def test_with_bazel_legacy_features(self):
+    toolchain = make_toolchain("""
+        feature { name: 'a' }
+        feature { name: 'sysroot' }
+    """)
+    features = with_bazel_legacy_features(toolchain).feature
+    self.assertEqual([feature.name for feature in features], [
+        "legacy_compile_flags", "legacy_link_flags", "a", "sysroot",
+        "per_object_debug_info", "user_compile_flags",
+        "unfiltered_compile_flags", "objcopy_embed_flags", "ld_embed_flags"
+    ])
+    self.assertEqual(len(toolchain.feature), 2)
+    toolchain = make_toolchain("feature { name: 'no_legacy_features' }")
+    self.assertEqual(with_bazel_legacy_features(toolchain), toolchain)
+
+  def test_format(self):
+    results = [
+        ValidationResult("a", [], None),
+        validate_migration(
+            make_toolchain(LEGACY_TOOLCHAIN),
+            make_toolchain("toolchain_identifier: 'legacy'")),
+        ValidationResult("b", [], "invalid"),
+    ]
+    self.assertEqual(format_validation_result(results[0]), "PASS a")
+    self.assertTrue(format_validation_result(results[1]).startswith(
+        "FAIL legacy: "))
+    self.assertEqual(format_validation_result(results[2]), "ERROR b: invalid")
+    self.assertEqual(
+        format_validation_summary(results),
+        "Validated 3 toolchains, 1 passed, 1 failed, 1 errors.")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,382 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing diff_expanded_ctoolchains function.
+
+diff_expanded_ctoolchains compares what two CToolchains pass to the actions
+instead of how they are written: every action is expanded for every
+configuration of requested features and every set of build variables of a
+matrix, and only actions whose flags or environment differ are reported.
+Reordered features or restructured flag groups that expand to the same flags,
+as produced by legacy_fields_migration_lib, are not differences.
+
+The expansions of every feature are memoized per set of enabled features they
+depend on, so configurations that only differ in unrelated features reuse
+them.
+"""
+
+import collections
+import json
+from tools.migration.flag_expansion_lib import compile_expansion_plan
+from tools.migration.legacy_fields_migration_lib import LINKING_MODE_TO_FEATURE_NAME
+
+try:
+  # Python 2
+  _STRING_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+  # Python 3
+  _STRING_TYPES = (str,)
+
+FLAGS = "flags"
+ENV = "env"
+FEATURES = "features"
+
+COMPILATION_MODE_FEATURES = ["dbg", "fastbuild", "opt"]
+LINKING_MODE_FEATURES = sorted(LINKING_MODE_TO_FEATURE_NAME.values())
+
+
+def mode_configurations(compilation_modes=None, linking_modes=None):
+  """Returns (name, requested features) tuples of all mode combinations.
+
+  Every configuration requests one compilation mode feature and one linking
+  mode feature, it is named by both joined with a comma, e.g.
+  "opt,fully_static_link".
+  """
+  configurations = []
+  for compilation_mode in compilation_modes or COMPILATION_MODE_FEATURES:
+    for linking_mode in linking_modes or LINKING_MODE_FEATURES:
+      configurations.append(("%s,%s" % (compilation_mode, linking_mode),
+                             [compilation_mode, linking_mode]))
+  return configurations
+
+
+DEFAULT_CONFIGURATIONS = mode_configurations()
+
+# Build variables commonly set by Bazel, "none" expands only the flags that
+# don't depend on any variable.
+DEFAULT_VARIABLE_SETS = [
+    ("none", {}),
+    ("default", {
+        "source_file": "pkg/source.cc",
+        "output_file": "pkg/source.o",
+        "output_execpath": "pkg/binary",
+        "include_paths": ["pkg/include"],
+        "quote_include_paths": ["."],
+        "system_include_paths": ["/usr/include"],
+        "preprocessor_defines": ["DEFINE"],
+        "user_compile_flags": ["-user_compile_flag"],
+        "unfiltered_compile_flags": ["-unfiltered_compile_flag"],
+        "user_link_flags": ["-user_link_flag"],
+        "library_search_directories": ["pkg/lib"],
+        "runtime_library_search_directories": ["pkg/lib"],
+        "linker_param_file": "pkg/binary-2.params",
+        "sysroot": "/sysroot",
+        "is_using_fission": "",
+    }),
+]
+
+
+class SemanticDifference(
+    collections.namedtuple(
+        "SemanticDifference",
+        ["action", "configuration", "variables", "kind", "before", "after"])):
+  """A difference between the expansions of an action of two CToolchains.
+
+  configuration and variables are the names of the feature configuration and
+  the variable set of the matrix, kind is FLAGS or ENV. before and after are
+  the list of flags or of (key, value) environment tuples, or the message of
+  the error the expansion raised. When resolving the features of the
+  configuration fails for only one of the toolchains, or differently, kind is
+  FEATURES, action and variables are None and before and after are the list of
+  enabled feature names or the error message. When a toolchain is invalid,
+  e.g. defines a feature twice, configuration is None as well and before and
+  after are the error messages, None for a valid toolchain.
+  """
+  __slots__ = ()
+
+
+def parse_matrix(text):
+  """Returns the (configurations, variable sets) of a JSON matrix.
+
+  The matrix is a JSON object with an optional "configurations" object mapping
+  names to lists of requested features and an optional "variables" object
+  mapping names to objects of build variables. Missing entries default to
+  DEFAULT_CONFIGURATIONS and DEFAULT_VARIABLE_SETS. Both are returned as lists
+  of (name, value) tuples in the order of the file. Raises ValueError when the
+  matrix is malformed.
+  """
+  matrix = json.loads(text, object_pairs_hook=collections.OrderedDict)
+  if not isinstance(matrix, dict):
+    raise ValueError("Matrix must be a JSON object")
+  unknown_keys = sorted(set(matrix) - set(["configurations", "variables"]))
+  if unknown_keys:
+    raise ValueError("Unknown matrix keys: %s" % ", ".join(unknown_keys))
+  configurations = DEFAULT_CONFIGURATIONS
+  if "configurations" in matrix:
+    configurations = list(_matrix_entries(matrix, "configurations", list))
+    for name, features in configurations:
+      if not all(isinstance(feature, _STRING_TYPES) for feature in features):
+        raise ValueError(
+            "Features of configuration '%s' must be strings" % name)
+  variable_sets = DEFAULT_VARIABLE_SETS
+  if "variables" in matrix:
+    variable_sets = list(_matrix_entries(matrix, "variables", dict))
+  return configurations, variable_sets
+
+
+def parse_variable_sets(text):
+  """Returns the (name, variables) tuples of a JSON object of variable sets.
+
+  The object has the format of the "variables" of a matrix, see parse_matrix.
+  Raises ValueError when it is malformed.
+  """
+  variable_sets = json.loads(text, object_pairs_hook=collections.OrderedDict)
+  return list(_matrix_entries({"variables": variable_sets}, "variables", dict))
+
+
+def _matrix_entries(matrix, key, value_type):
+  entries = matrix[key]
+  if not isinstance(entries, dict) or not entries:
+    raise ValueError("Matrix '%s' must be a non-empty JSON object" % key)
+  for name, value in entries.items():
+    if not isinstance(value, value_type):
+      raise ValueError("Matrix %s '%s' must be a JSON %s" %
+                       (key, name, "array" if value_type is list else "object"))
+    yield name, value
+
+
+class ToolchainExpander(object):
+  """Expands the actions of a toolchain, memoizing the expansions.
+
+  Every configuration requests its features, all action configs of the
+  toolchain and the requested features passed here. action_variables is an
+  optional function called with the action, the requested features, the
+  frozenset of enabled names and the variables; it returns a dict of variables
+  overriding those of the variable set for the action, whose values must be
+  strings or lists of strings. Raises ValueError when the toolchain is invalid,
+  e.g. defines a feature twice.
+
+  caches is an optional dict shared by the expanders of multiple toolchains,
+  so that features and action configs they have in common are expanded once.
+  Shared expanders must be used with the same variable sets.
+  """
+
+  def __init__(self, toolchain, requested=(), action_variables=None,
+               caches=None):
+    self._plan = compile_expansion_plan(
+        toolchain, shared_cache_keys=caches is not None)
+    self._requested = list(requested) + [
+        action_config.config_name for action_config in toolchain.action_config
+    ]
+    self._action_variables = action_variables
+    # The expansions are only memoized for the same variables, so there is a
+    # cache for every variable set and combination of action variables.
+    self._caches = {} if caches is None else caches
+    self._enabled_names = {}
+
+  def actions(self):
+    """Returns the sorted names of the actions the toolchain expands."""
+    return self._plan.actions()
+
+  def solve(self, requested):
+    """Returns the enabled bitset and None, or None and the error message."""
+    try:
+      return self._plan.solver.solve(list(requested) + self._requested), None
+    except ValueError as e:
+      return None, str(e)
+
+  def names(self, enabled):
+    """Returns the names in the enabled bitset."""
+    return self._plan.solver.names(enabled)
+
+  def expand(self, action, requested, enabled, variable_set, variables):
+    """Returns the flags and the environment of the action.
+
+    The environment is a list of (key, value) tuples, either is replaced by
+    the message of the error its expansion raised. Like in Bazel, the flags of
+    the action config of the action precede those of the features, see
+    ExpansionPlan.command_line.
+    """
+    cache_key = variable_set
+    if self._action_variables:
+      enabled_names = self._enabled_names.get(enabled)
+      if enabled_names is None:
+        enabled_names = frozenset(self.names(enabled))
+        self._enabled_names[enabled] = enabled_names
+      overrides = self._action_variables(action, requested, enabled_names,
+                                         variables)
+      if overrides:
+        cache_key = (variable_set,
+                     tuple((name, _freeze(value))
+                           for name, value in sorted(overrides.items())))
+        variables = dict(variables)
+        variables.update(overrides)
+    cache = self._caches.get(cache_key)
+    if cache is None:
+      cache = self._caches[cache_key] = {}
+    return (_expand(self._plan.command_line, action, enabled, variables, cache),
+            _expand(self._plan.environment, action, enabled, variables, cache))
+
+
+def diff_expanded_ctoolchains(toolchain_before,
+                              toolchain_after,
+                              configurations=None,
+                              variable_sets=None):
+  """Returns the SemanticDifferences of the expanded actions of the toolchains.
+
+  Every configuration requests its features and all action configs of a
+  toolchain, then every action having flag sets or env sets in either
+  toolchain is expanded with every variable set.
+  """
+  return diff_expansions(lambda: ToolchainExpander(toolchain_before),
+                         lambda: ToolchainExpander(toolchain_after),
+                         configurations, variable_sets)
+
+
+def diff_expansions(make_expander_before,
+                    make_expander_after,
+                    configurations=None,
+                    variable_sets=None):
+  """Returns the SemanticDifferences of the actions of two ToolchainExpanders.
+
+  The expanders are returned by the make_expander functions. Errors raised by
+  creating an expander for an invalid toolchain, resolving the features or
+  expanding an action are compared by their message.
+  """
+  configurations = configurations or DEFAULT_CONFIGURATIONS
+  variable_sets = variable_sets or DEFAULT_VARIABLE_SETS
+  expanders = []
+  errors = []
+  for make_expander in [make_expander_before, make_expander_after]:
+    try:
+      expanders.append(make_expander())
+      errors.append(None)
+    except ValueError as e:
+      errors.append(str(e))
+  if errors[0] != errors[1]:
+    return [
+        SemanticDifference(None, None, None, FEATURES, errors[0], errors[1])
+    ]
+  if errors[0]:
+    return []
+  actions = sorted(set(expanders[0].actions()) | set(expanders[1].actions()))
+  differences = []
+  for configuration, requested in configurations:
+    (enabled_before, error_before), (enabled_after, error_after) = [
+        expander.solve(requested) for expander in expanders
+    ]
+    if error_before or error_after:
+      if error_before != error_after:
+        differences.append(
+            SemanticDifference(
+                None, configuration, None, FEATURES, error_before or
+                expanders[0].names(enabled_before), error_after or
+                expanders[1].names(enabled_after)))
+      continue
+    for action in actions:
+      for variable_set, variables in variable_sets:
+        flags_before, env_before = expanders[0].expand(
+            action, requested, enabled_before, variable_set, variables)
+        flags_after, env_after = expanders[1].expand(
+            action, requested, enabled_after, variable_set, variables)
+        if flags_before != flags_after:
+          differences.append(
+              SemanticDifference(action, configuration, variable_set, FLAGS,
+                                 flags_before, flags_after))
+        if env_before != env_after:
+          differences.append(
+              SemanticDifference(action, configuration, variable_set, ENV,
+                                 env_before, env_after))
+  return differences
+
+
+def _expand(expand_function, action, enabled, variables, cache):
+  """Returns the expansion as a list, or the message of the error it raised."""
+  try:
+    expansion = expand_function(action, enabled, variables, cache)
+  except ValueError as e:
+    return str(e)
+  if isinstance(expansion, dict):
+    return list(expansion.items())
+  return expansion
+
+
+def has_semantic_difference(differences):
+  """Returns whether there are any SemanticDifferences."""
+  return bool(differences)
+
+
+def _expansion_to_string(kind, expansion):
+  if expansion is None:
+    return "\tNo error"
+  if isinstance(expansion, _STRING_TYPES):
+    return "\tError: %s" % expansion
+  if kind == ENV:
+    expansion = ["%s=%s" % entry for entry in expansion]
+  if not expansion:
+    return "\t[]"
+  return "\n".join("\t" + element for element in expansion)
+
+
+def format_semantic_differences(differences):
+  """Returns the human-readable text describing the SemanticDifferences.
+
+  Differences that are the same in multiple configurations and variable sets
+  are printed once, listing all of them.
+  """
+  grouped = collections.OrderedDict()
+  for difference in differences:
+    key = (difference.action, difference.kind, _freeze(difference.before),
+           _freeze(difference.after))
+    grouped.setdefault(key, (difference, []))[1].append(
+        (difference.configuration, difference.variables))
+  lines = []
+  for difference, matrix_entries in grouped.values():
+    if difference.configuration is None:
+      lines.append("Difference in compiling the toolchains:")
+    elif difference.kind == FEATURES:
+      lines.append("Difference in the enabled features of configurations "
+                   "%s:" % ", ".join(
+                       "'%s'" % configuration
+                       for configuration, _ in matrix_entries))
+    else:
+      lines.append(
+          "Difference in %s of action '%s' with configurations and variables "
+          "%s:" % (difference.kind, difference.action, ", ".join(
+              "'%s'/'%s'" % entry for entry in matrix_entries)))
+    lines.append("Before change:")
+    lines.append(_expansion_to_string(difference.kind, difference.before))
+    lines.append("After change:")
+    lines.append(_expansion_to_string(difference.kind, difference.after))
+    lines.append("")
+  if not differences:
+    lines.append("No difference")
+  return "\n".join(lines)
+
+
+def _freeze(expansion):
+  if isinstance(expansion, list):
+    return tuple(expansion)
+  return expansion
+
+
+def semantic_difference_to_json(difference):
+  """Returns the SemanticDifference as a JSON-serializable dict."""
+  return {
+      "action": difference.action,
+      "configuration": difference.configuration,
+      "variables": difference.variables,
+      "kind": difference.kind,
+      "before": difference.before,
+      "after": difference.after,
+  }
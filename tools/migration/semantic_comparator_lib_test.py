@@ -0,0 +1,273 @@
+import unittest
+from google.protobuf import text_format
+from third_party.com.github.bazelbuild.bazel.src.main.protobuf import crosstool_config_pb2
+from tools.migration.semantic_comparator_lib import DEFAULT_CONFIGURATIONS
+from tools.migration.semantic_comparator_lib import DEFAULT_VARIABLE_SETS
+from tools.migration.semantic_comparator_lib import ENV
+from tools.migration.semantic_comparator_lib import FEATURES
+from tools.migration.semantic_comparator_lib import FLAGS
+from tools.migration.semantic_comparator_lib import diff_expanded_ctoolchains
+from tools.migration.semantic_comparator_lib import format_semantic_differences
+from tools.migration.semantic_comparator_lib import mode_configurations
+from tools.migration.semantic_comparator_lib import parse_matrix
+from tools.migration.semantic_comparator_lib import parse_variable_sets
+from tools.migration.semantic_comparator_lib import semantic_difference_to_json
+
+
+def make_toolchain(toolchain_proto):
+  toolchain = crosstool_config_pb2.CToolchain()
+  text_format.Merge(toolchain_proto, toolchain)
+  return toolchain
+
+
+def diff(before_proto, after_proto, configurations=None, variable_sets=None):
+  return diff_expanded_ctoolchains(
+      make_toolchain(before_proto), make_toolchain(after_proto),
+      configurations, variable_sets)
+
+
+class SemanticComparatorLibTest(unittest.TestCase):
+
+  def test_restructured_flags_are_no_difference(self):
+    before = """
+        feature { name: 'opt' }
+        feature {
+          name: 'default_compile_flags'
+          enabled: true
+          flag_set {
+            action: 'c-compile'
+            flag_group { flag: '-a' }
+          }
+          flag_set {
+            action: 'c-compile'
+            with_feature { feature: 'opt' }
+            flag_group {
+              expand_if_all_available: 'sysroot'
+              flag: '--sysroot=%{sysroot}'
+            }
+          }
+        }
+    """
+    after = """
+        feature {
+          name: 'default_compile_flags'
+          enabled: true
+          flag_set {
+            action: 'c-compile'
+            flag_group { flag_group { flag: '-a' } }
+          }
+          flag_set {
+            action: 'c-compile'
+            with_feature { feature: 'opt' }
+            flag_group {
+              expand_if_all_available: 'sysroot'
+              flag_group { flag: '--sysroot=%{sysroot}' }
+            }
+          }
+        }
+        feature { name: 'opt' }
+    """
+    differences = diff(before, after)
+    self.assertEqual(differences, [])
+    self.assertEqual(format_semantic_differences(differences), "No difference")
+
+  def test_flag_difference(self):
+    before = """
+        feature { name: 'dbg' }
+        feature { name: 'opt' }
+        feature {
+          name: 'flags'
+          enabled: true
+          flag_set {
+            action: 'c-compile'
+            with_feature { feature: 'opt' }
+            flag_group { flag: '-O2' }
+          }
+        }
+    """
+    after = before.replace("-O2", "-O3")
+    configurations = [("dbg", ["dbg"]), ("opt", ["opt"])]
+    variable_sets = [("none", {}), ("sysroot", {"sysroot": "/"})]
+    differences = diff(before, after, configurations, variable_sets)
+    self.assertEqual([(d.action, d.configuration, d.variables, d.kind)
+                      for d in differences],
+                     [("c-compile", "opt", "none", FLAGS),
+                      ("c-compile", "opt", "sysroot", FLAGS)])
+    self.assertEqual(differences[0].before, ["-O2"])
+    self.assertEqual(differences[0].after, ["-O3"])
+    self.assertEqual(
+        format_semantic_differences(differences), "\n".join([
+            "Difference in flags of action 'c-compile' with configurations "
+            "and variables 'opt'/'none', 'opt'/'sysroot':",
+            "Before change:",
+            "\t-O2",
+            "After change:",
+            "\t-O3",
+            "",
+        ]))
+    self.assertEqual(
+        semantic_difference_to_json(differences[0]), {
+            "action": "c-compile",
+            "configuration": "opt",
+            "variables": "none",
+            "kind": FLAGS,
+            "before": ["-O2"],
+            "after": ["-O3"],
+        })
+
+  def test_action_configs_are_requested(self):
+    before = """
+        action_config {
+          config_name: 'c-compile'
+          action_name: 'c-compile'
+          flag_set { flag_group { flag: '-a' } }
+        }
+    """
+    after = """
+        action_config { config_name: 'c-compile' action_name: 'c-compile' }
+    """
+    differences = diff(before, after, [("none", [])], [("none", {})])
+    self.assertEqual(len(differences), 1)
+    self.assertEqual(differences[0].before, ["-a"])
+    self.assertEqual(differences[0].after, [])
+
+  def test_action_config_flags_precede_feature_flags(self):
+    before = """
+        feature {
+          name: 'f'
+          enabled: true
+          flag_set { action: 'c-compile' flag_group { flag: '-f' } }
+        }
+        action_config {
+          config_name: 'c-compile'
+          action_name: 'c-compile'
+          flag_set { flag_group { flag: '-ac' } }
+        }
+    """
+    moved_first = """
+        feature {
+          name: 'ac'
+          enabled: true
+          flag_set { action: 'c-compile' flag_group { flag: '-ac' } }
+        }
+        feature {
+          name: 'f'
+          enabled: true
+          flag_set { action: 'c-compile' flag_group { flag: '-f' } }
+        }
+        action_config { config_name: 'c-compile' action_name: 'c-compile' }
+    """
+    moved_last = """
+        feature {
+          name: 'f'
+          enabled: true
+          flag_set { action: 'c-compile' flag_group { flag: '-f' } }
+          flag_set { action: 'c-compile' flag_group { flag: '-ac' } }
+        }
+        action_config { config_name: 'c-compile' action_name: 'c-compile' }
+    """
+    matrix = ([("none", [])], [("none", {})])
+    self.assertEqual(diff(before, moved_first, *matrix), [])
+    differences = diff(before, moved_last, *matrix)
+    self.assertEqual([(d.action, d.before, d.after) for d in differences],
+                     [("c-compile", ["-ac", "-f"], ["-f", "-ac"])])
+
+  def test_env_difference(self):
+    before = """
+        feature {
+          name: 'env'
+          enabled: true
+          env_set {
+            action: 'c-compile'
+            env_entry { key: 'PATH' value: '/bin' }
+          }
+        }
+    """
+    after = before.replace("/bin", "/usr/bin")
+    differences = diff(before, after, [("none", [])], [("none", {})])
+    self.assertEqual([(d.kind, d.before, d.after) for d in differences],
+                     [(ENV, [("PATH", "/bin")], [("PATH", "/usr/bin")])])
+    self.assertIn("\tPATH=/bin\nAfter change:\n\tPATH=/usr/bin",
+                  format_semantic_differences(differences))
+
+  def test_expansion_errors(self):
+    before = """
+        feature {
+          name: 'flags'
+          enabled: true
+          flag_set {
+            action: 'c-compile'
+            flag_group { flag: '-I%{include}' }
+          }
+        }
+    """
+    differences = diff(before, before, [("none", [])], [("none", {})])
+    self.assertEqual(differences, [])
+    differences = diff(before, before.replace("-I%{include}", "-I"),
+                       [("none", [])], [("none", {})])
+    self.assertEqual(len(differences), 1)
+    self.assertIn("Cannot find variable named 'include'",
+                  differences[0].before)
+    self.assertIn("\tError: ", format_semantic_differences(differences))
+
+  def test_feature_resolution_difference(self):
+    before = """
+        feature { name: 'a' provides: 'symbol' enabled: true }
+        feature { name: 'b' provides: 'symbol' }
+    """
+    after = before.replace("provides: 'symbol' }", "}")
+    differences = diff(before, after, [("b", ["b"])])
+    self.assertEqual([(d.action, d.configuration, d.kind) for d in differences],
+                     [(None, "b", FEATURES)])
+    self.assertIn("Symbol symbol is provided", differences[0].before)
+    self.assertEqual(differences[0].after, ["a", "b"])
+    self.assertIn("Difference in the enabled features of configurations 'b':",
+                  format_semantic_differences(differences))
+
+  def test_invalid_toolchain(self):
+    invalid = "feature { name: 'a' } feature { name: 'a' }"
+    self.assertEqual(diff(invalid, invalid), [])
+    differences = diff("feature { name: 'a' }", invalid)
+    self.assertEqual([(d.configuration, d.kind, d.before) for d in differences],
+                     [(None, FEATURES, None)])
+    self.assertIn("specified multiple times", differences[0].after)
+    self.assertIn("Difference in compiling the toolchains:\nBefore change:\n"
+                  "\tNo error\n", format_semantic_differences(differences))
+
+  def test_mode_configurations(self):
+    self.assertEqual(
+        mode_configurations(["opt"], ["fully_static_link"]),
+        [("opt,fully_static_link", ["opt", "fully_static_link"])])
+    self.assertEqual(len(DEFAULT_CONFIGURATIONS), 12)
+    self.assertIn(("dbg,dynamic_linking_mode", ["dbg", "dynamic_linking_mode"]),
+                  DEFAULT_CONFIGURATIONS)
+
+  def test_parse_matrix(self):
+    self.assertEqual(
+        parse_matrix("{}"), (DEFAULT_CONFIGURATIONS, DEFAULT_VARIABLE_SETS))
+    configurations, variable_sets = parse_matrix("""{
+        "configurations": {"opt": ["opt"], "dbg": ["dbg", "pic"]},
+        "variables": {"sysroot": {"sysroot": "/"}}
+    }""")
+    self.assertEqual(configurations, [("opt", ["opt"]),
+                                      ("dbg", ["dbg", "pic"])])
+    self.assertEqual(variable_sets, [("sysroot", {"sysroot": "/"})])
+    for matrix in [
+        "[]", '{"unknown": {}}', '{"configurations": {}}',
+        '{"configurations": {"opt": "opt"}}',
+        '{"configurations": {"opt": [1]}}', '{"variables": {"none": []}}'
+    ]:
+      with self.assertRaises(ValueError):
+        parse_matrix(matrix)
+
+  def test_parse_variable_sets(self):
+    self.assertEqual(
+        parse_variable_sets('{"b": {"sysroot": "/"}, "a": {}}'),
+        [("b", {"sysroot": "/"}), ("a", {})])
+    for variable_sets in ["{}", "[]", '{"a": []}']:
+      with self.assertRaises(ValueError):
+        parse_variable_sets(variable_sets)
+
+
+if __name__ == "__main__":
+  unittest.main()
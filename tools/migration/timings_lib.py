@@ -0,0 +1,188 @@
+# Copyright 2018 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Module providing PhaseTimer class and run_profiled function.
+
+PhaseTimer measures the wall and CPU time the command line tools spend in each
+of their phases, e.g. reading, parsing, migrating and writing, together with
+the slowest items, e.g. toolchains, of every phase and the peak RSS.
+run_profiled runs a function under cProfile and writes the statistics to a
+file in the pstats format.
+"""
+
+import collections
+import cProfile
+import heapq
+import itertools
+import os
+import sys
+import timeit
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows.
+  resource = None
+
+
+def _cpu_time():
+  times = os.times()
+  return times[0] + times[1]
+
+
+class _Phase(object):
+  """Context manager adding the time spent in its body to a phase."""
+
+  def __init__(self, timer, name, item):
+    self._timer = timer
+    self._name = name
+    self._item = item
+
+  def __enter__(self):
+    self._wall = timeit.default_timer()
+    self._cpu = _cpu_time()
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    wall = timeit.default_timer() - self._wall
+    self._timer.add(self._name, wall, _cpu_time() - self._cpu)
+    if self._item is not None:
+      self._timer.record_item(self._name, self._item, wall)
+
+
+class _NullPhase(object):
+
+  def __enter__(self):
+    pass
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class PhaseTimer(object):
+  """Sums up the wall and CPU time spent in named phases.
+
+  A disabled timer measures nothing, so the tools can time their phases
+  unconditionally at no cost.
+  """
+
+  def __init__(self, enabled=True, top_n=10):
+    self.enabled = enabled
+    self._top_n = top_n
+    self._start_wall = timeit.default_timer()
+    self._start_cpu = _cpu_time()
+    # Maps phase names to [wall seconds, CPU seconds], in order of appearance.
+    self._phases = collections.OrderedDict()
+    # Maps phase names to min heaps of the (seconds, sequence, item) tuples of
+    # the slowest items.
+    self._slowest_items = {}
+    self._sequence = itertools.count()
+
+  def phase(self, name, item=None):
+    """Returns a context manager timing its body as part of the phase.
+
+    When item is given, the wall time of the body is recorded as the time of
+    that item, see record_item.
+    """
+    if not self.enabled:
+      return _NULL_PHASE
+    return _Phase(self, name, item)
+
+  def iterate(self, name, iterable):
+    """Yields the elements of iterable, timing the iteration as the phase."""
+    if not self.enabled:
+      return iterable
+    return self._iterate(name, iter(iterable))
+
+  def _iterate(self, name, iterator):
+    while True:
+      with self.phase(name):
+        try:
+          element = next(iterator)
+        except StopIteration:
+          return
+      yield element
+
+  def add(self, name, wall_seconds, cpu_seconds):
+    """Adds the wall and CPU time to the phase."""
+    if not self.enabled:
+      return
+    times = self._phases.setdefault(name, [0.0, 0.0])
+    times[0] += wall_seconds
+    times[1] += cpu_seconds
+
+  def record_item(self, name, item, seconds):
+    """Records the time spent on an item in the phase, keeping the slowest."""
+    if not self.enabled:
+      return
+    heap = self._slowest_items.setdefault(name, [])
+    entry = (seconds, next(self._sequence), item)
+    if len(heap) < self._top_n:
+      heapq.heappush(heap, entry)
+    elif heap and entry > heap[0]:
+      heapq.heapreplace(heap, entry)
+
+  def report(self, out=None):
+    """Writes the times of all phases, the peak RSS and the slowest items.
+
+    The report is written to stderr unless another file is given.
+    """
+    if not self.enabled:
+      return
+    out = out or sys.stderr
+    out.write("%-20s %12s %12s\n" % ("phase", "wall ms", "cpu ms"))
+    for name, (wall, cpu) in self._phases.items():
+      out.write("%-20s %12.1f %12.1f\n" % (name, wall * 1e3, cpu * 1e3))
+    out.write("%-20s %12.1f %12.1f\n" %
+              ("total", (timeit.default_timer() - self._start_wall) * 1e3,
+               (_cpu_time() - self._start_cpu) * 1e3))
+    peak_rss = _peak_rss_bytes()
+    if peak_rss is not None:
+      out.write("peak RSS %.1f MB" % (peak_rss[0] / 1048576.0))
+      if peak_rss[1]:
+        out.write(", worker processes %.1f MB" % (peak_rss[1] / 1048576.0))
+      out.write("\n")
+    for name in self._phases:
+      heap = self._slowest_items.get(name)
+      if not heap:
+        continue
+      out.write("slowest %s:\n" % name)
+      for seconds, _, item in sorted(heap, reverse=True):
+        out.write("%12.3f ms  %s\n" % (seconds * 1e3, item))
+
+
+def _peak_rss_bytes():
+  """Returns the peak RSS of this process and of its children in bytes."""
+  if resource is None:
+    return None
+  # ru_maxrss is in bytes on macOS, but in kilobytes elsewhere.
+  unit = 1 if sys.platform == "darwin" else 1024
+  return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+
+def run_profiled(profile_path, function, *args):
+  """Calls function, profiling it with cProfile when profile_path is set.
+
+  The statistics are written to profile_path in the pstats format even when
+  function raises, e.g. SystemExit. Only the calling process is profiled.
+  """
+  if not profile_path:
+    return function(*args)
+  profile = cProfile.Profile()
+  try:
+    return profile.runcall(function, *args)
+  finally:
+    profile.dump_stats(profile_path)
@@ -0,0 +1,96 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+from tools.migration.timings_lib import PhaseTimer
+from tools.migration.timings_lib import run_profiled
+
+try:
+  # Python 2
+  from cStringIO import StringIO
+except ImportError:
+  # Python 3
+  from io import StringIO
+
+
+def report(timer):
+  out = StringIO()
+  timer.report(out)
+  return out.getvalue()
+
+
+class TimingsLibTest(unittest.TestCase):
+
+  def test_sums_phases(self):
+    timer = PhaseTimer()
+    timer.add("parse", 1.0, 0.5)
+    timer.add("migrate", 2.0, 1.5)
+    timer.add("parse", 3.0, 2.5)
+    with timer.phase("write"):
+      pass
+    lines = report(timer).splitlines()
+    self.assertEqual(lines[0].split(), ["phase", "wall", "ms", "cpu", "ms"])
+    self.assertEqual(lines[1].split(), ["parse", "4000.0", "3000.0"])
+    self.assertEqual(lines[2].split(), ["migrate", "2000.0", "1500.0"])
+    self.assertEqual(lines[3].split()[0], "write")
+    self.assertEqual(lines[4].split()[0], "total")
+
+  def test_iterate(self):
+    timer = PhaseTimer()
+    self.assertEqual(list(timer.iterate("parse", [1, 2, 3])), [1, 2, 3])
+    self.assertIn("\nparse ", report(timer))
+
+  def test_records_slowest_items(self):
+    timer = PhaseTimer(top_n=2)
+    timer.add("migrate", 0.0, 0.0)
+    timer.record_item("migrate", "fast", 0.001)
+    timer.record_item("migrate", "slowest", 0.003)
+    timer.record_item("migrate", "slow", 0.002)
+    output = report(timer)
+    self.assertIn("slowest migrate:\n", output)
+    slowest = output.split("slowest migrate:\n")[1].splitlines()
+    self.assertEqual([line.split()[-1] for line in slowest],
+                     ["slowest", "slow"])
+
+  def test_phase_records_item(self):
+    timer = PhaseTimer()
+    with timer.phase("compare", item="toolchain-1"):
+      pass
+    self.assertIn("slowest compare:\n", report(timer))
+    self.assertIn("toolchain-1", report(timer))
+
+  def test_disabled_timer(self):
+    timer = PhaseTimer(enabled=False)
+    with timer.phase("parse", item="crosstool"):
+      pass
+    iterable = [1, 2]
+    self.assertIs(timer.iterate("parse", iterable), iterable)
+    timer.add("parse", 1.0, 1.0)
+    timer.record_item("parse", "crosstool", 1.0)
+    self.assertEqual(report(timer), "")
+
+  def test_run_profiled(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      profile_path = os.path.join(tmpdir, "profile")
+      self.assertEqual(run_profiled(None, sorted, [2, 1]), [1, 2])
+      self.assertFalse(os.path.exists(profile_path))
+      self.assertEqual(run_profiled(profile_path, sorted, [2, 1]), [1, 2])
+      self.assertTrue(pstats.Stats(profile_path).total_calls > 0)
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def test_run_profiled_writes_profile_on_exit(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      profile_path = os.path.join(tmpdir, "profile")
+      with self.assertRaises(SystemExit):
+        run_profiled(profile_path, exit, 1)
+      pstats.Stats(profile_path)
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+  unittest.main()